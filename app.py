@@ -1,29 +1,53 @@
 import os
 from flask import Flask
 from models import db
+from storage import configure_storage, create_schema, dispose_engines, init_storage, init_schema
 
 # create the app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "bubble_sheet_scanner_secret")
 
-# configure the database using SQLite
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///app.db"
+# configure the database (SQLite by default, override with DATABASE_URL)
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///app.db")
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max upload size
+# Scanner debug images: off, sampled or full
+app.config['DEBUG_ARTIFACTS'] = os.environ.get('DEBUG_ARTIFACTS', 'off')
+app.config['DEBUG_ARTIFACT_SAMPLE_RATE'] = float(os.environ.get('DEBUG_ARTIFACT_SAMPLE_RATE', '0.05'))
+# Identical resubmissions: reuse the earlier result as is, or copy it into a new ScanResult
+app.config['REUSE_ATTACH_NEW_RESULT'] = os.environ.get('REUSE_ATTACH_NEW_RESULT', '').lower() in ('1', 'true', 'yes')
+# Warm each worker (scanner, OCR, templates, roster) before it takes traffic; see warmup.py
+app.config['WARMUP'] = os.environ.get('WARMUP', 'true').lower() in ('1', 'true', 'yes')
+# Create missing tables on the first request; with this off, run `flask init-db` at deploy time
+app.config['SCHEMA_AUTO_CREATE'] = os.environ.get('SCHEMA_AUTO_CREATE', 'true').lower() in ('1', 'true', 'yes')
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 # initialize the app with the extension
+configure_storage(app)
 db.init_app(app)
+init_storage(app, db)
+# `flask init-db`, plus schema creation on the first request
+init_schema(app, db)
 
 # Set the demo mode flag
 DEMO_MODE = True
 
-with app.app_context():
-    db.create_all()
-
 # Import routes after app is initialized to avoid circular imports
 from routes import *
 
+def create_app():
+    """
+    The app for production servers (see gunicorn.conf.py). Meant to run once in
+    the master before workers fork: creates the schema there, imports the
+    scanner stack so forked workers share it, and drops the master's database
+    connections so no worker inherits them.
+    """
+    create_schema(app, db)
+    if app.config['WARMUP']:
+        get_scanner()
+    dispose_engines(app, db)
+    return app
+
 def init_db():
     """Initialize database tables"""
     with app.app_context():
@@ -0,0 +1,404 @@
+"""
+Background batch grading with live progress.
+
+A batch is a BatchJob with one BatchItem per file. Submitting a file only
+stores it (see upload_store.py) and queues an item; grading threads claim
+queued items from the database, grade them and record the outcome on the
+item. Because the queue lives in the database, any worker's threads can
+grade any batch, a batch survives the request that submitted it, and items
+left half-graded by a worker that died are picked up again after
+BATCH_STALL_SECONDS.
+
+Progress is pushed to the browser as Server-Sent Events from
+/batch-jobs/<id>/events: one 'item' event per status change (queued,
+grading, done, error, with the score when done), a 'progress' summary, and
+'complete' once the job is closed and every item has finished. The stream
+polls the database, so it works whichever worker does the grading.
+
+JSON API (all under /batch-jobs):
+
+    POST /batch-jobs                    {template, quiz_id (optional)} -> job
+    POST /batch-jobs/<id>/files         multipart files[] (sheets or ZIP archives) -> queued items
+    POST /batch-jobs/<id>/uploads       large files in resumable chunks (see chunked_upload.py)
+    POST /batch-jobs/<id>/close         no more files will be added
+    GET  /batch-jobs/<id>               job summary and items
+    GET  /batch-jobs/<id>/events        the SSE progress stream
+"""
+import json
+import os
+import threading
+import time
+import traceback
+import zipfile
+from datetime import datetime, timedelta
+
+from flask import Response, jsonify, request, stream_with_context
+from werkzeug.utils import secure_filename
+
+from metrics import QUEUE_DEPTH
+from models import db, BatchJob, BatchItem, BatchUpload, Quiz
+from storage import write_transaction
+from upload_store import store_upload
+
+BATCH_DEFAULTS = {
+    'BATCH_WORKERS': 2,              # grading threads per process, 0 = this process never grades
+    'BATCH_POLL_INTERVAL': 1.0,      # seconds between queue polls when idle, and between stream polls
+    'BATCH_STALL_SECONDS': 300,      # an item 'grading' whose worker hasn't checked in for this long is requeued
+    'BATCH_STREAM_SECONDS': 300,     # streams end after this long; EventSource reconnects by itself
+    'BATCH_HEARTBEAT_SECONDS': 15,   # comment lines that keep idle streams open through proxies
+    'BATCH_ZIP_MAX_ENTRIES': 5000,   # sheets taken from one ZIP archive
+    'BATCH_ZIP_MAX_ENTRY_BYTES': 50 * 1024 * 1024,  # larger entries are skipped (and so are ZIP bombs)
+}
+
+FINISHED = ('done', 'error')
+BATCH_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf'}
+ARCHIVE_EXTENSIONS = {'zip'}
+
+_workers = []
+_workers_lock = threading.Lock()
+_wakeup = threading.Event()
+
+
+def batch_settings(app):
+    settings = {}
+    for key, default in BATCH_DEFAULTS.items():
+        value = app.config.get(key, os.environ.get(key, default))
+        settings[key] = type(default)(value)
+    return settings
+
+
+def create_job(template_name, quiz_id=None):
+    """Open a batch job; its sheets are graded against quiz_id's answer key when given."""
+    with write_transaction(db.session):
+        job = BatchJob(template_used=template_name, quiz_id=quiz_id, status='open')
+        db.session.add(job)
+    return job
+
+
+def add_item(job, filename, digest, file_path, extension):
+    """Queue a stored upload for grading as part of job. Returns the BatchItem."""
+    # The request has already read the job; a plain commit here would fail as
+    # soon as a grading thread wrote in between (see write_transaction)
+    with write_transaction(db.session):
+        item = BatchItem(job_id=job.id, filename=filename, content_hash=digest, file_path=file_path,
+                         extension=extension, status='queued', updated_at=datetime.utcnow())
+        db.session.add(item)
+    _wakeup.set()
+    return item
+
+
+def _extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+
+def submit_file(app, job, filename, stream):
+    """
+    Store an uploaded file and queue it on job; a ZIP archive queues each
+    sheet in it (see submit_archive). Returns the queued items (as item_dict),
+    empty when nothing in the upload can be graded.
+    """
+    filename = secure_filename(filename or '')
+    extension = _extension(filename)
+    if extension in ARCHIVE_EXTENSIONS:
+        return submit_archive(app, job, stream)
+    if extension not in BATCH_EXTENSIONS:
+        return []
+    digest, file_path = store_upload(stream, extension, app.config['UPLOAD_FOLDER'])
+    return [item_dict(add_item(job, filename, digest, file_path, extension))]
+
+
+def submit_archive(app, job, fileobj):
+    """
+    Queue every sheet in a ZIP archive on job, one entry at a time: each entry
+    is streamed into the upload store and queued before the next is read, so
+    grading starts at once and memory use doesn't grow with the archive.
+    fileobj must be seekable (a spooled upload or an open file).
+    Folders, hidden files and other file types are skipped. Returns the queued items (as item_dict).
+    """
+    settings = batch_settings(app)
+    items = []
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile as e:
+        print(f"Skipping unreadable ZIP archive for batch {job.id}: {e}")
+        return items
+    with archive:
+        # Reading the central directory costs memory per entry, not per byte
+        for info in archive.infolist():
+            name = info.filename.rsplit('/', 1)[-1]
+            extension = _extension(name)
+            if info.is_dir() or name.startswith('.') or '__MACOSX/' in info.filename:
+                continue
+            if extension not in BATCH_EXTENSIONS:
+                continue
+            if info.file_size > settings['BATCH_ZIP_MAX_ENTRY_BYTES']:
+                print(f"Skipping {info.filename} in batch {job.id}: {info.file_size} bytes")
+                continue
+            if len(items) >= settings['BATCH_ZIP_MAX_ENTRIES']:
+                print(f"Batch {job.id}: stopping after {len(items)} sheets from one archive")
+                break
+            try:
+                with archive.open(info) as entry:
+                    digest, file_path = store_upload(entry, extension, app.config['UPLOAD_FOLDER'])
+            except (zipfile.BadZipFile, NotImplementedError, RuntimeError) as e:
+                # Corrupt, encrypted or unsupported entries; keep going
+                print(f"Skipping {info.filename} in batch {job.id}: {e}")
+                continue
+            # Keep plain dicts: every commit expires each BatchItem still held in the session
+            items.append(item_dict(add_item(job, secure_filename(info.filename), digest, file_path, extension)))
+    return items
+
+
+def close_job(job):
+    """Mark the job's submission complete; it finishes once its items have."""
+    with write_transaction(db.session):
+        if job.status == 'open':
+            job.status = 'closed'
+            job.closed_at = datetime.utcnow()
+
+
+def job_summary(job):
+    """
+    Counts of the job's items by status and of chunked uploads still arriving
+    (see chunked_upload.py), plus whether the job is finished.
+    """
+    counts = dict(db.session.query(BatchItem.status, db.func.count(BatchItem.id))
+                  .filter(BatchItem.job_id == job.id).group_by(BatchItem.status).all())
+    uploading = BatchUpload.query.filter_by(job_id=job.id, completed_at=None).count()
+    total = sum(counts.values())
+    finished = sum(counts.get(status, 0) for status in FINISHED)
+    return {
+        'job_id': job.id,
+        'template': job.template_used,
+        'quiz_id': job.quiz_id,
+        'status': job.status,
+        'total': total,
+        'queued': counts.get('queued', 0),
+        'grading': counts.get('grading', 0),
+        'done': counts.get('done', 0),
+        'error': counts.get('error', 0),
+        'uploading': uploading,
+        'complete': job.status == 'closed' and not uploading and finished == total,
+    }
+
+
+def item_dict(item):
+    return {
+        'id': item.id,
+        'filename': item.filename,
+        'status': item.status,
+        'error': item.error,
+        'scan_id': item.scan_result_id,
+        'score': item.score,
+        'total': item.total_questions,
+        'percentage': item.percentage,
+    }
+
+
+def _claim_next(settings):
+    """
+    Take the oldest queued item (or a stalled one) for this process.
+    Returns (item id, job template, job quiz id) or None.
+    """
+    stalled_before = datetime.utcnow() - timedelta(seconds=settings['BATCH_STALL_SECONDS'])
+    with write_transaction(db.session):
+        query = (BatchItem.query
+                 .filter(db.or_(BatchItem.status == 'queued',
+                                db.and_(BatchItem.status == 'grading', BatchItem.updated_at < stalled_before)))
+                 .order_by(BatchItem.id))
+        if db.engine.dialect.name != 'sqlite':
+            # SQLite's BEGIN IMMEDIATE already lets one claim through at a time;
+            # elsewhere lock the row, passing over rows another worker is claiming
+            query = query.with_for_update(skip_locked=True)
+        item = query.first()
+        if item is None:
+            return None
+        if item.status == 'grading':
+            print(f"Requeueing stalled batch item {item.id} (was with {item.worker})")
+        item.status = 'grading'
+        item.worker = _worker_name()
+        item.updated_at = datetime.utcnow()
+        return item.id, item.job.template_used, item.job.quiz_id
+
+
+def _worker_name():
+    return f"{os.uname().nodename}:{os.getpid()}"
+
+
+def _keep_alive(app, item_id, interval, done):
+    """
+    Refresh updated_at on an item this process is grading every interval
+    seconds until done is set, so a long file isn't taken for stalled and
+    graded twice.
+    """
+    worker = _worker_name()
+    while not done.wait(interval):
+        try:
+            with app.app_context():
+                try:
+                    with write_transaction(db.session):
+                        (BatchItem.query.filter_by(id=item_id, status='grading', worker=worker)
+                         .update({'updated_at': datetime.utcnow()}, synchronize_session=False))
+                finally:
+                    db.session.remove()
+        except Exception as e:
+            print(f"Error refreshing batch item {item_id}: {e}")
+
+
+def _finish(item_id, **fields):
+    with write_transaction(db.session):
+        item = BatchItem.query.get(item_id)
+        for key, value in fields.items():
+            setattr(item, key, value)
+        item.updated_at = datetime.utcnow()
+
+
+def _grade_item(app, settings, grade, item_id, template_name, quiz_id):
+    item = BatchItem.query.get(item_id)
+    done = threading.Event()
+    threading.Thread(target=_keep_alive, args=(app, item_id, max(1.0, settings['BATCH_STALL_SECONDS'] / 3), done),
+                     name=f'batch-keepalive-{item_id}', daemon=True).start()
+    try:
+        scan_result, error, reused = grade(item.content_hash, item.file_path, item.extension, template_name, quiz_id)
+    except Exception as e:
+        print(f"Error grading batch item {item_id} ({item.filename}): {e}")
+        traceback.print_exc()
+        db.session.rollback()
+        scan_result, error = None, str(e)
+    finally:
+        done.set()
+    if error:
+        _finish(item_id, status='error', error=str(error)[:255])
+    else:
+        _finish(item_id, status='done', scan_result_id=scan_result.id, score=scan_result.score,
+                total_questions=scan_result.total_questions, percentage=scan_result.percentage)
+
+
+def _worker_loop(app, grade):
+    settings = batch_settings(app)
+    while True:
+        try:
+            with app.app_context():
+                try:
+                    claimed = _claim_next(settings)
+                    QUEUE_DEPTH.set(BatchItem.query.filter_by(status='queued').count(), queue='batch')
+                    if claimed:
+                        _grade_item(app, settings, grade, *claimed)
+                finally:
+                    db.session.remove()
+        except Exception as e:
+            print(f"Error in batch worker: {e}")
+            traceback.print_exc()
+            claimed = None
+        if not claimed:
+            _wakeup.wait(settings['BATCH_POLL_INTERVAL'])
+            _wakeup.clear()
+
+
+def start_batch_workers(app, grade):
+    """
+    Start this process's grading threads, once (and again after a fork).
+    grade(digest, file_path, extension, template, quiz_id) -> (scan_result, error, reused).
+    """
+    with _workers_lock:
+        _workers[:] = [thread for thread in _workers if thread.is_alive()]
+        count = batch_settings(app)['BATCH_WORKERS']
+        for i in range(len(_workers), count):
+            thread = threading.Thread(target=_worker_loop, args=(app, grade), name=f'batch-grader-{i}', daemon=True)
+            thread.start()
+            _workers.append(thread)
+
+
+def _event(name, data, event_id=None):
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {name}", f"data: {json.dumps(data)}"]
+    return '\n'.join(lines) + '\n\n'
+
+
+def progress_stream(app, job_id):
+    """Yield SSE messages for a job until it completes (or BATCH_STREAM_SECONDS pass)."""
+    settings = batch_settings(app)
+    sent = {}
+    last_summary = None
+    started = last_write = time.monotonic()
+    yield f"retry: {int(settings['BATCH_POLL_INTERVAL'] * 2000)}\n\n"
+    try:
+        while True:
+            job = BatchJob.query.get(job_id)
+            for item in BatchItem.query.filter_by(job_id=job_id).order_by(BatchItem.id):
+                state = (item.status, item.updated_at)
+                if sent.get(item.id) != state:
+                    sent[item.id] = state
+                    yield _event('item', item_dict(item), event_id=item.id)
+            summary = job_summary(job)
+            # End the read transaction so the next poll sees new commits
+            db.session.rollback()
+
+            now = time.monotonic()
+            if summary != last_summary:
+                last_summary = summary
+                yield _event('progress', summary)
+                last_write = now
+            if summary['complete']:
+                yield _event('complete', summary)
+                return
+            if now - started > settings['BATCH_STREAM_SECONDS']:
+                return
+            if now - last_write > settings['BATCH_HEARTBEAT_SECONDS']:
+                yield ": keep-alive\n\n"
+                last_write = now
+            time.sleep(settings['BATCH_POLL_INTERVAL'])
+    finally:
+        db.session.remove()
+
+
+def init_batch_jobs(app, grade):
+    """Register the /batch-jobs API and its progress stream. grade is as for start_batch_workers()."""
+    @app.route('/batch-jobs', methods=['POST'])
+    def batch_job_create():
+        data = request.get_json(silent=True) or request.form
+        quiz_id = data.get('quiz_id') or None
+        if quiz_id is not None:
+            quiz = db.session.get(Quiz, int(quiz_id)) if str(quiz_id).isdigit() else None
+            if quiz is None:
+                return jsonify(error=f"No quiz with id {quiz_id}"), 400
+            quiz_id = quiz.id
+        job = create_job(data.get('template', 'standard_20'), quiz_id)
+        return jsonify(job_summary(job)), 201
+
+    @app.route('/batch-jobs/<int:job_id>', methods=['GET'])
+    def batch_job_status(job_id):
+        job = BatchJob.query.get_or_404(job_id)
+        summary = job_summary(job)
+        summary['items'] = [item_dict(item) for item in job.items]
+        return jsonify(summary)
+
+    @app.route('/batch-jobs/<int:job_id>/files', methods=['POST'])
+    def batch_job_files(job_id):
+        job = BatchJob.query.get_or_404(job_id)
+        if job.status != 'open':
+            return jsonify(error='This batch is closed'), 409
+        start_batch_workers(app, grade)
+        items, rejected = [], []
+        for file in request.files.getlist('files[]'):
+            queued = submit_file(app, job, file.filename, file.stream)
+            if not queued:
+                rejected.append(file.filename)
+            items.extend(queued)
+        return jsonify(items=items, rejected=rejected)
+
+    @app.route('/batch-jobs/<int:job_id>/close', methods=['POST'])
+    def batch_job_close(job_id):
+        job = BatchJob.query.get_or_404(job_id)
+        close_job(job)
+        return jsonify(job_summary(job))
+
+    @app.route('/batch-jobs/<int:job_id>/events')
+    def batch_job_events(job_id):
+        BatchJob.query.get_or_404(job_id)
+        db.session.rollback()
+        response = Response(stream_with_context(progress_stream(app, job_id)), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        # Stop nginx and similar proxies from buffering the stream
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
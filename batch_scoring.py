@@ -0,0 +1,181 @@
+"""
+Scoring and storing many sheets at once.
+
+The batch paths (`flask grade`, every page of a PDF) don't score sheet by
+sheet. The answers read from the sheets are collected into a sheets x
+questions matrix of small integers (0 blank, 1 for A, 2 for B, ..., and -1
+for a question the sheet didn't have), and one comparison against the
+compiled key gives the correctness of every answer, the scores and the
+percentages for the whole batch. save_scored() then writes the students,
+scans and answers with one multi-row INSERT per table, in one transaction,
+straight from those arrays.
+
+Scores come out as SheetResult.build() would give them: the total is the
+number of questions in the key and percentages are rounded to one decimal.
+
+Batch jobs, chunked uploads and the hot folder grade one upload at a time
+through grade_stored_upload, so an image upload there is still scored and
+saved on its own; only a PDF's pages go through here together.
+"""
+import numpy as np
+from sqlalchemy import insert, select
+
+from metrics import stage
+from models import db, Answer, ScanResult, Student
+from storage import write_transaction
+
+BLANK = 0
+ABSENT = -1
+
+
+def letter_code(letter):
+    """The matrix code of an answer letter; BLANK for None."""
+    return ord(letter.upper()) - ord('A') + 1 if letter else BLANK
+
+
+def code_letter(code):
+    return chr(ord('A') + code - 1) if code > 0 else None
+
+
+def compile_key(key, columns):
+    """An answer key {question number: letter} as a vector of codes, BLANK where a question isn't scored."""
+    vector = np.full(columns, BLANK, dtype=np.int8)
+    for question, letter in key.items():
+        vector[int(question) - 1] = letter_code(letter)
+    return vector
+
+
+def answer_matrix(results, columns):
+    """The answers of results (SheetResults) as a sheets x columns matrix of codes."""
+    matrix = np.full((len(results), columns), ABSENT, dtype=np.int8)
+    for row, result in enumerate(results):
+        for question, letter in result.answers.items():
+            matrix[row, int(question) - 1] = letter_code(letter)
+    return matrix
+
+
+class BatchScore:
+    """The sheets of one template scored against one key."""
+
+    def __init__(self, indices, answers, key):
+        self.indices = np.asarray(indices)   # positions of these sheets in the batch
+        self.answers = answers
+        self.key = key
+        scored = key > BLANK
+        # Blank and absent answers have codes below any key letter, so never match
+        self.correct = (answers == key) & scored
+        self.scores = self.correct.sum(axis=1)
+        self.total = int(scored.sum())
+        if self.total:
+            self.percentages = np.round(self.scores / self.total * 100, 1)
+        else:
+            self.percentages = np.zeros(len(self.scores))
+
+
+class ScoredBatch:
+    """A list of SheetResults and their scores, in the same order. Built by score_sheets()."""
+
+    def __init__(self, results, groups):
+        self.results = results
+        self.groups = groups
+        self.scores = np.zeros(len(results), dtype=np.int64)
+        self.totals = np.zeros(len(results), dtype=np.int64)
+        self.percentages = np.zeros(len(results))
+        for group in groups:
+            self.scores[group.indices] = group.scores
+            self.totals[group.indices] = group.total
+            self.percentages[group.indices] = group.percentages
+
+    def __len__(self):
+        return len(self.results)
+
+    def score(self, index):
+        """Sheet index's score as SheetResult.score has it."""
+        return {'correct': int(self.scores[index]), 'total': int(self.totals[index]),
+                'percentage': float(self.percentages[index])}
+
+
+def score_sheets(results, key_for):
+    """
+    Score results (SheetResults of any templates; their own scores are
+    ignored) against key_for(template name) -> {question number: letter}.
+    Sheets of the same template are scored together. Returns a ScoredBatch.
+    """
+    by_template = {}
+    for index, result in enumerate(results):
+        by_template.setdefault(result.template, []).append(index)
+    groups = []
+    for template, indices in by_template.items():
+        key = key_for(template)
+        sheets = [results[index] for index in indices]
+        columns = max([int(q) for q in key]
+                      + [int(q) for sheet in sheets for q in sheet.answers]
+                      + [sheets[0].template_info['questions_per_sheet']])
+        groups.append(BatchScore(indices, answer_matrix(sheets, columns), compile_key(key, columns)))
+    return ScoredBatch(results, groups)
+
+
+def _student_ids(results):
+    """Student row ids for the results' students, creating the ones not on file. Call in a write transaction."""
+    names = {result.student['name'] for result in results}
+    found = {}
+    for name, student_id in (db.session.execute(select(Student.name, Student.id)
+                                                .where(Student.name.in_(names)).order_by(Student.id))):
+        found.setdefault(name, student_id)
+    new = {}
+    for result in results:
+        name = result.student['name']
+        if name not in found and name not in new:
+            new[name] = {'name': name, 'student_id': result.student.get('id')}
+    if new:
+        rows = list(new.values())
+        ids = db.session.execute(insert(Student).returning(Student.id, sort_by_parameter_order=True), rows).scalars()
+        found.update(zip(new, ids))
+    return [found[result.student['name']] for result in results]
+
+
+def save_scored(batch, image_paths, quiz_id=None):
+    """
+    Store a ScoredBatch: find or create each student, then insert the scans
+    and their answers in bulk, in one transaction. image_paths has one entry
+    per sheet. Returns the new ScanResult ids, in the batch's order.
+    """
+    results = batch.results
+    if not results:
+        return []
+    with stage('db_commit'), write_transaction(db.session):
+        student_ids = _student_ids(results)
+        scans = [{
+            'student_id': student_ids[index],
+            'template_used': result.template,
+            'score': int(batch.scores[index]),
+            'total_questions': int(batch.totals[index]),
+            'percentage': float(batch.percentages[index]),
+            'image_path': image_paths[index],
+            'confidence': result.min_confidence,
+            'regraded_questions': result.regraded_questions,
+            'quiz_id': quiz_id,
+        } for index, result in enumerate(results)]
+        scan_ids = list(db.session.execute(
+            insert(ScanResult).returning(ScanResult.id, sort_by_parameter_order=True), scans).scalars())
+
+        answers = []
+        for group in batch.groups:
+            # One row per answer the sheet has and the key scores, as save_scan_result stores them
+            rows, columns = np.nonzero((group.answers != ABSENT) & (group.key > BLANK))
+            sheets = group.indices[rows].tolist()
+            selected = group.answers[rows, columns].tolist()
+            correct = group.correct[rows, columns].tolist()
+            for sheet, column, code, is_correct in zip(sheets, columns.tolist(), selected, correct):
+                question = column + 1
+                answers.append({
+                    'scan_result_id': scan_ids[sheet],
+                    'question_number': question,
+                    'selected_answer': code_letter(code),
+                    'correct_answer': code_letter(int(group.key[column])),
+                    'is_correct': is_correct,
+                    'confidence': results[sheet].confidence.get(str(question)),
+                })
+        if answers:
+            db.session.execute(insert(Answer), answers)
+    return scan_ids
@@ -0,0 +1,194 @@
+"""
+Per-stage micro-benchmark for BubbleSheetScanner.
+
+Times each pipeline stage separately on a synthetic corpus (see synthetic.py)
+and reports latency, throughput and accuracy against the ground truth:
+
+    decode      read + resize + write the working image (as process_sheet does)
+    ocr_header  extract_student_info_from_image
+    bubbles     _check_for_bubbles
+    grading     _process_answer_bubbles
+    matching    _match_student_with_database
+
+    python benchmark.py --count 20 --noise 6 --rotate 1 --json bench.json
+    python benchmark.py --corpus corpus/          # reuse a saved corpus
+"""
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+STAGES = ['decode', 'ocr_header', 'bubbles', 'grading', 'matching']
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def summarize(timings):
+    """Turn {stage: [seconds]} into per-stage latency stats in milliseconds."""
+    summary = {}
+    for stage, values in timings.items():
+        if not values:
+            continue
+        summary[stage] = {
+            'count': len(values),
+            'mean_ms': sum(values) / len(values) * 1000,
+            'p50_ms': _percentile(values, 50) * 1000,
+            'p95_ms': _percentile(values, 95) * 1000,
+            'total_s': sum(values),
+        }
+    return summary
+
+
+def run_benchmark(corpus_dir, manifest, workdir, repeat=1):
+    """Run every stage on every sheet of the corpus. Returns the report dict."""
+    import cv2
+    from app import app, db
+    from models import Student
+    from scanner import BubbleSheetScanner, ScanOptions
+
+    scanner = BubbleSheetScanner()
+    options = ScanOptions()
+    timings = {stage: [] for stage in STAGES}
+    accuracy = {
+        'sheets': 0, 'questions': 0, 'answers_correct': 0,
+        'bubbles_detected': 0, 'ocr_id_correct': 0, 'ocr_name_found': 0, 'matched': 0, 'regraded': 0,
+    }
+
+    with app.app_context():
+        db.create_all()
+        # The roster the matching stage searches
+        for truth in manifest['sheets']:
+            db.session.add(Student(name=truth['student']['name'], student_id=truth['student']['id']))
+        db.session.commit()
+
+        for _ in range(repeat):
+            for truth in manifest['sheets']:
+                template_name = truth['template']
+                question_count = scanner.templates[template_name]['questions_per_sheet']
+                image_path = os.path.join(workdir, truth['file'])
+                shutil.copyfile(os.path.join(corpus_dir, truth['file']), image_path)
+
+                started = time.perf_counter()
+                img = cv2.imread(image_path)
+                ratio = options.resize_height / img.shape[0]
+                img = cv2.resize(img, (int(img.shape[1] * ratio), options.resize_height), interpolation=cv2.INTER_AREA)
+                cv2.imwrite(image_path, img)
+                timings['decode'].append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                student_info = scanner.extract_student_info_from_image(image_path, template_name)
+                timings['ocr_header'].append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                has_bubbles = scanner._check_for_bubbles(image_path)
+                timings['bubbles'].append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                answers, _, regraded = scanner._process_answer_bubbles(image_path, question_count, template_name, workdir)
+                timings['grading'].append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                # Name only, so the fuzzy roster scan is what gets measured
+                matched = scanner._match_student_with_database({'name': truth['student']['name'], 'id': ''})
+                timings['matching'].append(time.perf_counter() - started)
+
+                accuracy['sheets'] += 1
+                accuracy['bubbles_detected'] += bool(has_bubbles)
+                for q_num, expected in truth['answers'].items():
+                    accuracy['questions'] += 1
+                    accuracy['answers_correct'] += answers.get(q_num) == expected
+                accuracy['regraded'] += regraded
+                if student_info:
+                    accuracy['ocr_id_correct'] += student_info.get('id') == truth['student']['id']
+                    accuracy['ocr_name_found'] += bool(student_info.get('name'))
+                accuracy['matched'] += bool(matched) and matched.get('id') == truth['student']['id']
+
+                os.remove(image_path)
+
+    sheets = max(accuracy['sheets'], 1)
+    pipeline_seconds = sum(sum(values) for values in timings.values())
+    return {
+        'corpus': {key: manifest[key] for key in ('seed', 'dpi', 'blank_rate', 'degradation')},
+        'sheets': accuracy['sheets'],
+        'stages': summarize(timings),
+        'throughput_sheets_per_s': accuracy['sheets'] / pipeline_seconds if pipeline_seconds else 0.0,
+        'accuracy': {
+            'answers': accuracy['answers_correct'] / max(accuracy['questions'], 1),
+            'bubble_detection': accuracy['bubbles_detected'] / sheets,
+            'ocr_id': accuracy['ocr_id_correct'] / sheets,
+            'ocr_name_found': accuracy['ocr_name_found'] / sheets,
+            'roster_match': accuracy['matched'] / sheets,
+        },
+        # Share of answers the fast grading tier left to the full-resolution pass
+        'regraded_fraction': accuracy['regraded'] / max(accuracy['questions'], 1),
+    }
+
+
+def print_report(report):
+    print(f"Sheets: {report['sheets']}  corpus: {report['corpus']}")
+    print(f"{'stage':<12}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'total s':>10}")
+    for stage in STAGES:
+        stats = report['stages'].get(stage)
+        if stats:
+            print(f"{stage:<12}{stats['mean_ms']:>10.1f}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['total_s']:>10.2f}")
+    print(f"Throughput: {report['throughput_sheets_per_s']:.2f} sheets/s (sum of stages, single thread)")
+    print("Accuracy: " + "  ".join(f"{key}={value:.1%}" for key, value in report['accuracy'].items()))
+    print(f"Re-graded at full resolution: {report['regraded_fraction']:.1%} of answers")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', help='directory written by synthetic.py (default: generate a fresh one)')
+    parser.add_argument('--template', action='append', help='layouts to generate (default: all)')
+    parser.add_argument('--count', type=int, default=10, help='sheets per template when generating')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--noise', type=float, default=0.0)
+    parser.add_argument('--blur', type=int, default=0)
+    parser.add_argument('--rotate', type=float, default=0.0)
+    parser.add_argument('--gradient', type=float, default=0.0)
+    parser.add_argument('--repeat', type=int, default=1, help='passes over the corpus')
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_')
+    # Keep the benchmark away from the real database
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+
+    from synthetic import TEMPLATE_QUESTIONS, generate_corpus
+
+    try:
+        if args.corpus:
+            corpus_dir = args.corpus
+            with open(os.path.join(corpus_dir, 'manifest.json')) as f:
+                manifest = json.load(f)
+        else:
+            corpus_dir = os.path.join(workdir, 'corpus')
+            manifest = generate_corpus(
+                corpus_dir, args.template or list(TEMPLATE_QUESTIONS), args.count, seed=args.seed,
+                noise=args.noise, blur=args.blur, rotate=args.rotate, gradient=args.gradient
+            )
+
+        # The scanner logs with print(); keep it out of the report
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            report = run_benchmark(corpus_dir, manifest, workdir, args.repeat)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
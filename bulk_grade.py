@@ -0,0 +1,247 @@
+"""
+Headless bulk grading: `flask grade`.
+
+Grades a directory or glob of scans without the web server:
+
+    flask grade scans/                          # every sheet in scans/, template auto-detected
+    flask grade 'batch/**/*.jpg' -t extended_50 --workers 8 --csv results.csv
+    flask grade scans/ --quiz 3 --no-db --csv quiz3.csv
+
+Sheets are scanned in a pool of worker processes. The workers never touch
+the database or need an app context: the parent loads the roster once and
+hands it to each worker, and the workers return the answers they read. The
+parent collects them into batches of GRADE_FLUSH_SHEETS, scores each batch
+against the quiz's or the template's answer key as one matrix and writes it
+(to the database in bulk, to CSV, or both); see batch_scoring.py.
+Every page of a PDF is graded as its own sheet. Input files are never
+modified.
+"""
+import csv
+import glob
+import os
+import shutil
+import statistics
+import tempfile
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import click
+
+SHEET_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf'}
+# Graded sheets scored and stored together
+GRADE_FLUSH_SHEETS = 64
+
+CSV_FIELDS = ['file', 'page', 'status', 'error', 'student_name', 'student_id', 'template', 'quiz_id',
+              'score', 'total', 'percentage', 'min_confidence', 'answers', 'scan_id', 'seconds']
+
+# Per worker process, set by _init_worker
+_worker = {}
+
+
+def collect_files(patterns, recursive=False):
+    """Expand directories and glob patterns into a sorted list of sheet files."""
+    files = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            walker = os.walk(pattern) if recursive else [(pattern, [], os.listdir(pattern))]
+            for directory, _, names in walker:
+                files.update(os.path.join(directory, name) for name in names)
+        else:
+            files.update(glob.glob(pattern, recursive=True))
+    return sorted(path for path in files
+                  if os.path.isfile(path) and path.rsplit('.', 1)[-1].lower() in SHEET_EXTENSIONS)
+
+
+def _init_worker(roster, options):
+    from scanner import BubbleSheetScanner
+    _worker['scanner'] = BubbleSheetScanner()
+    _worker['roster'] = roster
+    _worker['options'] = options
+
+
+def grade_file(path, template_name):
+    """
+    Scan one file in a worker process (every page, for a PDF) without scoring it.
+    Returns a list of (page, SheetResult or None, error, seconds).
+    """
+    from scanner import ScanOptions
+    scanner = _worker['scanner']
+    work_dir = tempfile.mkdtemp(prefix='grade_')
+    options = dict(_worker['options'], upload_folder=work_dir)
+    outcomes = []
+    try:
+        if path.lower().endswith('.pdf'):
+            pages = scanner.convert_pdf_to_images(path, work_dir)
+        else:
+            pages = [path]
+        for page, page_path in enumerate(pages, start=1):
+            started = time.perf_counter()
+            try:
+                # An empty key: the parent scores the answers against the right one
+                result, error = scanner.process_sheet(
+                    page_path, template_name, correct_answers={},
+                    options=ScanOptions(work_path=os.path.join(work_dir, f"{uuid.uuid4().hex}.png"), **options),
+                    roster=_worker['roster'])
+            except Exception as e:
+                traceback.print_exc()
+                result, error = None, str(e)
+            outcomes.append((page, result, error, time.perf_counter() - started))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return outcomes
+
+
+class KeyBook:
+    """The answer keys to score against: a quiz's for every sheet, or each template's default key."""
+
+    def __init__(self, get_scanner, quiz_key=None):
+        self.get_scanner = get_scanner
+        self.quiz_key = quiz_key
+        self.keys = {}
+
+    def key_for(self, template_name):
+        if self.quiz_key is not None:
+            return self.quiz_key
+        if template_name not in self.keys:
+            from scanner import TEMPLATES
+            self.keys[template_name] = self.get_scanner().get_correct_answers(
+                TEMPLATES[template_name]['questions_per_sheet'])
+        return self.keys[template_name]
+
+
+def _answer_string(result):
+    """Answers in question order as one string, '-' for a blank."""
+    return ''.join(result.answers.get(str(q)) or '-'
+                   for q in range(1, result.template_info['questions_per_sheet'] + 1))
+
+
+def run_grading(app, get_scanner, files, template_name, quiz_id=None, workers=None,
+                csv_path=None, to_db=True, echo=print):
+    """Grade files in a process pool and write the results. Returns the throughput report."""
+    from batch_scoring import save_scored, score_sheets
+    from models import db
+    from roster import quiz_answer_keys, roster_index
+    from storage import dispose_engines
+
+    quiz_key = quiz_answer_keys()[quiz_id] if quiz_id is not None else None
+    keys = KeyBook(get_scanner, quiz_key)
+    roster = roster_index()
+    options = {'debug_artifacts': 'off'}
+    workers = workers or os.cpu_count() or 1
+    # The workers are forked; don't let them inherit open database connections
+    db.session.commit()
+    dispose_engines(app, db)
+
+    csv_file = open(csv_path, 'w', newline='') if csv_path else None
+    writer = csv.DictWriter(csv_file, fieldnames=CSV_FIELDS) if csv_file else None
+    if writer:
+        writer.writeheader()
+
+    report = {'files': len(files), 'sheets': 0, 'graded': 0, 'failed': 0, 'workers': workers}
+    latencies = []
+    # Graded sheets waiting to be scored and stored: (SheetResult, CSV row)
+    pending = []
+
+    def flush():
+        batch = score_sheets([result for result, _ in pending], keys.key_for)
+        scan_ids = save_scored(batch, [os.path.abspath(row['file']) for _, row in pending],
+                               quiz_id) if to_db else None
+        for index, (result, row) in enumerate(pending):
+            score = batch.score(index)
+            row.update(status='graded', student_name=result.student.get('name'),
+                       student_id=result.student.get('id'), template=result.template,
+                       score=score['correct'], total=score['total'], percentage=score['percentage'],
+                       min_confidence=result.min_confidence, answers=_answer_string(result),
+                       scan_id=scan_ids[index] if scan_ids else None)
+            echo(f"{row['file']} page {row['page']}: {score['correct']}/{score['total']} "
+                 f"({result.student.get('name')})")
+            if writer:
+                writer.writerow(row)
+        report['graded'] += len(pending)
+        pending.clear()
+
+    started = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(roster, options)) as pool:
+            futures = {pool.submit(grade_file, path, template_name): path for path in files}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    outcomes = future.result()
+                except Exception as e:
+                    outcomes = [(1, None, f"Worker failed: {e}", 0.0)]
+                for page, result, error, seconds in outcomes:
+                    report['sheets'] += 1
+                    latencies.append(seconds)
+                    row = {'file': path, 'page': page, 'seconds': round(seconds, 3), 'quiz_id': quiz_id}
+                    if error or result is None:
+                        report['failed'] += 1
+                        row.update(status='error', error=error)
+                        echo(f"FAILED {path} page {page}: {error}")
+                        if writer:
+                            writer.writerow(row)
+                    else:
+                        pending.append((result, row))
+                if len(pending) >= GRADE_FLUSH_SHEETS:
+                    flush()
+        if pending:
+            flush()
+    finally:
+        if csv_file:
+            csv_file.close()
+
+    elapsed = time.perf_counter() - started
+    report.update({
+        'seconds': round(elapsed, 2),
+        'sheets_per_second': round(report['sheets'] / elapsed, 2) if elapsed else 0.0,
+        'median_sheet_seconds': round(statistics.median(latencies), 3) if latencies else None,
+        'p95_sheet_seconds': round(sorted(latencies)[int(0.95 * (len(latencies) - 1))], 3) if latencies else None,
+    })
+    return report
+
+
+def init_bulk_grade(app, get_scanner):
+    """Register the `flask grade` command."""
+    @app.cli.command('grade')
+    @click.argument('paths', nargs=-1, required=True)
+    @click.option('--template', '-t', default=None,
+                  help="Template name, or 'auto' to recognise each sheet (default: auto, or the quiz's template).")
+    @click.option('--quiz', 'quiz_id', type=int, default=None, help='Grade against this quiz\'s answer key.')
+    @click.option('--workers', '-w', type=int, default=None, help='Worker processes (default: one per CPU).')
+    @click.option('--csv', 'csv_path', type=click.Path(dir_okay=False, writable=True), default=None,
+                  help='Also write one row per sheet to this CSV file.')
+    @click.option('--db/--no-db', 'to_db', default=True, help='Store results in the database (default) or not.')
+    @click.option('--recursive', '-r', is_flag=True, help='Descend into subdirectories.')
+    def grade_command(paths, template, quiz_id, workers, csv_path, to_db, recursive):
+        """Grade scanned sheets from directories or glob patterns."""
+        from models import Quiz
+        from scanner import TEMPLATES
+        from template_detect import AUTO_TEMPLATE
+        from template_registry import template_for_questions
+
+        if quiz_id is not None:
+            quiz = Quiz.query.get(quiz_id)
+            if quiz is None:
+                raise click.BadParameter(f"No quiz with id {quiz_id}", param_hint='--quiz')
+            template = template or template_for_questions(quiz.num_items).name
+        template = template or AUTO_TEMPLATE
+        if template != AUTO_TEMPLATE and template not in TEMPLATES:
+            raise click.BadParameter(f"Unknown template {template}", param_hint='--template')
+        if not to_db and not csv_path:
+            raise click.UsageError("Nothing to write: use --csv with --no-db")
+
+        files = collect_files(paths, recursive)
+        if not files:
+            raise click.UsageError("No PNG, JPG or PDF files found")
+        click.echo(f"Grading {len(files)} files with template {template}"
+                   + (f" against quiz {quiz_id}" if quiz_id is not None else ""))
+
+        report = run_grading(app, get_scanner, files, template, quiz_id, workers,
+                             csv_path, to_db, echo=click.echo)
+        click.echo(f"{report['graded']} of {report['sheets']} sheets graded ({report['failed']} failed) "
+                   f"from {report['files']} files in {report['seconds']} s with {report['workers']} workers: "
+                   f"{report['sheets_per_second']} sheets/s, median {report['median_sheet_seconds']} s "
+                   f"and p95 {report['p95_sheet_seconds']} s per sheet")
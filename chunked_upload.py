@@ -0,0 +1,248 @@
+"""
+Chunked, resumable uploads into a batch job.
+
+A single multipart request is capped by MAX_CONTENT_LENGTH and lost
+entirely on one dropped connection. Here each file is sent as a series of
+chunks, appended in order to UPLOAD_FOLDER/incoming/<upload id>.part:
+
+    POST  /batch-jobs/<id>/uploads           {filename, size} -> {upload_id, offset: 0, chunk_size}
+    PATCH /batch-jobs/<id>/uploads/<upload>  raw bytes, Upload-Offset: <offset> -> {offset, complete, item}
+    HEAD  /batch-jobs/<id>/uploads/<upload>  Upload-Offset / Upload-Length headers
+    GET   /batch-jobs/<id>/uploads/<upload>  the same as JSON
+    DELETE /batch-jobs/<id>/uploads/<upload> give up on an unfinished upload
+
+A chunk is only accepted at the current offset (409 with the real offset
+otherwise). After a failure the client asks for the offset and carries on
+from there; bytes that arrived before a connection dropped are kept. The
+offset is the size of the .part file, so any worker can take the next
+chunk. When the last byte arrives the file moves into the content-addressed
+store and is queued as a BatchItem straight away, so grading starts while
+the rest of the batch is still uploading. A ZIP archive is unpacked into
+the queue entry by entry instead (see batch_jobs.submit_archive). Partial files untouched for
+RETENTION_PARTIAL_AGE are removed by retention.py, which forgets their
+uploads.
+"""
+import fcntl
+import os
+import uuid
+from datetime import datetime
+
+from flask import jsonify, request
+from werkzeug.utils import secure_filename
+
+from batch_jobs import ARCHIVE_EXTENSIONS, BATCH_EXTENSIONS, add_item, item_dict, start_batch_workers, submit_archive
+from models import db, BatchItem, BatchJob, BatchUpload
+from storage import write_transaction
+from upload_store import CHUNK_SIZE, store_file
+
+INCOMING_DIR = 'incoming'
+
+UPLOAD_DEFAULTS = {
+    'BATCH_CHUNK_SIZE': 5 * 1024 * 1024,         # suggested chunk size; must stay under MAX_CONTENT_LENGTH
+    'BATCH_UPLOAD_MAX_BYTES': 200 * 1024 * 1024,  # largest single sheet file
+    'BATCH_ARCHIVE_MAX_BYTES': 8 * 1024 ** 3,     # largest ZIP archive
+}
+
+
+def upload_settings(app):
+    settings = {}
+    for key, default in UPLOAD_DEFAULTS.items():
+        settings[key] = int(app.config.get(key, os.environ.get(key, default)))
+    return settings
+
+
+def part_path(upload_folder, upload_id):
+    return os.path.join(upload_folder, INCOMING_DIR, f"{upload_id}.part")
+
+
+def create_upload(app, job, filename, size):
+    """Start a chunked upload of a file of size bytes. Returns the BatchUpload, or None for a file type we can't grade."""
+    filename = secure_filename(filename or '')
+    extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+    if extension not in BATCH_EXTENSIONS | ARCHIVE_EXTENSIONS:
+        return None
+    upload_id = uuid.uuid4().hex
+    path = part_path(app.config['UPLOAD_FOLDER'], upload_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    with write_transaction(db.session):
+        upload = BatchUpload(id=upload_id, job_id=job.id, filename=filename, extension=extension, size=size)
+        db.session.add(upload)
+    return upload
+
+
+def upload_offset(app, upload):
+    """Bytes received so far; None when the partial file has expired."""
+    if upload.completed_at:
+        return upload.size
+    try:
+        return os.path.getsize(part_path(app.config['UPLOAD_FOLDER'], upload.id))
+    except FileNotFoundError:
+        return None
+
+
+def append_chunk(app, upload, offset, stream, length):
+    """
+    Append length bytes from stream at offset.
+    Returns (new offset, None), or (current offset, error) when the chunk
+    can't be taken (offset None when the partial file is gone).
+    Queues the file for grading once it is complete.
+    """
+    path = part_path(app.config['UPLOAD_FOLDER'], upload.id)
+    try:
+        # Never recreate the file: it is gone once expired or complete
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+    except FileNotFoundError:
+        return None, 'This upload has expired or already finished'
+    with os.fdopen(fd, 'ab') as part:
+        # One writer per upload at a time, across threads and workers
+        fcntl.flock(part, fcntl.LOCK_EX)
+        current = os.fstat(part.fileno()).st_size
+        if current == upload.size:
+            # Another request finished the file while this one waited
+            return current, 'This upload is already complete'
+        if offset != current:
+            return current, f"Expected offset {current}"
+        if current + length > upload.size:
+            return current, f"Chunk runs past the declared size of {upload.size} bytes"
+
+        remaining = length
+        try:
+            while remaining:
+                chunk = stream.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                part.write(chunk)
+                remaining -= len(chunk)
+        finally:
+            # Whatever arrived is kept; the client resumes from the new offset
+            part.flush()
+            current = os.fstat(part.fileno()).st_size
+
+        if current == upload.size:
+            _complete(app, upload, path)
+    return current, None
+
+
+def _complete(app, upload, path):
+    """Queue a fully received file on its job: moved into the store, or for a ZIP archive, unpacked into it."""
+    job = db.session.get(BatchJob, upload.job_id)
+    if upload.extension in ARCHIVE_EXTENSIONS:
+        with open(path, 'rb') as archive:
+            items = submit_archive(app, job, archive)
+        os.remove(path)
+        item_id = None
+    else:
+        digest, file_path = store_file(path, upload.extension, app.config['UPLOAD_FOLDER'])
+        items = [add_item(job, upload.filename, digest, file_path, upload.extension)]
+        item_id = items[0].id
+    with write_transaction(db.session):
+        finished = db.session.get(BatchUpload, upload.id)
+        finished.completed_at = datetime.utcnow()
+        finished.item_id = item_id
+        finished.entries = len(items)
+    print(f"Chunked upload {upload.id} ({upload.filename}, {upload.size} bytes) queued as {len(items)} batch item(s)")
+
+
+def abandon_upload(app, upload):
+    """Drop an unfinished upload and its partial file, so its job can complete without it."""
+    try:
+        os.remove(part_path(app.config['UPLOAD_FOLDER'], upload.id))
+    except FileNotFoundError:
+        pass
+    with write_transaction(db.session):
+        BatchUpload.query.filter_by(id=upload.id, completed_at=None).delete()
+
+
+def upload_dict(app, upload):
+    offset = upload_offset(app, upload)
+    item = db.session.get(BatchItem, upload.item_id) if upload.item_id else None
+    return {
+        'upload_id': upload.id,
+        'filename': upload.filename,
+        'size': upload.size,
+        'offset': offset,
+        'expired': offset is None,
+        'complete': upload.completed_at is not None,
+        'entries': upload.entries,
+        'item': item_dict(item) if item else None,
+    }
+
+
+def init_chunked_uploads(app, grade):
+    """Register the chunked upload API. grade is as for batch_jobs.start_batch_workers()."""
+    def get_upload(job_id, upload_id):
+        return BatchUpload.query.filter_by(id=upload_id, job_id=job_id).first_or_404()
+
+    @app.route('/batch-jobs/<int:job_id>/uploads', methods=['POST'])
+    def batch_upload_create(job_id):
+        job = BatchJob.query.get_or_404(job_id)
+        if job.status != 'open':
+            return jsonify(error='This batch is closed'), 409
+        data = request.get_json(silent=True) or request.form
+        settings = upload_settings(app)
+        try:
+            size = int(data.get('size', 0))
+        except (TypeError, ValueError):
+            size = 0
+        if size <= 0:
+            return jsonify(error='size must be a positive number of bytes'), 400
+        is_archive = str(data.get('filename', '')).lower().endswith('.zip')
+        limit = settings['BATCH_ARCHIVE_MAX_BYTES' if is_archive else 'BATCH_UPLOAD_MAX_BYTES']
+        if size > limit:
+            return jsonify(error=f"Files like this are limited to {limit} bytes"), 413
+        upload = create_upload(app, job, data.get('filename'), size)
+        if upload is None:
+            return jsonify(error='Please upload PNG, JPG, JPEG, PDF, or ZIP files'), 400
+        response = upload_dict(app, upload)
+        response['chunk_size'] = settings['BATCH_CHUNK_SIZE']
+        return jsonify(response), 201
+
+    @app.route('/batch-jobs/<int:job_id>/uploads/<upload_id>', methods=['GET', 'HEAD'])
+    def batch_upload_status(job_id, upload_id):
+        upload = get_upload(job_id, upload_id)
+        response = jsonify(upload_dict(app, upload))
+        offset = upload_offset(app, upload)
+        if offset is None:
+            response.status_code = 410
+        else:
+            response.headers['Upload-Offset'] = str(offset)
+        response.headers['Upload-Length'] = str(upload.size)
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    @app.route('/batch-jobs/<int:job_id>/uploads/<upload_id>', methods=['PATCH', 'PUT'])
+    def batch_upload_chunk(job_id, upload_id):
+        upload = get_upload(job_id, upload_id)
+        if upload.completed_at:
+            return jsonify(upload_dict(app, upload))
+        if upload_offset(app, upload) is None:
+            return jsonify(error='This upload has expired; start it again'), 410
+        try:
+            offset = int(request.headers.get('Upload-Offset', request.args.get('offset', '')))
+        except ValueError:
+            return jsonify(error='Upload-Offset header required'), 400
+        length = request.content_length or 0
+        # Don't hold a read transaction while the chunk streams in
+        db.session.commit()
+
+        start_batch_workers(app, grade)
+        _, error = append_chunk(app, upload, offset, request.stream, length)
+        data = upload_dict(app, upload)
+        status = 200
+        if error and not data['complete']:
+            data['error'] = error
+            status = 410 if data['expired'] else 409
+        response = jsonify(data)
+        response.status_code = status
+        if data['offset'] is not None:
+            response.headers['Upload-Offset'] = str(data['offset'])
+        return response
+
+    @app.route('/batch-jobs/<int:job_id>/uploads/<upload_id>', methods=['DELETE'])
+    def batch_upload_abandon(job_id, upload_id):
+        upload = get_upload(job_id, upload_id)
+        if upload.completed_at:
+            return jsonify(error='This upload is complete and queued for grading'), 409
+        abandon_upload(app, upload)
+        return '', 204
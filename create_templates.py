@@ -1,74 +1,61 @@
 import os
+import sys
 from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter as report_letter
-from reportlab.lib.units import inch
+from reportlab.graphics.barcode import code128
 
-def create_bubble_sheet(filename, num_questions=20, title=None):
+from template_registry import (BARCODE_PREFIX, POINTS_PER_INCH as inch, TEMPLATE_REGISTRY, printed_templates,
+                               sheet_layout)
+
+
+def create_bubble_sheet(filename, template_name='standard_20', title=None, barcode=True):
     """
-    Create a bubble sheet template PDF with the specified number of questions.
+    Create the bubble sheet PDF of a registered template (see sheet_templates.json).
+    With barcode, a footer barcode (BARCODE_PREFIX + name) identifies the
+    layout to the scanner's template auto-detection.
     """
-    c = canvas.Canvas(filename, pagesize=report_letter)
-    width, height = report_letter
+    spec = TEMPLATE_REGISTRY[template_name]
+    layout = sheet_layout(spec)
+    width, height = layout['page_size']
+    c = canvas.Canvas(filename, pagesize=layout['page_size'])
 
     # Set default title if not specified
     if title is None:
-        title = f"MattChecker {num_questions}-Question Answer Sheet"
-
-    # Configuration based on number of questions
-    if num_questions <= 20:
-        columns_per_page = 1
-        questions_per_column = 20
-    elif num_questions <= 50:
-        columns_per_page = 2
-        questions_per_column = 25
-    else:  # 100 questions
-        columns_per_page = 4
-        questions_per_column = 25
+        title = spec.title
 
     # Draw header
     c.setFont("Helvetica-Bold", 16)
-    c.drawCentredString(width/2, height - 0.75*inch, title)
+    c.drawCentredString(width/2, layout['title_y'], title)
     c.setFont("Helvetica", 12)
-    c.drawCentredString(width/2, height - 1.1*inch, "Fill in the bubble corresponding to your answer for each question")
+    c.drawCentredString(width/2, layout['subtitle_y'], "Fill in the bubble corresponding to your answer for each question")
     c.setFont("Helvetica-Bold", 12)
-    c.drawString(1*inch, height - 1.5*inch, "Name: ________________________________")
-    c.drawString(width - 4*inch, height - 1.5*inch, "ID: ___________________")
-
-    start_y = height - 2.2*inch
-    column_width = (width - 2*inch) / columns_per_page
-    spacing = 0.3*inch if num_questions <= 20 else 0.25*inch
-
-    current_question = 1
-    for col in range(columns_per_page):
-        col_x = 1.0*inch + col * column_width
-
-        for i in range(questions_per_column):
-            if current_question > num_questions:
-                break
-
-            y = start_y - (i * spacing)
+    for field in layout['fields'].values():
+        c.drawString(*field['label_at'], field['label'])
+        c.rect(*field['box'], stroke=1, fill=0)
 
-            c.setFont("Helvetica-Bold", 10)
-            c.drawString(col_x, y, f"{current_question}.")
+    c.setFont("Helvetica-Bold", 10)
+    for question, x, y in layout['labels']:
+        c.drawRightString(x, y - 3, f"{question}.")
 
-            bubble_x = col_x + 0.25*inch
-            c.setFont("Helvetica", 8)
-            for j, letter in enumerate(['A', 'B', 'C', 'D']):
-                c.circle(bubble_x + j*0.25*inch, y, 4, stroke=1, fill=0)
-                c.drawString(bubble_x + j*0.25*inch - 2, y - 2, letter)
+    c.setFont("Helvetica", 8)
+    for question, j, x, y in layout['bubbles']:
+        c.circle(x, y, layout['bubble_radius'], stroke=1, fill=0)
+        c.drawCentredString(x, y - 2.5, spec.choices[j])
 
-            current_question += 1
+    if barcode:
+        symbol = code128.Code128(f"{BARCODE_PREFIX}{template_name}", barHeight=0.3*inch, barWidth=1.0)
+        symbol.drawOn(c, width - 1*inch - symbol.width, 0.5*inch)
 
     c.save()
-    print(f"Created {filename} with {num_questions} questions")
+    print(f"Created {filename} with {spec.questions} questions")
 
 def main():
     output_dir = "static/templates"
     os.makedirs(output_dir, exist_ok=True)
 
-    create_bubble_sheet(f"{output_dir}/standard_20.pdf", 20, "Standard 20-Question Answer Sheet")
-    create_bubble_sheet(f"{output_dir}/extended_50.pdf", 50, "Extended 50-Question Answer Sheet")
-    create_bubble_sheet(f"{output_dir}/comprehensive_100.pdf", 100, "Comprehensive 100-Question Answer Sheet")
+    # Optionally limit to the named templates: python create_templates.py standard_20
+    names = sys.argv[1:] or [spec.name for spec in printed_templates()]
+    for name in names:
+        create_bubble_sheet(f"{output_dir}/{name}.pdf", name)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,72 @@
+"""
+Background writer for scanner debug images.
+
+Encoding and writing PNGs is slow, so scans only hand the image over to a
+queue and a daemon thread does the cv2.imwrite. When the queue is full the
+artifact is dropped rather than slowing the scan down.
+"""
+import os
+import queue
+import threading
+import traceback
+
+import cv2
+
+from metrics import REGISTRY, Counter
+
+# Debug artifact modes (DEBUG_ARTIFACTS setting)
+MODES = ('off', 'sampled', 'full')
+# Questions saved per sheet in sampled mode
+SAMPLED_QUESTIONS = 5
+
+ARTIFACTS_WRITTEN = REGISTRY.register(Counter(
+    'mattchecker_debug_artifacts_total', 'Debug images handed to the writer, by outcome', ['outcome']))
+
+
+class ArtifactWriter:
+    """Writes queued (path, image) pairs to disk on a daemon thread."""
+    def __init__(self, max_queue=256):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = threading.Thread(target=self._run, name='debug-artifact-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, path, image):
+        """Queue an image for writing. Returns False if it was dropped."""
+        try:
+            self.queue.put_nowait((path, image))
+        except queue.Full:
+            ARTIFACTS_WRITTEN.inc(outcome='dropped')
+            return False
+        ARTIFACTS_WRITTEN.inc(outcome='queued')
+        return True
+
+    def flush(self):
+        """Block until everything queued so far has been written."""
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            path, image = self.queue.get()
+            try:
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                cv2.imwrite(path, image)
+            except Exception as e:
+                print(f"Error writing debug artifact {path}: {e}")
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
+
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Return this process's writer, starting it on first use (and again after a fork)."""
+    global _writer, _writer_pid
+    with _writer_lock:
+        if _writer is None or _writer_pid != os.getpid():
+            _writer = ArtifactWriter()
+            _writer_pid = os.getpid()
+        return _writer
@@ -0,0 +1,45 @@
+"""
+Gunicorn settings: a preforked pool of warm workers.
+
+    gunicorn -c gunicorn.conf.py
+
+The master loads the app once (create_app: schema, scanner imports) and forks
+workers that share it. Each worker drops the database connections it
+inherited, then warms up (see warmup.py) before it accepts its first
+connection, so no request lands on a cold worker, and starts its batch
+grading threads (see batch_jobs.py). Settings can be overridden
+with the usual GUNICORN_CMD_ARGS or the environment variables below.
+"""
+import multiprocessing
+import os
+
+wsgi_app = 'app:create_app()'
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', min(4, multiprocessing.cpu_count() * 2 + 1)))
+# Each open batch progress stream (Server-Sent Events) holds a thread
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+preload_app = True
+# Warm-up runs before a worker's first heartbeat; leave it room
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+# Recycle workers now and then; the replacements are warmed the same way
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+
+
+def post_fork(server, worker):
+    # SQLite handles must not be shared across processes
+    from app import app, db
+    from storage import dispose_engines
+    dispose_engines(app, db)
+
+
+def post_worker_init(worker):
+    # Runs in the worker after the app is loaded and before it accepts connections
+    from app import app, get_scanner, grade_stored_upload
+    from batch_jobs import start_batch_workers
+    from warmup import warm_worker
+    if app.config['WARMUP']:
+        warm_worker(app, get_scanner)
+    # Grading threads can't survive the fork, so each worker starts its own
+    start_batch_workers(app, grade_stored_upload)
@@ -0,0 +1,286 @@
+"""
+Hot-folder watcher: grade whatever the copier-scanners drop into a folder.
+
+    flask watch /srv/scans                 # run until stopped
+    flask watch /srv/scans --once          # grade what is there, then exit
+
+New files are noticed with inotify when inotify_simple is installed (and the
+folder is local), and by polling every HOTFOLDER_POLL_INTERVAL seconds in any
+case, since network shares don't always deliver inotify events. A file is
+taken once its size and modification time have not changed for
+HOTFOLDER_SETTLE_SECONDS, so half-written scans are left alone.
+
+Each file is first moved into processing/, then queued as an item of the
+watcher's batch job (see batch_jobs.py) and renamed processing/item-<item id>--<name>.
+The batch grading threads grade it, and the file moves to done/ or to
+failed/ (with a <name>.error.txt saying why). At most HOTFOLDER_MAX_PENDING
+files are queued at a time. After a restart, the files still in
+processing/ carry their item ids, so the watcher picks up their outcomes
+(or waits for the queue to finish them) instead of starting over; a file
+that never got an id is moved back to be taken again.
+"""
+import os
+import re
+import threading
+import time
+import traceback
+
+import click
+
+from batch_jobs import BATCH_EXTENSIONS, add_item, close_job, create_job, start_batch_workers
+from models import db, BatchItem
+from upload_store import store_upload
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:  # optional; polling alone works everywhere
+    INotify = None
+
+HOTFOLDER_DEFAULTS = {
+    'HOTFOLDER_DIR': '',
+    'HOTFOLDER_TEMPLATE': 'auto',
+    'HOTFOLDER_SETTLE_SECONDS': 3.0,    # unchanged this long = fully written
+    'HOTFOLDER_POLL_INTERVAL': 5.0,     # seconds between folder scans
+    'HOTFOLDER_MAX_PENDING': 50,        # files queued for grading at once
+}
+
+PROCESSING_DIR = 'processing'
+DONE_DIR = 'done'
+FAILED_DIR = 'failed'
+# Names scanners and copy tools give files while they are still being written
+TEMPORARY_SUFFIXES = ('.part', '.tmp', '.crdownload', '~')
+# processing/item-<id>--<name>: a file queued as batch item <id>
+QUEUED_NAME = re.compile(r'^item-(\d+)--(.+)$')
+
+
+def hot_folder_settings(app):
+    settings = {}
+    for key, default in HOTFOLDER_DEFAULTS.items():
+        value = app.config.get(key, os.environ.get(key, default))
+        settings[key] = type(default)(value)
+    return settings
+
+
+def _unique_path(directory, name):
+    """A path for name in directory that doesn't overwrite anything."""
+    base, extension = os.path.splitext(name)
+    path = os.path.join(directory, name)
+    counter = 1
+    while os.path.exists(path):
+        path = os.path.join(directory, f"{base}_{counter}{extension}")
+        counter += 1
+    return path
+
+
+class HotFolder:
+    """One watched directory and the files it has queued."""
+
+    def __init__(self, app, directory, template_name, settings, echo=print):
+        self.app = app
+        self.directory = os.path.abspath(directory)
+        self.template_name = template_name
+        self.settings = settings
+        self.echo = echo
+        self.job = None
+        # path -> (size, mtime, when that pair was first seen)
+        self.candidates = {}
+        # item id -> path under processing/
+        self.pending = {}
+        for name in (PROCESSING_DIR, DONE_DIR, FAILED_DIR):
+            os.makedirs(os.path.join(self.directory, name), exist_ok=True)
+
+    def recover(self):
+        """Take back the files a previous run left in processing/."""
+        processing = os.path.join(self.directory, PROCESSING_DIR)
+        for name in sorted(os.listdir(processing)):
+            path = os.path.join(processing, name)
+            match = QUEUED_NAME.match(name)
+            if match:
+                self.pending[int(match.group(1))] = path
+            else:
+                # Claimed but never queued; take it again
+                os.replace(path, _unique_path(self.directory, name))
+        if self.pending:
+            self.echo(f"Resuming {len(self.pending)} files queued before the restart")
+
+    def scan(self):
+        """Files in the folder that have stopped changing. Returns their paths, oldest first."""
+        now = time.time()
+        ready = []
+        seen = set()
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False) or entry.name.startswith('.'):
+                    continue
+                if entry.name.lower().endswith(TEMPORARY_SUFFIXES):
+                    continue
+                stat = entry.stat()
+                seen.add(entry.path)
+                signature = (stat.st_size, stat.st_mtime)
+                previous = self.candidates.get(entry.path)
+                if previous is None or previous[:2] != signature:
+                    self.candidates[entry.path] = signature + (now,)
+                    continue
+                settle = self.settings['HOTFOLDER_SETTLE_SECONDS']
+                if now - previous[2] >= settle and now - stat.st_mtime >= settle:
+                    ready.append((stat.st_mtime, entry.path))
+        for path in list(self.candidates):
+            if path not in seen:
+                del self.candidates[path]
+        return [path for _, path in sorted(ready)]
+
+    def submit(self, path):
+        """Claim a settled file and queue it for grading."""
+        name = os.path.basename(path)
+        extension = name.rsplit('.', 1)[1].lower() if '.' in name else ''
+        self.candidates.pop(path, None)
+        if extension not in BATCH_EXTENSIONS:
+            self._fail(path, name, f"Not a sheet file ({extension or 'no extension'})")
+            return
+        if os.path.getsize(path) == 0:
+            self._fail(path, name, "Empty file")
+            return
+        claimed = _unique_path(os.path.join(self.directory, PROCESSING_DIR), name)
+        try:
+            os.replace(path, claimed)
+        except FileNotFoundError:
+            return  # removed while we looked
+        try:
+            with open(claimed, 'rb') as f:
+                digest, file_path = store_upload(f, extension, self.app.config['UPLOAD_FOLDER'])
+            if self.job is None:
+                self.job = create_job(self.template_name)
+            item = add_item(self.job, name, digest, file_path, extension)
+        except Exception as e:
+            print(f"Error queueing {name} from the hot folder: {e}")
+            traceback.print_exc()
+            db.session.rollback()
+            self._fail(claimed, name, f"Could not queue for grading: {e}")
+            return
+        queued = os.path.join(os.path.dirname(claimed), f"item-{item.id}--{os.path.basename(claimed)}")
+        os.replace(claimed, queued)
+        self.pending[item.id] = queued
+        self.echo(f"Queued {name} as batch item {item.id}")
+
+    def reap(self):
+        """Move files whose grading finished to done/ or failed/. Returns how many."""
+        if not self.pending:
+            return 0
+        items = (db.session.query(BatchItem.id, BatchItem.status, BatchItem.error, BatchItem.score,
+                                  BatchItem.total_questions)
+                 .filter(BatchItem.id.in_(list(self.pending))).all())
+        db.session.rollback()
+        found = {row.id: row for row in items}
+        finished = 0
+        for item_id, path in list(self.pending.items()):
+            row = found.get(item_id)
+            name = QUEUED_NAME.match(os.path.basename(path)).group(2)
+            if row is None:
+                self._fail(path, name, f"Batch item {item_id} no longer exists")
+            elif row.status == 'done':
+                os.replace(path, _unique_path(os.path.join(self.directory, DONE_DIR), name))
+                self.echo(f"Graded {name}: {row.score}/{row.total_questions}")
+            elif row.status == 'error':
+                self._fail(path, name, row.error)
+            else:
+                continue
+            del self.pending[item_id]
+            finished += 1
+        return finished
+
+    def _fail(self, path, name, reason):
+        target = _unique_path(os.path.join(self.directory, FAILED_DIR), name)
+        try:
+            os.replace(path, target)
+        except FileNotFoundError:
+            return
+        with open(f"{target}.error.txt", 'w') as f:
+            f.write(f"{reason}\n")
+        self.echo(f"Failed {name}: {reason}")
+
+    def step(self):
+        """One pass: queue settled files (up to the pending limit) and collect finished ones."""
+        self.reap()
+        room = self.settings['HOTFOLDER_MAX_PENDING'] - len(self.pending)
+        for path in self.scan()[:max(room, 0)]:
+            self.submit(path)
+
+    def idle(self):
+        """Nothing waiting in the folder and nothing being graded."""
+        return not self.pending and not self.candidates
+
+    def close(self):
+        if self.job is not None:
+            close_job(self.job)
+
+
+def _open_inotify(directory):
+    if INotify is None:
+        return None
+    try:
+        inotify = INotify()
+        inotify.add_watch(directory, inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO | inotify_flags.CREATE)
+        return inotify
+    except OSError as e:
+        print(f"inotify unavailable for {directory} ({e}); polling only")
+        return None
+
+
+def watch(app, grade, directory, template_name, once=False, stop=None, echo=print):
+    """
+    Watch directory until stop (a threading.Event) is set, or with once=True
+    until everything in it has been graded.
+    grade is as for batch_jobs.start_batch_workers().
+    """
+    settings = hot_folder_settings(app)
+    stop = stop or threading.Event()
+    inotify = _open_inotify(directory)
+    echo(f"Watching {os.path.abspath(directory)} ({'inotify and polling' if inotify else 'polling'}), "
+         f"template {template_name}")
+    # Wake often enough to notice a file settling and grading finishing
+    wait = min(settings['HOTFOLDER_POLL_INTERVAL'], settings['HOTFOLDER_SETTLE_SECONDS'], 1.0)
+    with app.app_context():
+        start_batch_workers(app, grade)
+        folder = HotFolder(app, directory, template_name, settings, echo)
+        folder.recover()
+        last_scan = 0.0
+        try:
+            while not stop.is_set():
+                now = time.monotonic()
+                if now - last_scan >= settings['HOTFOLDER_POLL_INTERVAL'] or folder.candidates:
+                    folder.step()
+                    last_scan = now
+                else:
+                    folder.reap()
+                if once and folder.idle():
+                    break
+                if inotify is not None and inotify.read(timeout=int(wait * 1000)):
+                    # Something arrived; look now rather than at the next poll
+                    last_scan = 0.0
+                elif inotify is None:
+                    stop.wait(wait)
+        finally:
+            folder.close()
+            db.session.remove()
+            if inotify is not None:
+                inotify.close()
+
+
+def init_hot_folder(app, grade):
+    """Register the `flask watch` command. grade is as for batch_jobs.start_batch_workers()."""
+    @app.cli.command('watch')
+    @click.argument('directory', required=False)
+    @click.option('--template', '-t', default=None, help="Template name or 'auto' (default: HOTFOLDER_TEMPLATE).")
+    @click.option('--once', is_flag=True, help='Grade what is in the folder now, then exit.')
+    def watch_command(directory, template, once):
+        """Grade sheets dropped into a folder, moving them to done/ or failed/."""
+        settings = hot_folder_settings(app)
+        directory = directory or settings['HOTFOLDER_DIR']
+        if not directory:
+            raise click.UsageError("Give a directory or set HOTFOLDER_DIR")
+        if not os.path.isdir(directory):
+            raise click.BadParameter(f"{directory} is not a directory", param_hint='directory')
+        try:
+            watch(app, grade, directory, template or settings['HOTFOLDER_TEMPLATE'], once=once, echo=click.echo)
+        except KeyboardInterrupt:
+            click.echo("Stopped")
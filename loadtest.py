@@ -0,0 +1,337 @@
+"""
+HTTP load-test harness for the scanning endpoints.
+
+Drives /process_camera_image, /upload and /batch-scan with synthetic sheets
+(see synthetic.py) and reports p50/p95/p99 latency, error rate and
+throughput per endpoint. A /batch-scan request only queues a batch job, so
+its latency runs until /batch-jobs/<id> reports the job complete.
+
+Two load models:
+  closed loop  --concurrency C --requests N   C clients send N requests back to back
+  open loop    --rate R --duration S          Poisson arrivals at R req/s for S seconds
+                                              (at most --concurrency in flight)
+
+By default a throwaway server is started locally (gunicorn with
+gunicorn.conf.py if available, otherwise the Flask dev server) with its own
+database and upload folder:
+
+    python loadtest.py --endpoint camera --concurrency 8 --requests 200
+    python loadtest.py --endpoint upload --rate 5 --duration 60 --workers 4
+    python loadtest.py --url http://127.0.0.1:5000 --endpoint batch --batch-size 10
+
+Each run is saved under loadtest_results/. Compare with a saved baseline:
+
+    python loadtest.py ... --save-baseline          # writes loadtest_results/baseline.json
+    python loadtest.py ... --baseline loadtest_results/baseline.json
+"""
+import argparse
+import base64
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(REPO_DIR, 'loadtest_results')
+ENDPOINTS = ['camera', 'upload', 'batch']
+# How often a batch request polls its job until the job completes
+JOB_POLL_SECONDS = 0.2
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def _multipart(fields, files):
+    """Encode form fields and (field, filename, bytes) files as multipart/form-data."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, data in files:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: image/png\r\n\r\n'.encode() + data + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def build_sheets(template, count, seed):
+    """Render a pool of synthetic sheets as PNG bytes to draw requests from."""
+    import cv2
+    from synthetic import generate_sheet
+
+    rng = random.Random(seed)
+    sheets = []
+    for _ in range(count):
+        img, _truth = generate_sheet(template, rng, noise=4, rotate=1)
+        ok, buf = cv2.imencode('.png', img)
+        sheets.append(buf.tobytes())
+    return sheets
+
+
+def make_request(endpoint, sheets, template, batch_size, rng):
+    """
+    Build (path, body, content type, success check, follow-up) for one
+    request. The follow-up, if any, is run after a successful response; see
+    wait_for_job().
+    """
+    if endpoint == 'camera':
+        body = json.dumps({
+            'image_data': 'data:image/png;base64,' + base64.b64encode(rng.choice(sheets)).decode(),
+            'template': template,
+        }).encode()
+        return '/process_camera_image', body, 'application/json', lambda status, location: status == 200, None
+
+    if endpoint == 'upload':
+        body, ctype = _multipart({'template': template}, [('file', 'sheet.png', rng.choice(sheets))])
+        # Success redirects to the result page, failures flash and redirect home
+        return '/upload', body, ctype, lambda status, location: status == 302 and '/result/' in location, None
+
+    files = [('files[]', f'sheet_{i}.png', rng.choice(sheets)) for i in range(batch_size)]
+    body, ctype = _multipart({'template': template}, files)
+    # Accepted files are queued as a job and redirect to its progress page; failures redirect without a job
+    return ('/batch-scan', body, ctype, lambda status, location: status == 302 and 'batch-scan?job=' in location,
+            wait_for_job)
+
+
+def wait_for_job(base_url, location, deadline):
+    """Poll the batch job a /batch-scan redirect points at until it completes. Returns an error kind or None."""
+    job_id = parse_qs(urlsplit(location).query)['job'][0]
+    parts = urlsplit(base_url)
+    while time.perf_counter() < deadline:
+        remaining = max(deadline - time.perf_counter(), 1)
+        conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=remaining)
+        conn.request('GET', f'/batch-jobs/{job_id}')
+        response = conn.getresponse()
+        body = response.read()
+        conn.close()
+        if response.status != 200:
+            return f'job_http_{response.status}'
+        summary = json.loads(body)
+        if summary['complete']:
+            return 'job_item_error' if summary['error'] else None
+        time.sleep(JOB_POLL_SECONDS)
+    return 'job_timeout'
+
+
+class Recorder:
+    """Thread-safe collection of (latency, ok) samples."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+        self.error_kinds = {}
+
+    def add(self, latency, ok, kind=None):
+        with self.lock:
+            self.latencies.append(latency)
+            if not ok:
+                self.errors += 1
+                self.error_kinds[kind] = self.error_kinds.get(kind, 0) + 1
+
+
+def send(base_url, request, timeout, recorder):
+    path, body, ctype, is_ok, follow_up = request
+    parts = urlsplit(base_url)
+    started = time.perf_counter()
+    try:
+        conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+        conn.request('POST', path, body=body, headers={'Content-Type': ctype, 'Content-Length': str(len(body))})
+        response = conn.getresponse()
+        response.read()
+        status = response.status
+        location = response.getheader('Location') or ''
+        conn.close()
+        ok = is_ok(status, location)
+        kind = None if ok else f'http_{status}'
+        if ok and follow_up:
+            kind = follow_up(base_url, location, started + timeout)
+            ok = kind is None
+        recorder.add(time.perf_counter() - started, ok, kind)
+    except Exception as e:
+        recorder.add(time.perf_counter() - started, False, type(e).__name__)
+
+
+def run_closed_loop(base_url, args, sheets, recorder):
+    rng = random.Random(args.seed)
+    requests = [make_request(args.endpoint, sheets, args.template, args.batch_size, rng) for _ in range(args.requests)]
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for request in requests:
+            pool.submit(send, base_url, request, args.timeout, recorder)
+
+
+def run_open_loop(base_url, args, sheets, recorder):
+    rng = random.Random(args.seed)
+    deadline = time.perf_counter() + args.duration
+    next_arrival = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        while next_arrival < deadline:
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            request = make_request(args.endpoint, sheets, args.template, args.batch_size, rng)
+            pool.submit(send, base_url, request, args.timeout, recorder)
+            next_arrival += rng.expovariate(args.rate)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers, threads):
+    """Start the app on a free port in a scratch directory. Returns (process, url, scratch dir)."""
+    scratch = tempfile.mkdtemp(prefix='loadtest_')
+    port = _free_port()
+    env = dict(os.environ)
+    env['DATABASE_URL'] = f"sqlite:///{os.path.join(scratch, 'loadtest.db')}"
+    env['PYTHONPATH'] = REPO_DIR + os.pathsep + env.get('PYTHONPATH', '')
+
+    if shutil.which('gunicorn'):
+        # The config's hooks warm each worker and start its batch grading threads, as in production
+        cmd = ['gunicorn', '-c', os.path.join(REPO_DIR, 'gunicorn.conf.py'), '-w', str(workers),
+               '--threads', str(threads), '-b', f'127.0.0.1:{port}', '--timeout', '300']
+    else:
+        print("gunicorn not found, using the Flask development server")
+        cmd = [sys.executable, '-c',
+               "from app import app, get_scanner, grade_stored_upload\n"
+               "from batch_jobs import start_batch_workers\n"
+               "from warmup import start_warmup_thread\n"
+               "start_warmup_thread(app, get_scanner)\n"
+               "start_batch_workers(app, grade_stored_upload)\n"
+               f"app.run(host='127.0.0.1', port={port}, threaded=True)"]
+
+    # Run from the scratch dir so the relative upload folder lands there
+    process = subprocess.Popen(cmd, cwd=scratch, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(300):
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return process, url, scratch
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"Server did not start: {' '.join(cmd)}")
+
+
+def report(args, recorder, elapsed):
+    latencies = recorder.latencies
+    total = len(latencies)
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'endpoint': args.endpoint,
+        'template': args.template,
+        'mode': 'open' if args.rate else 'closed',
+        'concurrency': args.concurrency,
+        'rate': args.rate,
+        'batch_size': args.batch_size if args.endpoint == 'batch' else 1,
+        'workers': args.workers,
+        'threads': args.threads,
+        'requests': total,
+        'errors': recorder.errors,
+        'error_rate': recorder.errors / total if total else 0.0,
+        'error_kinds': recorder.error_kinds,
+        'throughput_rps': total / elapsed if elapsed else 0.0,
+        'p50_ms': _percentile(latencies, 50) * 1000,
+        'p95_ms': _percentile(latencies, 95) * 1000,
+        'p99_ms': _percentile(latencies, 99) * 1000,
+        'max_ms': max(latencies) * 1000 if latencies else 0.0,
+        'elapsed_s': elapsed,
+    }
+
+
+def print_report(result, baseline=None):
+    keys = ['requests', 'throughput_rps', 'error_rate', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']
+    print(f"{result['endpoint']} ({result['mode']} loop, concurrency {result['concurrency']}"
+          + (f", {result['rate']} req/s" if result['rate'] else '') + ")")
+    for key in keys:
+        line = f"  {key:<15}{result[key]:>12.3f}"
+        if baseline and key in baseline and baseline[key]:
+            change = (result[key] - baseline[key]) / baseline[key] * 100
+            line += f"   baseline {baseline[key]:>10.3f}  ({change:+.1f}%)"
+        print(line)
+    if result['error_kinds']:
+        print(f"  errors by kind: {result['error_kinds']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoint', choices=ENDPOINTS, default='camera')
+    parser.add_argument('--url', help='target an already running server instead of starting one')
+    parser.add_argument('--template', default='standard_20')
+    parser.add_argument('--concurrency', type=int, default=4, help='clients / max requests in flight')
+    parser.add_argument('--requests', type=int, default=50, help='closed loop: total requests')
+    parser.add_argument('--rate', type=float, help='open loop: mean arrivals per second')
+    parser.add_argument('--duration', type=float, default=30, help='open loop: seconds to run')
+    parser.add_argument('--batch-size', type=int, default=5, help='files per /batch-scan request')
+    parser.add_argument('--sheets', type=int, default=10, help='distinct synthetic sheets to send')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers for the local server')
+    parser.add_argument('--threads', type=int, default=1, help='gunicorn threads per worker')
+    parser.add_argument('--timeout', type=float, default=120,
+                        help='per-request timeout in seconds (for a batch, until its job completes)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', help='compare against this saved result')
+    parser.add_argument('--save-baseline', action='store_true', help='also save this run as the baseline')
+    args = parser.parse_args()
+
+    sheets = build_sheets(args.template, args.sheets, args.seed)
+
+    process = scratch = None
+    base_url = args.url
+    if not base_url:
+        process, base_url, scratch = start_server(args.workers, args.threads)
+        print(f"Started local server at {base_url}")
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    try:
+        if args.rate:
+            run_open_loop(base_url, args, sheets, recorder)
+        else:
+            run_closed_loop(base_url, args, sheets, recorder)
+    finally:
+        elapsed = time.perf_counter() - started
+        if process:
+            process.terminate()
+            process.wait(timeout=10)
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    result = report(args, recorder, elapsed)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    run_path = os.path.join(RESULTS_DIR, f"{result['endpoint']}_{datetime.now().strftime('%Y%m%d%H%M%S')}.json")
+    with open(run_path, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"Saved {run_path}")
+    if args.save_baseline:
+        with open(os.path.join(RESULTS_DIR, 'baseline.json'), 'w') as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,9 @@
-
-from app import app
+from app import app, get_scanner, grade_stored_upload
+from batch_jobs import start_batch_workers
+from warmup import start_warmup_thread
 
 if __name__ == "__main__":
+    # The development server has no post-fork hook; warm while it starts
+    start_warmup_thread(app, get_scanner)
+    start_batch_workers(app, grade_stored_upload)
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,207 @@
+"""
+Lightweight in-process instrumentation.
+
+Counters, gauges and histograms kept in memory and exposed in the Prometheus
+text format at /metrics. Each gunicorn worker keeps its own numbers, so
+scrape every worker (or sum them) to see the whole server.
+
+Pipeline code times its stages with:
+
+    with stage('ocr_header'):
+        ...
+
+Send a request with the header "X-Trace: 1" (or set TRACE_ALL_REQUESTS) to
+get that request's stage timings back in a Server-Timing response header,
+which browser dev tools show under the request's Timing tab.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Latency buckets in seconds, from fast pixel work up to a slow batch request
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Stage timings for the request being traced, or None when tracing is off
+_trace = ContextVar('stage_trace', default=None)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{str(value).replace(chr(34), chr(39))}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {value}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def _render_value(self, key, value):
+        # Bucket counts are already cumulative: an observation counts in every bucket it fits
+        counts, total, count = value
+        lines = []
+        for bound, bucket_count in zip(self.buckets, counts):
+            labels = _format_labels(self.labelnames + ('le',), key + (repr(float(bound)),))
+            lines.append(f'{self.name}_bucket{labels} {bucket_count}')
+        labels = _format_labels(self.labelnames + ('le',), key + ('+Inf',))
+        lines.append(f'{self.name}_bucket{labels} {count}')
+        lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {total}')
+        lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+SCANS = REGISTRY.register(Counter(
+    'mattchecker_scans_total', 'Sheets run through the scanner', ['template', 'outcome']))
+SCAN_FAILURES = REGISTRY.register(Counter(
+    'mattchecker_scan_failures_total', 'Sheets rejected by the scanner, by reason', ['reason']))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'mattchecker_stage_seconds', 'Time spent in each pipeline stage', ['stage']))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'mattchecker_request_seconds', 'Request latency by route', ['route', 'method', 'status']))
+HEADER_PREPROCESS = REGISTRY.register(Counter(
+    'mattchecker_header_preprocess_total', 'Header OCR preprocessing path taken', ['path']))
+GRADE_REGRADES = REGISTRY.register(Counter(
+    'mattchecker_grade_regrades_total', 'Answers re-read at full resolution after an unclear fast read', ['scope']))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'mattchecker_queue_depth', 'Sheets waiting to be graded', ['queue']))
+WARMUP_SECONDS = REGISTRY.register(Gauge(
+    'mattchecker_warmup_seconds', 'Time this worker spent on each warm-up step', ['step']))
+
+
+@contextmanager
+def stage(name):
+    """Time a block as pipeline stage `name`, recording it on the current trace if any."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((name, elapsed))
+
+
+def start_trace():
+    """Start collecting stage timings for the current request."""
+    _trace.set([])
+
+
+def finish_trace():
+    """Stop collecting and return the Server-Timing header value, or None if nothing was traced."""
+    trace = _trace.get()
+    _trace.set(None)
+    if not trace:
+        return None
+    return ', '.join(f'{name};dur={elapsed * 1000:.1f}' for name, elapsed in trace)
+
+
+def init_metrics(app):
+    """Time every request, honour X-Trace and serve /metrics."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_started = time.perf_counter()
+        if app.config.get('TRACE_ALL_REQUESTS') or request.headers.get('X-Trace'):
+            start_trace()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                    route=route, method=request.method, status=response.status_code)
+        header = finish_trace()
+        if header:
+            response.headers['Server-Timing'] = header
+        return response
+
+    @app.teardown_request
+    def _clear_trace(exc):
+        # after_request doesn't run when the view raises; don't leak the trace into this thread's next request
+        _trace.set(None)
+
+    @app.route('/metrics')
+    def metrics():
+        return app.response_class(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
@@ -19,9 +19,11 @@ class Section(db.Model):
 class Student(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    student_id = db.Column(db.String(50), nullable=True)
+    student_id = db.Column(db.String(50), nullable=True, index=True)
     section_id = db.Column(db.Integer, db.ForeignKey('section.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # When a roster import last changed the row (see roster_import.py)
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)
 
     scans = db.relationship('ScanResult', backref='student', lazy=True)
 
@@ -45,6 +47,9 @@ class ScanResult(db.Model):
     percentage = db.Column(db.Float, nullable=False)
     scan_date = db.Column(db.DateTime, default=datetime.utcnow)
     image_path = db.Column(db.String(255), nullable=True)
+    confidence = db.Column(db.Float, nullable=True)  # lowest answer confidence on the sheet, 0-1
+    regraded_questions = db.Column(db.Integer, nullable=True)  # answers re-read at full resolution
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=True, index=True)  # the quiz whose key graded it, if any
 
     answers = db.relationship('Answer', backref='scan_result', lazy=True, cascade="all, delete-orphan")
 
@@ -53,11 +58,12 @@ class ScanResult(db.Model):
 
 class Answer(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    scan_result_id = db.Column(db.Integer, db.ForeignKey('scan_result.id'), nullable=False)
+    scan_result_id = db.Column(db.Integer, db.ForeignKey('scan_result.id'), nullable=False, index=True)
     question_number = db.Column(db.Integer, nullable=False)
     selected_answer = db.Column(db.String(1), nullable=True)
     correct_answer = db.Column(db.String(1), nullable=False)
     is_correct = db.Column(db.Boolean, nullable=False)
+    confidence = db.Column(db.Float, nullable=True)  # 0-1, how clearly the bubble read
 
     def __repr__(self):
         return f'<Answer {self.question_number}: {self.selected_answer} (Correct: {self.correct_answer})>'
@@ -69,8 +75,76 @@ class Quiz(db.Model):
     answer_key = db.Column(db.String(100), nullable=False)  # Stores answers as string "ABCDABCD..."
     section_id = db.Column(db.Integer, db.ForeignKey('section.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # When the answer key last changed (see regrade.py)
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)
 
     section = db.relationship('Section', backref='quizzes', lazy=True)
 
     def __repr__(self):
-        return f'<Quiz {self.title}: {self.num_items} items>'
\ No newline at end of file
+        return f'<Quiz {self.title}: {self.num_items} items>'
+
+class ResultCache(db.Model):
+    """Maps the content hash of an upload and the template it was graded with to its ScanResult."""
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False)
+    template_used = db.Column(db.String(50), nullable=False)
+    scan_result_id = db.Column(db.Integer, db.ForeignKey('scan_result.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('content_hash', 'template_used', name='uq_result_cache_hash_template'),)
+
+    def __repr__(self):
+        return f'<ResultCache {self.content_hash[:12]} {self.template_used}: {self.scan_result_id}>'
+
+class BatchJob(db.Model):
+    """A batch of uploaded sheets graded in the background (see batch_jobs.py)."""
+    id = db.Column(db.Integer, primary_key=True)
+    template_used = db.Column(db.String(50), nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=True)  # the quiz to grade against, if any
+    # 'open' while files are still being added, 'closed' once the submission is complete
+    status = db.Column(db.String(20), nullable=False, default='open')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    closed_at = db.Column(db.DateTime, nullable=True)
+
+    items = db.relationship('BatchItem', backref='job', lazy=True, order_by='BatchItem.id')
+
+    def __repr__(self):
+        return f'<BatchJob {self.id} {self.template_used}: {self.status}>'
+
+class BatchItem(db.Model):
+    """One file of a batch: queued, grading, done or error."""
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('batch_job.id'), nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=False)
+    content_hash = db.Column(db.String(64), nullable=False)
+    file_path = db.Column(db.String(255), nullable=False)
+    extension = db.Column(db.String(10), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    error = db.Column(db.String(255), nullable=True)
+    scan_result_id = db.Column(db.Integer, db.ForeignKey('scan_result.id'), nullable=True)
+    score = db.Column(db.Integer, nullable=True)
+    total_questions = db.Column(db.Integer, nullable=True)
+    percentage = db.Column(db.Float, nullable=True)
+    # Process grading the item, and when its status last changed (for stalled-item recovery)
+    worker = db.Column(db.String(50), nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<BatchItem {self.id} {self.filename}: {self.status}>'
+
+class BatchUpload(db.Model):
+    """A file being uploaded to a batch in chunks (see chunked_upload.py); becomes a BatchItem once complete."""
+    id = db.Column(db.String(32), primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('batch_job.id'), nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=False)
+    extension = db.Column(db.String(10), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    # Set when the last chunk arrives and the file is queued for grading
+    completed_at = db.Column(db.DateTime, nullable=True)
+    # The BatchItem it became; a ZIP archive becomes several (counted in entries) and has none
+    item_id = db.Column(db.Integer, db.ForeignKey('batch_item.id'), nullable=True)
+    entries = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<BatchUpload {self.id} {self.filename}: {self.size} bytes>'
@@ -0,0 +1,145 @@
+"""
+Annotated overlays for stored scans, rendered on demand and cached on disk.
+
+An overlay is a downscaled copy of ScanResult.image_path with the scanner's
+view drawn on top: the option it picked for each question (green when
+correct, red when not), the correct option outlined, and questions where no
+mark was detected, or that read with low confidence, outlined in amber.
+
+Nothing is drawn at grading time. The first view of a scan renders it into
+UPLOAD_FOLDER/overlays/; later views are served from there. The cache key
+covers the image file and the stored answers, so a regrade or a recompressed
+original gets a fresh overlay.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+
+from models import Answer
+
+OVERLAY_DIR = 'overlays'
+# Rendered heights; 'full' matches the height the scanner works at
+OVERLAY_SIZES = {'thumb': 300, 'full': 800}
+OVERLAY_QUALITY = 80
+# Bump when the drawing changes so old cache entries are ignored
+OVERLAY_VERSION = 3
+
+CORRECT_COLOUR = (60, 180, 75)
+WRONG_COLOUR = (40, 40, 220)
+KEY_COLOUR = (60, 180, 75)
+UNCLEAR_COLOUR = (0, 165, 255)
+
+
+def _cache_key(scan_result, answers, size):
+    stat = os.stat(scan_result.image_path)
+    hasher = hashlib.sha256()
+    hasher.update(f"{OVERLAY_VERSION}|{size}|{scan_result.template_used}|{scan_result.image_path}|"
+                  f"{stat.st_mtime_ns}|{stat.st_size}".encode())
+    for answer in answers:
+        hasher.update(f"|{answer.question_number}:{answer.selected_answer}:{answer.correct_answer}:"
+                      f"{answer.confidence}".encode())
+    return hasher.hexdigest()[:16]
+
+
+def _load_image(image_path):
+    """Read the stored sheet; for a PDF, its first page."""
+    import cv2
+
+    if not image_path.lower().endswith('.pdf'):
+        return cv2.imread(image_path)
+
+    from pdf2image import convert_from_path
+    pages = convert_from_path(image_path, first_page=1, last_page=1)
+    if not pages:
+        return None
+    tmp_dir = tempfile.mkdtemp(prefix='overlay_')
+    try:
+        page_path = os.path.join(tmp_dir, 'page.png')
+        pages[0].save(page_path, 'PNG')
+        return cv2.imread(page_path)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def render_overlay(scanner, scan_result, answers, height):
+    """Draw the overlay for a scan at the given height. Returns a BGR image or None."""
+    import cv2
+    from scanner import GRADE_CONFIDENCE_MIN
+
+    img = _load_image(scan_result.image_path)
+    if img is None:
+        return None
+    scale = height / img.shape[0]
+    img = cv2.resize(img, (int(img.shape[1] * scale), height), interpolation=cv2.INTER_AREA)
+
+    question_count = max([a.question_number for a in answers] + [scan_result.total_questions or 0])
+    regions = scanner.answer_regions(scan_result.template_used, question_count, img.shape[0], img.shape[1])
+    template = scanner.templates.get(scan_result.template_used)
+    options = template['choices'] if template else []
+    marks = img.copy()
+    thickness = 1 if height < 500 else 2
+
+    for answer in answers:
+        region = regions.get(answer.question_number)
+        if not region:
+            continue
+        y1, y2, x1, x2 = region
+        option_width = (x2 - x1) / len(options)
+
+        def cell(option):
+            i = options.index(option)
+            return (int(x1 + i * option_width), y1), (int(x1 + (i + 1) * option_width), y2)
+
+        if answer.selected_answer in options:
+            colour = CORRECT_COLOUR if answer.is_correct else WRONG_COLOUR
+            cv2.rectangle(marks, *cell(answer.selected_answer), colour, -1)
+        if answer.selected_answer not in options or (
+                answer.confidence is not None and answer.confidence < GRADE_CONFIDENCE_MIN):
+            cv2.rectangle(img, (x1, y1), (x2, y2), UNCLEAR_COLOUR, thickness)
+        if answer.correct_answer in options and not answer.is_correct:
+            cv2.rectangle(img, *cell(answer.correct_answer), KEY_COLOUR, thickness)
+
+    # Translucent fills so the pencil marks stay visible underneath
+    return cv2.addWeighted(marks, 0.35, img, 0.65, 0)
+
+
+def overlay_path(get_scanner, scan_result, size, upload_folder):
+    """
+    Return the cached overlay for a scan, rendering it on the first request.
+    get_scanner returns the scanner and is only called to render, so serving
+    a cached overlay doesn't load the scanner.
+    Returns None when the scan has no stored image (or it can't be read).
+    """
+    if not scan_result.image_path or not os.path.exists(scan_result.image_path):
+        return None
+    answers = Answer.query.filter_by(scan_result_id=scan_result.id).order_by(Answer.question_number).all()
+
+    cache_dir = os.path.join(upload_folder, OVERLAY_DIR)
+    prefix = f"scan{scan_result.id}_{size}_"
+    path = os.path.join(cache_dir, f"{prefix}{_cache_key(scan_result, answers, size)}.jpg")
+    if os.path.exists(path):
+        return path
+
+    import cv2
+
+    img = render_overlay(get_scanner(), scan_result, answers, OVERLAY_SIZES[size])
+    if img is None:
+        return None
+    ok, data = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, OVERLAY_QUALITY])
+    if not ok:
+        return None
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # Drop overlays of this scan drawn from older answers or images
+    for entry in os.scandir(cache_dir):
+        if entry.name.startswith(prefix):
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.part')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data.tobytes())
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,160 @@
+"""
+Regrade stored scans after an answer key changes, without rescanning.
+
+    flask regrade --quiz 3                      # quiz 3's scans, against its current key
+    flask regrade --quiz 3 --key ABCDABCD...    # set quiz 3's key, then regrade
+    flask regrade --template standard_20        # scans graded with the default key
+    flask regrade --quiz 3 --dry-run            # count what would change
+
+The selected answers are already stored, so a regrade is three UPDATE
+statements run in one write transaction: one resets correct_answer and
+is_correct on the answers whose key letter changed, one marks answers to
+questions no longer in the key as incorrect, and one recounts score,
+total_questions and percentage on the scans whose score actually changed
+(and the batch items that show them).
+Scans graded against a quiz (scan_result.quiz_id) are regraded with that
+quiz; the rest with the default key of their template (the question table,
+as scanner.get_correct_answers uses it). Images are never read.
+"""
+import time
+from datetime import datetime
+
+import click
+from sqlalchemy import Numeric, and_, case, cast, func, or_, select, update
+
+from models import db, Answer, BatchItem, Quiz, ScanResult
+from roster import answer_key
+from storage import write_transaction
+from template_registry import TEMPLATE_REGISTRY
+
+
+def template_key(template_name):
+    """The default answer key for a template: the question table, or the scanner's demo key when it is empty."""
+    questions = TEMPLATE_REGISTRY[template_name].questions
+    key = answer_key(questions)
+    if not key:
+        # As BubbleSheetScanner._get_demo_answers
+        key = {str(i): 'ABCD'[i % 4] for i in range(1, questions + 1)}
+    return key
+
+
+def _regrade(scope, key, dry_run=False, before=None):
+    """
+    Regrade the scans matched by scope (a condition on ScanResult) against
+    key ({question number: letter}). before() runs first in the same
+    transaction. Returns the report.
+    """
+    started = time.perf_counter()
+    key = {int(q): letter for q, letter in key.items()}
+    questions = list(key)
+    total = len(key)
+    scans = select(ScanResult.id).where(scope)
+    letter = case(key, value=Answer.question_number)
+    now_correct = case((and_(Answer.selected_answer.isnot(None), Answer.selected_answer == letter), True),
+                       else_=False)
+    no_sync = {'synchronize_session': False}
+
+    with write_transaction(db.session):
+        if before:
+            before()
+        scan_count = db.session.execute(select(func.count()).where(scope)).scalar()
+        answers_changed = db.session.execute(
+            update(Answer)
+            .where(Answer.scan_result_id.in_(scans), Answer.question_number.in_(questions),
+                   or_(Answer.correct_answer != letter, Answer.is_correct != now_correct))
+            .values(correct_answer=letter, is_correct=now_correct),
+            execution_options=no_sync).rowcount
+        answers_changed += db.session.execute(
+            update(Answer)
+            .where(Answer.scan_result_id.in_(scans), Answer.question_number.notin_(questions),
+                   Answer.is_correct.is_(True))
+            .values(is_correct=False),
+            execution_options=no_sync).rowcount
+
+        score = (select(func.count(Answer.id))
+                 .where(Answer.scan_result_id == ScanResult.id, Answer.question_number.in_(questions),
+                        Answer.is_correct.is_(True))
+                 .scalar_subquery())
+        percentage = func.round(cast(score * 100.0 / total, Numeric), 1) if total else 0
+        scores_changed = db.session.execute(
+            update(ScanResult)
+            .where(scope, or_(ScanResult.score != score, ScanResult.total_questions != total))
+            .values(score=score, total_questions=total, percentage=percentage),
+            execution_options=no_sync).rowcount
+
+        # Keep the batch progress records in step with the scans they point to
+        db.session.execute(
+            update(BatchItem)
+            .where(BatchItem.scan_result_id == ScanResult.id, scope,
+                   or_(BatchItem.score != ScanResult.score, BatchItem.total_questions != ScanResult.total_questions))
+            .values(score=ScanResult.score, total_questions=ScanResult.total_questions,
+                    percentage=ScanResult.percentage),
+            execution_options=no_sync)
+        if dry_run:
+            db.session.rollback()
+
+    return {
+        'scans': scan_count,
+        'answers_changed': answers_changed,
+        'scores_changed': scores_changed,
+        'dry_run': dry_run,
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+
+
+def regrade_quiz(quiz_id, new_key=None, dry_run=False):
+    """
+    Regrade the scans graded against a quiz. With new_key (a string of
+    letters, one per item) the quiz's key is replaced first, in the same
+    transaction. Returns the report.
+    """
+    quiz = db.session.get(Quiz, quiz_id)
+    key = new_key if new_key is not None else quiz.answer_key
+
+    def set_key():
+        if new_key is not None:
+            db.session.execute(update(Quiz).where(Quiz.id == quiz_id)
+                               .values(answer_key=new_key, updated_at=datetime.utcnow()))
+
+    report = _regrade(ScanResult.quiz_id == quiz_id,
+                      {str(i): letter for i, letter in enumerate(key, start=1)}, dry_run, set_key)
+    print(f"Regraded quiz {quiz_id}: {report}")
+    return report
+
+
+def regrade_template(template_name, dry_run=False):
+    """Regrade the scans of a template that weren't graded against a quiz. Returns the report."""
+    report = _regrade(and_(ScanResult.template_used == template_name, ScanResult.quiz_id.is_(None)),
+                      template_key(template_name), dry_run)
+    print(f"Regraded template {template_name}: {report}")
+    return report
+
+
+def init_regrade(app):
+    """Register the `flask regrade` command."""
+    @app.cli.command('regrade')
+    @click.option('--quiz', 'quiz_id', type=int, default=None, help="Regrade this quiz's scans.")
+    @click.option('--key', 'new_key', default=None, help='New answer key for --quiz, one letter per item.')
+    @click.option('--template', '-t', default=None, help='Regrade scans of this template graded with the default key.')
+    @click.option('--dry-run', is_flag=True, help='Report what would change without changing it.')
+    def regrade_command(quiz_id, new_key, template, dry_run):
+        """Recompute scores from the stored answers after an answer key changes."""
+        if (quiz_id is None) == (template is None):
+            raise click.UsageError("Give exactly one of --quiz or --template")
+        if quiz_id is not None:
+            quiz = db.session.get(Quiz, quiz_id)
+            if quiz is None:
+                raise click.BadParameter(f"No quiz with id {quiz_id}", param_hint='--quiz')
+            if new_key is not None:
+                new_key = new_key.strip().upper()
+                if len(new_key) != quiz.num_items:
+                    raise click.BadParameter(f"Need {quiz.num_items} letters, one per item", param_hint='--key')
+            report = regrade_quiz(quiz_id, new_key, dry_run)
+        else:
+            if new_key is not None:
+                raise click.UsageError("--key only applies to --quiz; the template key is the question table")
+            if template not in TEMPLATE_REGISTRY:
+                raise click.BadParameter(f"Unknown template {template}", param_hint='--template')
+            report = regrade_template(template, dry_run)
+        click.echo(f"{'Would change' if dry_run else 'Changed'} {report['scores_changed']} of "
+                   f"{report['scans']} scores ({report['answers_changed']} answers) in {report['seconds']} s")
@@ -0,0 +1,335 @@
+"""
+Upload retention: recompression, cleanup and a disk budget for UPLOAD_FOLDER.
+
+What lives in the upload folder and what happens to it:
+
+    objects/ab/<sha256>.<ext>   originals (see upload_store.py). Kept while a
+                                ScanResult points at them, recompressed to
+                                JPEG or WebP. Unreferenced ones are deleted
+                                after RETENTION_UNREFERENCED_AGE. Files still
+                                waiting in a batch job (see batch_jobs.py)
+                                are left alone until graded.
+    <uuid>.<ext>                originals saved before content addressing,
+                                treated the same way.
+    page_*.png, work/*,         derivatives and leftovers of failed scans,
+    temp_student_roi_*,         deleted after RETENTION_DERIVATIVE_AGE.
+    objects/*.part
+    debug_q*.png                debug artifacts, deleted after RETENTION_DEBUG_AGE.
+    incoming/*.part             unfinished chunked uploads (see chunked_upload.py),
+                                deleted after RETENTION_PARTIAL_AGE without a new
+                                chunk; their uploads are forgotten.
+    overlays/*                  rendered result overlays (see overlay.py), deleted
+                                after RETENTION_CACHE_AGE; they are redrawn on demand.
+
+If the folder is still over RETENTION_DISK_BUDGET_MB, the oldest files go
+first in that same order, down to referenced originals, whose ScanResult
+then loses its image.
+
+Run it with `flask retention` (add --dry-run to only report), or set
+RETENTION_INTERVAL to sweep in a background thread. Only one process sweeps
+at a time.
+"""
+import fcntl
+import os
+import threading
+import time
+import traceback
+
+import click
+
+from models import db, BatchItem, BatchUpload, ScanResult
+from storage import write_transaction
+from upload_store import OBJECTS_DIR, WORK_DIR
+from overlay import OVERLAY_DIR
+from chunked_upload import INCOMING_DIR
+
+RETENTION_DEFAULTS = {
+    'RETENTION_INTERVAL': 0,                  # seconds between background sweeps, 0 = off
+    'RETENTION_RECOMPRESS_FORMAT': 'jpg',     # jpg, webp or off
+    'RETENTION_QUALITY': 85,
+    'RETENTION_MAX_DIMENSION': 2000,          # longest side of kept originals, in pixels
+    'RETENTION_DERIVATIVE_AGE': 3600,
+    'RETENTION_DEBUG_AGE': 86400,
+    'RETENTION_PARTIAL_AGE': 86400,
+    'RETENTION_CACHE_AGE': 7 * 86400,
+    'RETENTION_UNREFERENCED_AGE': 86400,
+    'RETENTION_DISK_BUDGET_MB': 0,            # 0 = no budget
+}
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
+ORIGINAL_EXTENSIONS = IMAGE_EXTENSIONS | {'pdf'}
+
+# Order in which files are given up to meet the disk budget
+BUDGET_ORDER = ['cache', 'derivative', 'debug', 'partial', 'unreferenced', 'original']
+
+
+def retention_settings(app):
+    settings = {}
+    for key, default in RETENTION_DEFAULTS.items():
+        value = app.config.get(key, os.environ.get(key, default))
+        settings[key] = value if isinstance(default, str) else float(value)
+    return settings
+
+
+def _classify(rel_path, name):
+    """Sort a file under the upload folder into original, derivative, debug, cache or partial (or None to leave it alone)."""
+    parts = rel_path.split(os.sep)
+    extension = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+    if name.startswith('debug_q'):
+        return 'debug'
+    if parts[0] == OVERLAY_DIR and not name.endswith('.part'):
+        return 'cache'
+    if parts[0] == INCOMING_DIR:
+        return 'partial'
+    if name.startswith(('page_', 'temp_student_roi_')) or name.endswith('.part') or parts[0] == WORK_DIR:
+        return 'derivative'
+    if parts[0] == OBJECTS_DIR and len(parts) == 3 and extension in ORIGINAL_EXTENSIONS:
+        return 'original'
+    if len(parts) == 1 and extension in ORIGINAL_EXTENSIONS:
+        return 'original'
+    return None
+
+
+def scan_upload_folder(upload_folder):
+    """Walk the upload folder once with os.scandir. Returns a list of file records."""
+    files = []
+    stack = [upload_folder]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+                continue
+            rel_path = os.path.relpath(entry.path, upload_folder)
+            kind = _classify(rel_path, entry.name)
+            if kind is None:
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            files.append({'path': entry.path, 'kind': kind, 'size': stat.st_size, 'mtime': stat.st_mtime})
+    return files
+
+
+def _referenced_paths():
+    """Absolute paths of every image a ScanResult points at."""
+    rows = db.session.query(ScanResult.image_path).filter(ScanResult.image_path.isnot(None)).distinct()
+    return {os.path.abspath(path) for (path,) in rows}
+
+
+def _pending_paths():
+    """Absolute paths of uploads queued or being graded in a batch job."""
+    rows = db.session.query(BatchItem.file_path).filter(BatchItem.status.in_(('queued', 'grading'))).distinct()
+    return {os.path.abspath(path) for (path,) in rows}
+
+
+def _forget_uploads(upload_ids):
+    """Drop unfinished chunked uploads whose partial files were deleted, so their jobs can complete."""
+    with write_transaction(db.session):
+        (BatchUpload.query.filter(BatchUpload.id.in_(upload_ids), BatchUpload.completed_at.is_(None))
+         .delete(synchronize_session=False))
+
+
+def _repoint(old_path, new_path):
+    """Move every ScanResult from old_path to new_path (None = the image is gone)."""
+    with write_transaction(db.session):
+        for scan_result in ScanResult.query.filter(ScanResult.image_path.in_(_stored_forms(old_path))):
+            # Keep the stored path in the form it was saved in (usually relative)
+            if new_path and not os.path.isabs(scan_result.image_path):
+                scan_result.image_path = os.path.relpath(new_path)
+            else:
+                scan_result.image_path = new_path
+
+
+def _stored_forms(path):
+    # image_path may have been saved relative to the working directory
+    return {path, os.path.relpath(path)}
+
+
+def _remove_empty_shards(upload_folder):
+    """Drop object shard directories that no longer hold anything."""
+    objects_dir = os.path.join(upload_folder, OBJECTS_DIR)
+    if not os.path.isdir(objects_dir):
+        return
+    for entry in os.scandir(objects_dir):
+        if entry.is_dir(follow_symlinks=False):
+            try:
+                os.rmdir(entry.path)
+            except OSError:
+                pass
+
+
+def recompress(path, settings):
+    """
+    Re-encode an original as JPEG or WebP, capping its longest side.
+    Returns the new path, or None if it was left as is.
+    """
+    import cv2
+
+    target = settings['RETENTION_RECOMPRESS_FORMAT']
+    extension = path.rsplit('.', 1)[-1].lower()
+    if target == 'off' or extension not in IMAGE_EXTENSIONS or extension == target:
+        return None
+
+    img = cv2.imread(path)
+    if img is None:
+        return None
+    longest = max(img.shape[:2])
+    if longest > settings['RETENTION_MAX_DIMENSION']:
+        scale = settings['RETENTION_MAX_DIMENSION'] / longest
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    if target == 'webp':
+        ok, data = cv2.imencode('.webp', img, [cv2.IMWRITE_WEBP_QUALITY, int(settings['RETENTION_QUALITY'])])
+    else:
+        ok, data = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, int(settings['RETENTION_QUALITY'])])
+    if not ok or len(data) >= os.path.getsize(path):
+        return None
+
+    # Same name stem, so the content hash still finds the object
+    new_path = path.rsplit('.', 1)[0] + '.' + target
+    tmp_path = new_path + '.part'
+    with open(tmp_path, 'wb') as f:
+        f.write(data.tobytes())
+    os.replace(tmp_path, new_path)
+    return new_path
+
+
+def run_retention(app, dry_run=False):
+    """One sweep over the upload folder. Returns a report of what was (or would be) done."""
+    settings = retention_settings(app)
+    upload_folder = os.path.abspath(app.config['UPLOAD_FOLDER'])
+    now = time.time()
+    report = {'recompressed': 0, 'deleted': 0, 'bytes_freed': 0, 'over_budget_deleted': 0, 'total_bytes': 0}
+
+    expired_uploads = []
+
+    def remove(record, reason_key='deleted'):
+        report[reason_key] += 1
+        report['bytes_freed'] += record['size']
+        if dry_run:
+            return
+        if record['kind'] == 'partial':
+            expired_uploads.append(os.path.basename(record['path']).rsplit('.', 1)[0])
+        try:
+            os.remove(record['path'])
+        except FileNotFoundError:
+            pass
+
+    with app.app_context():
+        referenced = _referenced_paths()
+        pending = _pending_paths()
+        db.session.commit()
+        files = scan_upload_folder(upload_folder)
+        kept = []
+        pending_bytes = 0
+
+        for record in files:
+            age = now - record['mtime']
+            if os.path.abspath(record['path']) in pending:
+                pending_bytes += record['size']
+                continue
+            if record['kind'] == 'original' and os.path.abspath(record['path']) not in referenced:
+                record['kind'] = 'unreferenced'
+
+            if record['kind'] == 'derivative' and age > settings['RETENTION_DERIVATIVE_AGE']:
+                remove(record)
+            elif record['kind'] == 'debug' and age > settings['RETENTION_DEBUG_AGE']:
+                remove(record)
+            elif record['kind'] == 'cache' and age > settings['RETENTION_CACHE_AGE']:
+                remove(record)
+            elif record['kind'] == 'partial' and age > settings['RETENTION_PARTIAL_AGE']:
+                remove(record)
+            elif record['kind'] == 'unreferenced' and age > settings['RETENTION_UNREFERENCED_AGE']:
+                remove(record)
+            elif record['kind'] == 'original' and not dry_run:
+                try:
+                    new_path = recompress(record['path'], settings)
+                except Exception as e:
+                    print(f"Error recompressing {record['path']}: {e}")
+                    new_path = None
+                if new_path:
+                    _repoint(record['path'], new_path)
+                    old_size = record['size']
+                    os.remove(record['path'])
+                    record.update(path=new_path, size=os.path.getsize(new_path))
+                    report['recompressed'] += 1
+                    report['bytes_freed'] += old_size - record['size']
+                kept.append(record)
+            else:
+                kept.append(record)
+
+        # Enforce the disk budget, cheapest losses and oldest files first
+        budget = settings['RETENTION_DISK_BUDGET_MB'] * 1024 * 1024
+        total = pending_bytes + sum(record['size'] for record in kept)
+        if budget and total > budget:
+            kept.sort(key=lambda record: (BUDGET_ORDER.index(record['kind']), record['mtime']))
+            for record in kept:
+                if total <= budget:
+                    break
+                if record['kind'] == 'original' and not dry_run:
+                    _repoint(record['path'], None)
+                remove(record, 'over_budget_deleted')
+                total -= record['size']
+        report['total_bytes'] = total
+        if expired_uploads:
+            _forget_uploads(expired_uploads)
+
+    if not dry_run:
+        _remove_empty_shards(upload_folder)
+    return report
+
+
+def _sweep_locked(app, dry_run=False):
+    """Run a sweep unless another process holds the retention lock (then returns None)."""
+    lock_path = os.path.join(app.config['UPLOAD_FOLDER'], '.retention.lock')
+    with open(lock_path, 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        try:
+            return run_retention(app, dry_run=dry_run)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def start_retention_thread(app):
+    """Sweep every RETENTION_INTERVAL seconds on a daemon thread (no-op when the interval is 0)."""
+    interval = retention_settings(app)['RETENTION_INTERVAL']
+    if not interval:
+        return None
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                report = _sweep_locked(app)
+                if report:
+                    print(f"Upload retention: {report}")
+            except Exception as e:
+                print(f"Error during upload retention: {e}")
+                traceback.print_exc()
+
+    thread = threading.Thread(target=loop, name='upload-retention', daemon=True)
+    thread.start()
+    return thread
+
+
+def init_retention(app):
+    """Register the `flask retention` command."""
+    @app.cli.command('retention')
+    @click.option('--dry-run', is_flag=True, help='Only report what would be removed.')
+    def retention_command(dry_run):
+        """Recompress kept uploads, delete derivatives and orphans, enforce the disk budget."""
+        report = _sweep_locked(app, dry_run=dry_run)
+        if report is None:
+            click.echo("Another retention sweep is running; try again later.")
+            return
+        prefix = 'Would free' if dry_run else 'Freed'
+        click.echo(f"{prefix} {report['bytes_freed'] / 1024 / 1024:.1f} MB: "
+                   f"{report['recompressed']} recompressed, {report['deleted']} deleted, "
+                   f"{report['over_budget_deleted']} deleted for the disk budget; "
+                   f"{report['total_bytes'] / 1024 / 1024:.1f} MB kept")
@@ -0,0 +1,103 @@
+"""
+Per-process caches of the student roster and the answer keys.
+
+Matching an OCR'd header against the roster used to load every student for
+every sheet, and grading re-read the answer key each time. Both are now held
+in memory and loaded once per worker (see warmup.py). Each lookup first runs a
+one-row fingerprint query (row count and highest id); any insert or delete,
+from this worker or another, changes it and the cache is reloaded. Students
+and quizzes that are edited in place (roster imports, answer key fixes) get
+a new updated_at, which is part of their fingerprint; code that edits other
+rows in place must call invalidate().
+
+Lookups need an app context, like the queries they replace.
+"""
+import threading
+
+from sqlalchemy import text
+
+from models import db, Student
+
+CHOICES = ['A', 'B', 'C', 'D']
+
+_lock = threading.Lock()
+_cache = {}
+
+
+class RosterIndex:
+    """The roster prepared for matching: students by ID, and (upper-case name, name, ID) for fuzzy matching."""
+
+    def __init__(self, students):
+        self.by_id = {}
+        self.names = []
+        for name, student_id in students:
+            if student_id and student_id not in self.by_id:
+                self.by_id[student_id] = name
+            self.names.append((name.upper(), name, student_id))
+
+    def __len__(self):
+        return len(self.names)
+
+
+def _fingerprint(table, key='id', extra=''):
+    row = db.session.execute(text(f"SELECT COUNT(*), MAX({key}){extra} FROM {table}")).fetchone()
+    return tuple(row)
+
+
+def _cached(name, fingerprint, load):
+    """Return the cached value for name, reloading it when the table fingerprint changed."""
+    entry = _cache.get(name)
+    if entry is not None and entry[0] == fingerprint:
+        return entry[1]
+    value = load()
+    with _lock:
+        _cache[name] = (fingerprint, value)
+    return value
+
+
+def roster_index():
+    """The RosterIndex of every student."""
+    def load():
+        rows = db.session.query(Student.name, Student.student_id).order_by(Student.id).all()
+        return RosterIndex(rows)
+    # Roster imports update students in place, which bumps updated_at
+    return _cached('roster', _fingerprint('student', extra=', MAX(updated_at)'), load)
+
+
+def _question_key():
+    """The question table as {question number: letter}."""
+    def load():
+        rows = db.session.execute(text("SELECT question_id, correct_answer FROM question ORDER BY question_id"))
+        return {str(row[0]): row[1] for row in rows}
+    return _cached('questions', _fingerprint('question'), load)
+
+
+def answer_key(question_count=None):
+    """
+    The default answer key (the question table) for a sheet of question_count
+    questions: truncated to it, or extended with A-D in rotation when the
+    table has fewer questions. Empty when the table is. Returns a new dict.
+    """
+    key = _question_key()
+    if not question_count:
+        return dict(key)
+    answers = {q: letter for q, letter in key.items() if int(q) <= question_count}
+    if key and len(key) < question_count:
+        for i in range(len(key) + 1, question_count + 1):
+            answers[str(i)] = CHOICES[(i - 1) % 4]
+    return answers
+
+
+def quiz_answer_keys():
+    """Every quiz's answer key compiled to {quiz id: {question number: letter}}."""
+    def load():
+        rows = db.session.execute(text("SELECT id, answer_key FROM quiz"))
+        return {row[0]: {str(i): letter for i, letter in enumerate(row[1], start=1)} for row in rows}
+    # Keys are edited in place (see regrade.py), which bumps updated_at
+    return _cached('quizzes', _fingerprint('quiz', extra=', MAX(updated_at)'), load)
+
+
+def invalidate():
+    """Drop every cached table in this process."""
+    with _lock:
+        _cache.clear()
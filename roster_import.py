@@ -0,0 +1,124 @@
+"""
+Roster import: load a CSV of students (name, student ID) into a section.
+
+    flask import-roster district.csv --section 2
+
+Rows are matched to existing students by student ID and upserted: a new ID
+is inserted, a known one has its name and section updated when they differ,
+and anything else is left alone. Students are never deleted, so their scans
+stay linked; a student missing from the file simply stays where they are.
+The file is read as a stream, ROSTER_IMPORT_BATCH rows at a time, each batch
+one lookup, one multi-row INSERT and one executemany UPDATE, all inside one
+transaction: an import that fails part way changes nothing. Changed rows
+get a new updated_at, which changes the roster cache fingerprint (see
+roster.py) in every worker at once.
+"""
+import codecs
+import csv
+import os
+import time
+from datetime import datetime
+
+import click
+from sqlalchemy import bindparam, insert, select, update
+
+from models import db, Section, Student
+from roster import invalidate
+from storage import write_transaction
+
+ROSTER_IMPORT_DEFAULTS = {
+    'ROSTER_IMPORT_BATCH': 1000,   # CSV rows looked up and written together
+}
+
+
+def roster_import_settings(app):
+    settings = {}
+    for key, default in ROSTER_IMPORT_DEFAULTS.items():
+        settings[key] = int(app.config.get(key, os.environ.get(key, default)))
+    return settings
+
+
+def _read_rows(stream):
+    """(name, student ID) for each row of a binary CSV stream, after the header row."""
+    reader = csv.reader(codecs.iterdecode(stream, 'utf-8-sig'))
+    next(reader, None)  # Skip header row
+    for row in reader:
+        if len(row) >= 2:
+            yield row[0].strip(), row[1].strip()
+        else:
+            yield None
+
+
+def _upsert_batch(batch, section_id, now, report):
+    """Upsert one batch of {student ID: name} (the last row wins within a batch)."""
+    existing = {}
+    for row in db.session.execute(select(Student.id, Student.student_id, Student.name, Student.section_id)
+                                  .where(Student.student_id.in_(list(batch))).order_by(Student.id)):
+        # Should an ID already be on file twice, the oldest row is the one kept up to date
+        existing.setdefault(row.student_id, row)
+    inserts = []
+    updates = []
+    for student_id, name in batch.items():
+        row = existing.get(student_id)
+        if row is None:
+            inserts.append({'name': name, 'student_id': student_id, 'section_id': section_id,
+                            'created_at': now, 'updated_at': now})
+        elif row.name != name or row.section_id != section_id:
+            updates.append({'row_id': row.id, 'name': name, 'section_id': section_id, 'updated_at': now})
+        else:
+            report['unchanged'] += 1
+    if inserts:
+        db.session.execute(insert(Student), inserts)
+    if updates:
+        db.session.execute(
+            update(Student.__table__).where(Student.__table__.c.id == bindparam('row_id'))
+            .values(name=bindparam('name'), section_id=bindparam('section_id'), updated_at=bindparam('updated_at')),
+            updates)
+    report['inserted'] += len(inserts)
+    report['updated'] += len(updates)
+
+
+def import_roster(stream, section_id, batch_size=1000):
+    """
+    Upsert the students in a CSV (binary stream of 'Name,Student ID' rows
+    after a header) into a section. Returns the report: inserted, updated,
+    unchanged and skipped (rows without a name or student ID) counts.
+    """
+    started = time.perf_counter()
+    report = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0}
+    now = datetime.utcnow()
+    with write_transaction(db.session):
+        batch = {}
+        for row in _read_rows(stream):
+            if row is None or not row[0] or not row[1]:
+                report['skipped'] += 1
+                continue
+            name, student_id = row
+            if student_id in batch:
+                # Repeated within the batch: the last row is written, earlier ones count as unchanged
+                report['unchanged'] += 1
+            batch[student_id] = name
+            if len(batch) >= batch_size:
+                _upsert_batch(batch, section_id, now, report)
+                batch = {}
+        if batch:
+            _upsert_batch(batch, section_id, now, report)
+    # The fingerprint covers other workers; drop this one's copy now
+    invalidate()
+    report['seconds'] = round(time.perf_counter() - started, 2)
+    print(f"Roster import into section {section_id}: {report}")
+    return report
+
+
+def init_roster_import(app):
+    """Register the `flask import-roster` command."""
+    @app.cli.command('import-roster')
+    @click.argument('csv_file', type=click.File('rb'))
+    @click.option('--section', 'section_id', type=int, required=True, help='Section to import the students into.')
+    def import_roster_command(csv_file, section_id):
+        """Upsert students from a 'Name,Student ID' CSV by student ID."""
+        if db.session.get(Section, section_id) is None:
+            raise click.BadParameter(f"No section with id {section_id}", param_hint='--section')
+        report = import_roster(csv_file, section_id, roster_import_settings(app)['ROSTER_IMPORT_BATCH'])
+        click.echo(f"{report['inserted']} inserted, {report['updated']} updated, {report['unchanged']} unchanged, "
+                   f"{report['skipped']} skipped in {report['seconds']} s")
@@ -1,24 +1,238 @@
 import os
 import base64
-import uuid
+import threading
 import traceback
 from datetime import datetime
-from flask import render_template, request, redirect, url_for, flash, jsonify
+from flask import render_template, request, redirect, url_for, flash, jsonify, send_file
 from random import choice
-import csv
-import io
 from werkzeug.utils import secure_filename
 from app import app, db, DEMO_MODE
-from models import Student, Question, ScanResult, Answer, Quiz, Section
-from scanner import BubbleSheetScanner
-
-# Initialize scanner
-scanner = BubbleSheetScanner()
+from models import Student, Question, ScanResult, Answer, Quiz, Section, ResultCache
+from upload_store import store_file, store_upload, work_path, find_cached_result, remember_result, copy_scan_result
+from metrics import init_metrics, stage
+from storage import write_transaction
+from roster import quiz_answer_keys
+from retention import init_retention, start_retention_thread
+from overlay import OVERLAY_SIZES, overlay_path
+from template_registry import TEMPLATE_REGISTRY, printed_templates, template_for_questions
+from warmup import init_warmup
+from batch_jobs import close_job, create_job, init_batch_jobs, start_batch_workers, submit_file
+from chunked_upload import init_chunked_uploads
+from bulk_grade import init_bulk_grade
+from hot_folder import init_hot_folder
+from regrade import init_regrade, regrade_quiz
+from similarity_views import init_similarity
+from roster_import import import_roster, init_roster_import, roster_import_settings
+
+# Shared scanner; it holds no per-request state, so it is safe across threads.
+# Created on first use, so workers that never scan don't load OpenCV and tesseract.
+_scanner = None
+_scanner_lock = threading.Lock()
+
+# Request timing, X-Trace support and the /metrics endpoint
+init_metrics(app)
+# `flask retention`, plus periodic sweeps when RETENTION_INTERVAL is set
+init_retention(app)
+start_retention_thread(app)
+
+@app.context_processor
+def inject_sheet_templates():
+    """The printed templates, for the template pickers and download links."""
+    return {'sheet_templates': printed_templates(), 'template_for_questions': template_for_questions}
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in {'png', 'jpg', 'jpeg', 'pdf'}
 
+def quiz_choices():
+    """The quizzes a sheet can be graded against, newest first, for the upload and batch forms."""
+    return Quiz.query.order_by(Quiz.created_at.desc()).all()
+
+def selected_quiz_id(value):
+    """The quiz id picked in a form or JSON body, or None for the template's own key."""
+    return int(value) if value not in (None, '') else None
+
+def get_scanner():
+    """The shared BubbleSheetScanner, importing the vision and OCR stack on the first call."""
+    global _scanner
+    if _scanner is None:
+        with _scanner_lock:
+            if _scanner is None:
+                from scanner import BubbleSheetScanner
+                _scanner = BubbleSheetScanner()
+    return _scanner
+
+# /ready and `flask warmup`; gunicorn.conf.py warms each worker before it takes traffic
+init_warmup(app, get_scanner)
+
+def scan_options(work_path=None):
+    """ScanOptions for a request, built from the app configuration."""
+    from scanner import ScanOptions
+    return ScanOptions(
+        upload_folder=app.config['UPLOAD_FOLDER'],
+        work_path=work_path,
+        debug_artifacts=app.config['DEBUG_ARTIFACTS'],
+        debug_sample_rate=app.config['DEBUG_ARTIFACT_SAMPLE_RATE']
+    )
+
+def save_scan_result(result, image_path, quiz_id=None):
+    """
+    Persist a SheetResult: find or create the student, then store the scan and its answers.
+    quiz_id records the quiz whose answer key graded it.
+    """
+    student_info = result.student
+
+    with stage('db_commit'), write_transaction(db.session):
+        # Create or get student
+        student = Student.query.filter_by(name=student_info['name']).first()
+        if not student:
+            student = Student(name=student_info['name'], student_id=student_info.get('id'))
+            db.session.add(student)
+            db.session.flush()
+
+        # Create scan result
+        score_info = result.score
+        scan_result = ScanResult(
+            student_id=student.id,
+            template_used=result.template,
+            score=score_info['correct'],
+            total_questions=score_info['total'],
+            percentage=score_info['percentage'],
+            image_path=image_path,
+            confidence=result.min_confidence,
+            regraded_questions=result.regraded_questions,
+            quiz_id=quiz_id
+        )
+        db.session.add(scan_result)
+        db.session.flush()
+
+        # Add answers
+        for q_num, answer in result.answers.items():
+            correct = result.correct_answers.get(q_num)
+            if correct is None:
+                # Past the end of a quiz shorter than the sheet; not part of the score
+                continue
+            is_correct = answer == correct
+
+            db_answer = Answer(
+                scan_result_id=scan_result.id,
+                question_number=int(q_num),
+                selected_answer=answer,
+                correct_answer=correct,
+                is_correct=is_correct,
+                confidence=result.confidence.get(q_num)
+            )
+            db.session.add(db_answer)
+
+    return student, scan_result
+
+# `flask grade`: headless bulk grading, scored and stored in batches (see batch_scoring.py)
+init_bulk_grade(app, get_scanner)
+# `flask regrade`: rescore stored answers after a key changes
+init_regrade(app)
+# /quiz/<id>/similarity and `flask similarity`: screen a quiz for copied answer patterns
+init_similarity(app)
+# `flask import-roster`: the student CSV import, from the command line
+init_roster_import(app)
+
+def grade_stored_upload(digest, filepath, extension, template_name, quiz_id=None):
+    """
+    Grade an upload kept in the content-addressed store, against quiz_id's
+    answer key when given (the scans are then linked to the quiz), otherwise
+    the template's.
+    Identical content already graded with the same template and quiz reuses that result
+    (attached to a new ScanResult when REUSE_ATTACH_NEW_RESULT is set).
+    Every page of a PDF is stored as its own scan (see grade_pdf_pages); the
+    first page's is the one returned and remembered.
+    Returns (scan_result, error, reused).
+    """
+    quiz_key = None
+    if quiz_id is not None:
+        quiz_key = quiz_answer_keys().get(quiz_id)
+        if quiz_key is None:
+            return None, f"No quiz with id {quiz_id}", False
+
+    previous = find_cached_result(digest, template_name, quiz_id)
+    if previous:
+        if app.config['REUSE_ATTACH_NEW_RESULT']:
+            return copy_scan_result(previous), None, True
+        return previous, None, True
+    # Don't keep a read transaction open while the sheet is scanned
+    db.session.commit()
+
+    if extension == 'pdf':
+        scan_result, error = grade_pdf_pages(digest, filepath, template_name, quiz_id, quiz_key)
+        if error:
+            return None, error, False
+    else:
+        # The stored original stays untouched; the scanner works on a resized copy
+        working_copy = work_path(app.config['UPLOAD_FOLDER'], digest)
+        try:
+            result, error = get_scanner().process_sheet(filepath, template_name, correct_answers=quiz_key,
+                                                        options=scan_options(working_copy))
+        finally:
+            if os.path.exists(working_copy):
+                os.remove(working_copy)
+
+        if error:
+            return None, error, False
+
+        student, scan_result = save_scan_result(result, filepath, quiz_id)
+    remember_result(digest, template_name, scan_result)
+    return scan_result, None, False
+
+def grade_pdf_pages(digest, filepath, template_name, quiz_id=None, quiz_key=None):
+    """
+    Grade every page of a stored PDF as its own sheet. The pages that read
+    are scored together as one matrix, against quiz_key when given, and stored
+    in bulk (see batch_scoring.py), each scan pointing at its own page image
+    in the upload store.
+    Returns (first page's scan_result, None), or (None, error) when no page could be graded.
+    """
+    # NumPy is loaded with the scanner, not when the app starts
+    from batch_scoring import save_scored, score_sheets
+
+    scanner = get_scanner()
+    image_paths = scanner.convert_pdf_to_images(filepath)
+    if not image_paths:
+        return None, 'Failed to convert PDF to images'
+
+    results = []
+    page_paths = []
+    first_error = None
+    for page, page_path in enumerate(image_paths, start=1):
+        working_copy = work_path(app.config['UPLOAD_FOLDER'], digest)
+        try:
+            # Scored below against the quiz's key, or that of whichever template each page turns out to be
+            result, error = scanner.process_sheet(page_path, template_name, correct_answers={},
+                                                  options=scan_options(working_copy))
+        finally:
+            if os.path.exists(working_copy):
+                os.remove(working_copy)
+        if error:
+            print(f"Page {page} of {filepath} not graded: {error}")
+            first_error = first_error or (f"Page {page}: {error}" if len(image_paths) > 1 else error)
+        else:
+            results.append(result)
+            page_paths.append(page_path)
+    if not results:
+        return None, first_error
+
+    # Keep each graded page, so its scan's overlay shows that page rather than the PDF's first
+    stored_pages = [store_file(page_path, 'png', app.config['UPLOAD_FOLDER'])[1] for page_path in page_paths]
+
+    batch = score_sheets(results, lambda template: quiz_key if quiz_key is not None else scanner.get_correct_answers(
+        TEMPLATE_REGISTRY[template].questions))
+    scan_ids = save_scored(batch, stored_pages, quiz_id)
+    print(f"Graded {len(results)} of {len(image_paths)} pages of {filepath}")
+    return db.session.get(ScanResult, scan_ids[0]), None
+
+# The /batch-jobs API; its grading threads use grade_stored_upload
+init_batch_jobs(app, grade_stored_upload)
+init_chunked_uploads(app, grade_stored_upload)
+# `flask watch`: grade sheets dropped into a folder
+init_hot_folder(app, grade_stored_upload)
+
 def init_db():
     """Initialize database tables"""
     with app.app_context():
@@ -31,7 +245,7 @@ def index():
     # Get recent scan results
     recent_scans = ScanResult.query.order_by(ScanResult.scan_date.desc()).limit(10).all()
     # Pass current year to the template for copyright notice
-    return render_template('index.html', recent_scans=recent_scans, now=datetime.now())
+    return render_template('index.html', recent_scans=recent_scans, quizzes=quiz_choices(), now=datetime.now())
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
@@ -48,75 +262,21 @@ def upload_file():
     template_name = request.form.get('template', 'standard_20')
 
     try:
+        quiz_id = selected_quiz_id(request.form.get('quiz_id'))
         if file and allowed_file(file.filename):
-            # Create a unique filename
+            # Store the upload under its content hash
             original_filename = secure_filename(file.filename)
             extension = original_filename.rsplit('.', 1)[1].lower()
-            unique_filename = f"{uuid.uuid4().hex}.{extension}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-
-            # Make sure the directory exists
-            os.makedirs(os.path.dirname(filepath), exist_ok=True)
-
-            file.save(filepath)
+            digest, filepath = store_upload(file.stream, extension, app.config['UPLOAD_FOLDER'])
 
-            # Process the file based on type
-            if extension == 'pdf':
-                image_paths = scanner.convert_pdf_to_images(filepath)
-                if not image_paths:
-                    flash('Failed to convert PDF to images', 'danger')
-                    return redirect(url_for('index'))
-
-                # Process the first page for now with the selected template
-                scanner.current_template = template_name
-                result, error = scanner.process_sheet(image_paths[0])
-            else:
-                # Process image directly with the selected template
-                scanner.current_template = template_name
-                result, error = scanner.process_sheet(filepath)
+            scan_result, error, reused = grade_stored_upload(digest, filepath, extension, template_name, quiz_id)
 
             if error:
                 flash(f'Error processing file: {error}', 'danger')
                 return redirect(url_for('index'))
 
-            # Save results to database
-            student_info = result['student']
-
-            # Create or get student
-            student = Student.query.filter_by(name=student_info['name']).first()
-            if not student:
-                student = Student(name=student_info['name'], student_id=student_info.get('id'))
-                db.session.add(student)
-                db.session.commit()
-
-            # Create scan result
-            score_info = result['score']
-            scan_result = ScanResult(
-                student_id=student.id,
-                template_used=result['template'],
-                score=score_info['correct'],
-                total_questions=score_info['total'],
-                percentage=score_info['percentage'],
-                image_path=filepath
-            )
-            db.session.add(scan_result)
-            db.session.commit()
-
-            # Add answers
-            for q_num, answer in result['answers'].items():
-                correct = result['correct_answers'].get(q_num)
-                is_correct = answer == correct
-
-                db_answer = Answer(
-                    scan_result_id=scan_result.id,
-                    question_number=int(q_num),
-                    selected_answer=answer,
-                    correct_answer=correct,
-                    is_correct=is_correct
-                )
-                db.session.add(db_answer)
-
-            db.session.commit()
+            if reused:
+                flash('This sheet was already graded; showing the earlier result', 'info')
 
             return redirect(url_for('view_result', scan_id=scan_result.id))
 
@@ -142,6 +302,25 @@ def view_result(scan_id):
         flash(f'Error retrieving result: {str(e)}', 'danger')
         return redirect(url_for('index'))
 
+@app.route('/result/<int:scan_id>/overlay')
+def result_overlay(scan_id):
+    """The stored sheet with detected and correct answers drawn on it (?size=thumb or full)."""
+    size = request.args.get('size', 'full')
+    if size not in OVERLAY_SIZES:
+        return jsonify(error=f"Unknown size: {size}"), 400
+    scan_result = ScanResult.query.get_or_404(scan_id)
+    try:
+        with stage('overlay'):
+            path = overlay_path(get_scanner, scan_result, size, app.config['UPLOAD_FOLDER'])
+    except Exception as e:
+        print(f"Error rendering overlay for scan {scan_id}: {e}")
+        traceback.print_exc()
+        path = None
+    if path is None:
+        return jsonify(error='No image stored for this scan'), 404
+    # send_file resolves relative paths against the app root, not the working directory
+    return send_file(os.path.abspath(path), mimetype='image/jpeg', conditional=True, max_age=86400)
+
 @app.route('/api/results')
 def api_results():
     try:
@@ -166,7 +345,7 @@ def api_results():
 @app.route('/camera')
 def camera():
     """Camera capture page"""
-    return render_template('camera.html', now=datetime.now())
+    return render_template('camera.html', quizzes=quiz_choices(), now=datetime.now())
 
 @app.route('/process_camera_image', methods=['POST'])
 def process_camera_image():
@@ -184,10 +363,12 @@ def process_camera_image():
             # Get from JSON payload
             image_data = data.get('image_data')
             template_name = data.get('template', 'standard_20')
+            quiz_id = selected_quiz_id(data.get('quiz_id'))
         else:
             # Fallback to form data
             image_data = request.form.get('image_data')
             template_name = request.form.get('template', 'standard_20')
+            quiz_id = selected_quiz_id(request.form.get('quiz_id'))
 
         if not image_data:
             flash('No image data received', 'danger')
@@ -201,22 +382,11 @@ def process_camera_image():
         # Decode the base64 image
         image_bytes = base64.b64decode(image_data)
 
-        # Save the image to a file
-        unique_filename = f"{uuid.uuid4().hex}.png"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-
-        # Make sure the directory exists
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-
-        # Write the image to a file
-        with open(filepath, 'wb') as f:
-            f.write(image_bytes)
+        # Store the image under its content hash
+        digest, filepath = store_upload(image_bytes, 'png', app.config['UPLOAD_FOLDER'])
 
         # Process the image with the selected template
-        scanner.current_template = template_name
-        # Always use process_sheet since it handles both detection and processing
-        result, error = scanner.process_sheet(filepath)
-
+        scan_result, error, reused = grade_stored_upload(digest, filepath, 'png', template_name, quiz_id)
 
         if error:
             if request.is_json:
@@ -225,63 +395,28 @@ def process_camera_image():
                 flash(f'Error processing image: {error}', 'danger')
                 return redirect(url_for('camera'))
 
-        # Save results to database (similar to upload_file route)
-        student_info = result['student']
-
-        # Create or get student
-        student = Student.query.filter_by(name=student_info['name']).first()
-        if not student:
-            student = Student(name=student_info['name'], student_id=student_info.get('id'))
-            db.session.add(student)
-            db.session.commit()
-
-        # Create scan result
-        score_info = result['score']
-        scan_result = ScanResult(
-            student_id=student.id,
-            template_used=result['template'],
-            score=score_info['correct'],
-            total_questions=score_info['total'],
-            percentage=score_info['percentage'],
-            image_path=filepath
-        )
-        db.session.add(scan_result)
-        db.session.commit()
-
-        # Add answers
-        for q_num, answer in result['answers'].items():
-            correct = result['correct_answers'].get(q_num)
-            is_correct = answer == correct
-
-            db_answer = Answer(
-                scan_result_id=scan_result.id,
-                question_number=int(q_num),
-                selected_answer=answer,
-                correct_answer=correct,
-                is_correct=is_correct
-            )
-            db.session.add(db_answer)
-
-        db.session.commit()
+        student = scan_result.student
 
         # Return appropriate response based on request type
         if request.is_json:
             # Only return success if we have valid student info and answers
-            sheet_detected = bool(student_info['name'] and len(result['answers']) > 0)
+            sheet_detected = bool(student.name and scan_result.total_questions > 0)
             return jsonify({
                 'success': sheet_detected,
                 'scan_id': scan_result.id,
+                'cached': reused,
                 'message': 'Image processed successfully' if sheet_detected else 'No valid exam sheet detected',
                 'result': {
                     'scan_id': scan_result.id,
+                    'template': scan_result.template_used,
                     'student': {
                         'name': student.name,
                         'id': student.student_id
                     },
                     'score': {
-                        'correct': score_info['correct'],
-                        'total': score_info['total'],
-                        'percentage': score_info['percentage']
+                        'correct': scan_result.score,
+                        'total': scan_result.total_questions,
+                        'percentage': scan_result.percentage
                     }
                 }
             })
@@ -410,27 +545,20 @@ def download_personalized_template(quiz_id, student_id):
 def download_template(template_type):
     """Download a template based on the selected format"""
     try:
-        template_file = None
-        if template_type == 'standard_20':
-            template_file = 'standard_20.pdf'
-            template_name = 'Standard 20 Questions Template'
-        elif template_type == 'extended_50':
-            template_file = 'extended_50.pdf'
-            template_name = 'Extended 50 Questions Template'
-        elif template_type == 'comprehensive_100':
-            template_file = 'comprehensive_100.pdf'
-            template_name = 'Comprehensive 100 Questions Template'
-        else:
+        spec = TEMPLATE_REGISTRY.get(template_type)
+        if spec is None or not spec.printed:
             flash('Invalid template type requested', 'danger')
             return redirect(url_for('index'))
 
         # Get the full path to the template file
+        template_file = f"{spec.name}.pdf"
         template_path = os.path.join(app.static_folder, 'templates', template_file)
 
-        # Make sure the file exists
+        # Templates added to sheet_templates.json are printed on first download
         if not os.path.exists(template_path):
-            flash(f'Template file not found: {template_file}', 'danger')
-            return redirect(url_for('index'))
+            from create_templates import create_bubble_sheet
+            os.makedirs(os.path.dirname(template_path), exist_ok=True)
+            create_bubble_sheet(template_path, spec.name)
 
         # Read the file in binary mode
         with open(template_path, 'rb') as f:
@@ -458,7 +586,11 @@ def download_template(template_type):
 @app.route('/setup')
 @app.route('/batch-scan', methods=['GET', 'POST'])
 def batch_scan():
-    """Handle batch scanning of multiple answer sheets with error tracking"""
+    """
+    Batch scanning page. A multipart POST of files[] (sheets or ZIP archives
+    of them) queues them as a batch job and returns to the page, which
+    streams the job's progress live.
+    """
     if request.method == 'POST':
         if 'files[]' not in request.files:
             flash('No files selected', 'danger')
@@ -466,100 +598,32 @@ def batch_scan():
 
         files = request.files.getlist('files[]')
         template_name = request.form.get('template', 'standard_20')
-        results = []
-        errors = []
+        quiz_id = request.form.get('quiz_id', type=int)
+        if quiz_id is not None and db.session.get(Quiz, quiz_id) is None:
+            flash('The selected quiz no longer exists', 'danger')
+            return redirect(url_for('batch_scan'))
 
+        job = create_job(template_name, quiz_id)
+        start_batch_workers(app, grade_stored_upload)
+        rejected = []
         for file in files:
-            if file and allowed_file(file.filename):
-                # Create unique filename
-                original_filename = secure_filename(file.filename)
-                extension = original_filename.rsplit('.', 1)[1].lower()
-                unique_filename = f"{uuid.uuid4().hex}.{extension}"
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-
-                file.save(filepath)
-
-                try:
-                    # Process file based on type
-                    if extension == 'pdf':
-                        image_paths = scanner.convert_pdf_to_images(filepath)
-                        if not image_paths:
-                            continue
-                        scanner.current_template = template_name
-                        result, error = scanner.process_sheet(image_paths[0])
-                    else:
-                        scanner.current_template = template_name
-                        result, error = scanner.process_sheet(filepath)
-
-                    if error:
-                        errors.append({
-                            'filename': original_filename,
-                            'error': error
-                        })
-                        continue
-
-                    # Save results to database
-                    student_info = result['student']
-                    student = Student.query.filter_by(name=student_info['name']).first()
-                    if not student:
-                        student = Student(name=student_info['name'], student_id=student_info.get('id'))
-                        db.session.add(student)
-                        db.session.commit()
-
-                    score_info = result['score']
-                    scan_result = ScanResult(
-                        student_id=student.id,
-                        template_used=result['template'],
-                        score=score_info['correct'],
-                        total_questions=score_info['total'],
-                        percentage=score_info['percentage'],
-                        image_path=filepath
-                    )
-                    db.session.add(scan_result)
-                    db.session.commit()
-
-                    for q_num, answer in result['answers'].items():
-                        correct = result['correct_answers'].get(q_num)
-                        is_correct = answer == correct
-                        db_answer = Answer(
-                            scan_result_id=scan_result.id,
-                            question_number=int(q_num),
-                            selected_answer=answer,
-                            correct_answer=correct,
-                            is_correct=is_correct
-                        )
-                        db.session.add(db_answer)
-
-                    db.session.commit()
-                    results.append(scan_result.id)
-
-                except Exception as e:
-                    print(f"Error processing file {original_filename}: {str(e)}")
-                    traceback.print_exc()
-
-        total_files = len(files)
-        success_count = len(results)
-        error_count = len(errors)
-
-        if success_count > 0:
-            flash(f'Successfully processed {success_count} out of {total_files} files', 'success')
-            if error_count > 0:
-                for error in errors:
-                    flash(f'Error in {error["filename"]}: {error["error"]}', 'warning')
-            return redirect(url_for('index'))
-        else:
-            flash('No files were successfully processed', 'danger')
-            for error in errors:
-                flash(f'Error in {error["filename"]}: {error["error"]}', 'danger')
-            return redirect(url_for('batch_scan'))
+            if file.filename and not submit_file(app, job, file.filename, file.stream):
+                rejected.append(file.filename)
+        close_job(job)
 
-    return render_template('batch_scan.html', now=datetime.now())
+        for filename in rejected:
+            flash(f'Skipped {filename}: please upload PNG, JPG, JPEG, PDF, or a ZIP of them', 'warning')
+        return redirect(url_for('batch_scan', job=job.id))
+
+    return render_template('batch_scan.html', job_id=request.args.get('job', type=int), quizzes=quiz_choices(),
+                           now=datetime.now())
 
 @app.route('/setup')
 def setup_db():
     """Setup route for initializing test data with student names from student_classes"""
     try:
         # Clear existing data
+        ResultCache.query.delete()
         Answer.query.delete()
         ScanResult.query.delete()
         Student.query.delete()
@@ -716,6 +780,28 @@ def list_quizzes():
     quizzes = Quiz.query.order_by(Quiz.created_at.desc()).all()
     return render_template('list_quizzes.html', quizzes=quizzes, now=datetime.now())
 
+@app.route('/quiz/<int:quiz_id>/answer-key', methods=['POST'])
+def update_answer_key(quiz_id):
+    """
+    Correct a quiz's answer key and regrade the scans already graded against
+    it (scan_result.quiz_id). Sheets graded without picking the quiz were
+    scored with their template's key and are left alone; `flask regrade
+    --template` rescores those.
+    """
+    quiz = Quiz.query.get_or_404(quiz_id)
+    answer_key = (request.form.get('answer_key') or '').strip().upper()
+    if len(answer_key) != quiz.num_items:
+        flash('Answer key length must match number of items', 'danger')
+        return redirect(url_for('list_quizzes'))
+    try:
+        report = regrade_quiz(quiz.id, answer_key)
+        flash(f"Answer key updated: {report['scores_changed']} of the {report['scans']} scans graded against this quiz "
+              f"changed score. Sheets graded without choosing this quiz keep their scores.", 'success')
+    except Exception as e:
+        traceback.print_exc()
+        flash(f'Error updating answer key: {str(e)}', 'danger')
+    return redirect(url_for('list_quizzes'))
+
 @app.route('/quiz/generate_key', methods=['POST'])
 def generate_key():
     num_items = int(request.form.get('num_items', 20))
@@ -741,23 +827,12 @@ def student_list():
             return redirect(url_for('student_list'))
             
         try:
-            # Clear existing students from the target section
-            Student.query.filter_by(section_id=section_id).delete()
-            
-            stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-            csv_reader = csv.reader(stream)
-            next(csv_reader)  # Skip header row
-            
-            for row in csv_reader:
-                if len(row) >= 2:  # Make sure we have both name and student ID
-                    name = row[0].strip()
-                    student_id = row[1].strip()
-                    student = Student(name=name, student_id=student_id, section_id=section_id)
-                    db.session.add(student)
-            
-            db.session.commit()
-            flash('Students imported successfully', 'success')
+            # Upsert by student ID; existing students (and their scans) are kept
+            report = import_roster(file.stream, int(section_id), roster_import_settings(app)['ROSTER_IMPORT_BATCH'])
+            flash(f"Students imported: {report['inserted']} added, {report['updated']} updated, "
+                  f"{report['unchanged']} unchanged, {report['skipped']} skipped", 'success')
         except Exception as e:
+            traceback.print_exc()
             flash(f'Error importing students: {str(e)}', 'danger')
             
         return redirect(url_for('student_list'))
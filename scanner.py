@@ -1,6 +1,11 @@
+import functools
 import os
 import random
+import tempfile
 import traceback
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Mapping, Optional
 import cv2
 import numpy as np
 import pytesseract
@@ -9,89 +14,182 @@ from datetime import datetime
 import uuid
 from pdf2image import convert_from_path
 from PIL import Image
-from flask import current_app
-from models import Student, db
+from flask import current_app, has_app_context
+from roster import answer_key, roster_index
+from metrics import SCANS, SCAN_FAILURES, HEADER_PREPROCESS, GRADE_REGRADES, stage
+from debug_artifacts import SAMPLED_QUESTIONS, get_writer as get_debug_writer
+from template_registry import TEMPLATE_REGISTRY
+from template_detect import AUTO_TEMPLATE, detect_template
+
+# Header quality gate: crops cleaner than this skip fastNlMeansDenoising
+HEADER_NOISE_MAX = 5.0       # estimated noise sigma, in grey levels
+HEADER_CONTRAST_MIN = 60.0   # grey-level spread between ink and paper
+# Mean tesseract word confidence (0-100) below which the denoising path is tried too
+OCR_MIN_CONFIDENCE = 60
+# Tesseract settings: the header band is a block of text; field boxes hold a
+# single line with a known alphabet (word gaps come out as spaces regardless)
+HEADER_OCR_CONFIG = r'--oem 3 --psm 6'
+FIELD_OCR_CONFIGS = {
+    'name': r'--oem 3 --psm 7 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz,',
+    'id': r'--oem 3 --psm 7 -c tessedit_char_whitelist=0123456789',
+}
+# Two-tier grading. The fast tier reads the darkness of each option cell at
+# FAST_GRADE_SCALE: an option is marked when its cell is at least FILL_FLOOR
+# darker than the cell unmarked, and MARK_CONTRAST darker (relative) than the
+# next darkest cell. Readings between BLANK_CONTRAST and CLEAR_CONTRAST are not
+# fully certain.
+FAST_GRADE_SCALE = 0.5
+FILL_FLOOR = 0.04
+BLANK_CONTRAST = 0.2
+MARK_CONTRAST = 0.5
+CLEAR_CONTRAST = 0.75
+# Answers less confident than this (0-1) are re-read at full resolution, and
+# the whole sheet is when more than SHEET_REGRADE_FRACTION of them are
+GRADE_CONFIDENCE_MIN = 0.3
+SHEET_REGRADE_FRACTION = 0.3
+# Field crops smaller than this (in pixels high) are upscaled before OCR
+FIELD_MIN_HEIGHT = 64
+# Laplacian-difference kernel for the noise estimate
+NOISE_KERNEL = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+
+# Template configurations, keyed by the template names used in the UI.
+# Built from sheet_templates.json (see template_registry.py); 'fields' gives
+# the name and ID write-in boxes printed on the sheet, if any.
+TEMPLATES = MappingProxyType({name: spec.as_dict() for name, spec in TEMPLATE_REGISTRY.items()})
+
+
+@functools.lru_cache(maxsize=64)
+def sampling_plan(template_name, img_height, img_width):
+    """
+    Where to read a template's answers on a page image of the given size,
+    compiled once per template and image size. Returns a dict with:
+    'cells', an int array (questions x choices x 4) of (y1, y2, x1, x2) option
+    cells, one bubble spacing wide and one row spacing high around each bubble;
+    'rows', {question_number: (y1, y2, x1, x2)} spanning each question's cells;
+    and 'block', the (top, bottom, left, right) box around all of them.
+    """
+    spec = TEMPLATE_REGISTRY[template_name]
+    sx, sy = img_width / spec.page_width, img_height / spec.page_height
+    column_width = (spec.page_width - 2 * spec.margin) / spec.columns
+    half_cell = spec.bubble_spacing / 2
+    half_row = spec.row_spacing / 2
+
+    cells = np.zeros((spec.questions, len(spec.choices), 4), dtype=np.int32)
+    for q in range(spec.questions):
+        col, row = divmod(q, spec.rows_per_column)
+        centre_y = spec.first_row + row * spec.row_spacing
+        first_x = spec.margin + col * column_width + spec.bubble_offset
+        for j in range(len(spec.choices)):
+            centre_x = first_x + j * spec.bubble_spacing
+            cells[q, j] = (round((centre_y - half_row) * sy), round((centre_y + half_row) * sy),
+                           round((centre_x - half_cell) * sx), round((centre_x + half_cell) * sx))
+    np.clip(cells[..., :2], 0, img_height, out=cells[..., :2])
+    np.clip(cells[..., 2:], 0, img_width, out=cells[..., 2:])
+    cells.flags.writeable = False
+
+    rows = {q + 1: (int(cells[q, 0, 0]), int(cells[q, 0, 1]), int(cells[q, 0, 2]), int(cells[q, -1, 3]))
+            for q in range(spec.questions)}
+    block = (int(cells[..., 0].min()), int(cells[..., 1].max()), int(cells[..., 2].min()), int(cells[..., 3].max()))
+    return {'cells': cells, 'rows': MappingProxyType(rows), 'block': block}
+
+
+@dataclass(frozen=True)
+class ScanOptions:
+    """Per-call scanning options."""
+    resize_height: int = 800
+    # Folder for temporary and debug files; defaults to the app's UPLOAD_FOLDER
+    # (the system temp directory outside an app context)
+    upload_folder: Optional[str] = None
+    # Overwrite the input file with the resized image
+    save_resized: bool = True
+    # Write the resized image here instead and leave the input file untouched
+    work_path: Optional[str] = None
+    # Debug images: 'off', 'sampled' (first questions of a fraction of sheets) or 'full'
+    debug_artifacts: str = 'off'
+    debug_sample_rate: float = 0.05
+
+
+@dataclass(frozen=True)
+class SheetResult:
+    """Immutable outcome of scanning one sheet."""
+    template: str
+    template_info: Mapping
+    student: Mapping
+    answers: Mapping
+    correct_answers: Mapping
+    score: Mapping
+    success: bool = True
+    confidence: Mapping = field(default_factory=lambda: MappingProxyType({}))
+    regraded_questions: int = 0
+
+    @classmethod
+    def build(cls, template, student, answers, correct_answers, confidence=None, regraded_questions=0):
+        """
+        Score the detected answers and freeze everything into a result.
+        confidence maps question numbers to how clearly each answer read (0-1).
+        """
+        correct = sum(1 for q_num, selected in answers.items()
+                      if q_num in correct_answers and selected == correct_answers[q_num])
+        total = len(correct_answers)
+        return cls(
+            template=template,
+            template_info=MappingProxyType(dict(TEMPLATES[template])),
+            student=MappingProxyType(dict(student)),
+            answers=MappingProxyType(dict(answers)),
+            correct_answers=MappingProxyType(dict(correct_answers)),
+            score=MappingProxyType({
+                'correct': correct,
+                'total': total,
+                'percentage': round(correct / total * 100, 1) if total > 0 else 0
+            }),
+            confidence=MappingProxyType(dict(confidence or {})),
+            regraded_questions=regraded_questions
+        )
+
+    def __reduce__(self):
+        # MappingProxyType can't be pickled; rebuild from plain dicts (results cross process boundaries)
+        return (SheetResult.build, (self.template, dict(self.student), dict(self.answers),
+                                    dict(self.correct_answers), dict(self.confidence), self.regraded_questions))
+
+    @property
+    def min_confidence(self):
+        """The least certain answer on the sheet, or None if no confidence was recorded."""
+        return min(self.confidence.values()) if self.confidence else None
+
+
+def default_folder():
+    """The app's UPLOAD_FOLDER, or the system temp directory when there is no app context (CLI workers)."""
+    if has_app_context():
+        return current_app.config['UPLOAD_FOLDER']
+    return tempfile.gettempdir()
+
 
 class BubbleSheetScanner:
     """
-    A simplified bubble sheet scanner that operates in demo mode without requiring 
-    OpenCV or other image processing libraries.
+    Bubble sheet scanner using OCR for the student header and contour analysis
+    for the answer bubbles.
+
+    The scanner keeps no per-request state: the template, answer key and options
+    are passed to every process_sheet() call, so a single instance can be shared
+    by threaded workers and thread pools. Given an answer key and a roster it
+    needs neither the database nor an app context, so it also runs in worker
+    processes (see bulk_grade.py).
     """
     def __init__(self):
         # Map the template names from the UI to internal template configurations
-        self.templates = {
-            # 20-question templates
-            'standard_20': {
-                'identifier': 'Standard 20-Question Template',
-                'questions_per_sheet': 20,
-                'choices': ['A', 'B', 'C', 'D']
-            },
-            # 50-question templates
-            'extended_50': {
-                'identifier': 'Extended 50-Question Template',
-                'questions_per_sheet': 50,
-                'choices': ['A', 'B', 'C', 'D']
-            },
-            # 100-question templates
-            'comprehensive_100': {
-                'identifier': 'Comprehensive 100-Question Template',
-                'questions_per_sheet': 100,
-                'choices': ['A', 'B', 'C', 'D']
-            },
-            # Legacy templates (keeping for backward compatibility)
-            'template1_20': {
-                'identifier': 'EXAM ANSWER SHEET - 20Q',
-                'questions_per_sheet': 20,
-                'choices': ['A', 'B', 'C', 'D']
-            },
-            'template2_20': {
-                'identifier': '# EXAM ANSWER SHEET - 20Q',
-                'questions_per_sheet': 20,
-                'choices': ['A', 'B', 'C', 'D']
-            }
-        }
-        self.current_template = None
+        self.templates = TEMPLATES
 
     def get_correct_answers(self, question_count=None):
         """Get correct answers from the database, or generate demo answers with the specified question count."""
         try:
-            from app import db
-            from sqlalchemy import text
-
-            # Attempt to fetch from database
-            with db.engine.connect() as conn:
-                # Check how many questions are in the database
-                count_result = conn.execute(text("SELECT COUNT(*) FROM question"))
-                count = count_result.fetchone()[0]
-
-                # If we need more questions than exist in the database, we need to extend
-                if question_count and question_count > count:
-                    print(f"Extending answers from {count} to {question_count} questions")
-                    # First get existing answers
-                    result = conn.execute(text("SELECT question_id, correct_answer FROM question ORDER BY question_id"))
-                    answers = {str(row[0]): row[1] for row in result}
-
-                    # Generate additional answers in a pattern (A, B, C, D repeat)
-                    choices = ['A', 'B', 'C', 'D']
-                    for i in range(count + 1, question_count + 1):
-                        answers[str(i)] = choices[(i - 1) % 4]
-
-                    return answers
-                else:
-                    # If question_count is specified and we have enough questions, limit the number
-                    if question_count:
-                        result = conn.execute(text("SELECT question_id, correct_answer FROM question WHERE question_id <= :limit ORDER BY question_id"), 
-                                             {"limit": question_count})
-                    else:
-                        result = conn.execute(text("SELECT question_id, correct_answer FROM question ORDER BY question_id"))
-
-                    answers = {str(row[0]): row[1] for row in result}
-
-                    if not answers:
-                        # If no answers in database, return demo answers
-                        answers = self._get_demo_answers(question_count or 20)
-
-                    return answers
+            # The question table, cached per process (see roster.py)
+            answers = answer_key(question_count)
+            if question_count and len(answers) < question_count:
+                print(f"Extended answers to {question_count} questions")
+            if not answers:
+                # If no answers in database, return demo answers
+                answers = self._get_demo_answers(question_count or 20)
+            return answers
         except Exception as e:
             print(f"Database error: {e}")
             # Fall back to demo answers
@@ -102,32 +200,51 @@ class BubbleSheetScanner:
         choices = ['A', 'B', 'C', 'D']
         return {str(i): choices[i % 4] for i in range(1, question_count + 1)}
 
-    def process_sheet(self, image_path):
+    def process_sheet(self, image_path, template_name, correct_answers=None, options=None, roster=None):
         """
         Process the uploaded sheet using OCR and image processing techniques.
-        Falls back to demo mode if image processing fails.
+        Grades against correct_answers (question number -> letter) when given,
+        otherwise against the answer key stored in the database. Student names
+        are matched against roster (a roster.RosterIndex) when given, otherwise
+        against the database.
+        template_name 'auto' recognises the template from the sheet's layout.
+        Returns (SheetResult, None) on success or (None, error message).
         """
+        options = options or ScanOptions()
         try:
             # Check if image exists
             if not os.path.exists(image_path):
-                return None, "Could not read image"
+                return self._reject(template_name, 'missing_image', "Could not read image")
+
+            if template_name != AUTO_TEMPLATE and template_name not in self.templates:
+                return self._reject(template_name, 'unknown_template', f"Unknown answer sheet template: {template_name}")
+
+            upload_folder = options.upload_folder or default_folder()
+            debug_questions = self._debug_question_limit(options)
 
             # Resize image to reduce processing time
-            img = cv2.imread(image_path)
-            height = 800
-            ratio = height / img.shape[0]
-            dim = (int(img.shape[1] * ratio), height)
-            img = cv2.resize(img, dim, interpolation=cv2.INTER_AREA)
-
-            # Save resized image
-            cv2.imwrite(image_path, img)
-
-            # Use the current_template if set, otherwise randomly select a template
-            if not self.current_template or self.current_template not in self.templates:
-                template_name = random.choice(list(self.templates.keys()))
-                self.current_template = template_name
-            else:
-                template_name = self.current_template
+            with stage('decode'):
+                img = cv2.imread(image_path)
+
+                # Recognise the layout on the full-size page, where a barcode is still legible
+                if template_name == AUTO_TEMPLATE:
+                    with stage('detect_template'):
+                        template_name, score = detect_template(img, self.templates)
+                    if template_name is None:
+                        return self._reject(AUTO_TEMPLATE, 'unknown_layout', "Could not recognise the answer sheet layout. Please choose the template manually.")
+                    print(f"Detected template {template_name} (score {score:.2f})")
+
+                height = options.resize_height
+                ratio = height / img.shape[0]
+                dim = (int(img.shape[1] * ratio), height)
+                img = cv2.resize(img, dim, interpolation=cv2.INTER_AREA)
+
+                # Save resized image; later stages read the resized copy
+                if options.work_path:
+                    cv2.imwrite(options.work_path, img)
+                    image_path = options.work_path
+                elif options.save_resized:
+                    cv2.imwrite(image_path, img)
 
             template = self.templates[template_name]
 
@@ -135,73 +252,74 @@ class BubbleSheetScanner:
             question_count = template['questions_per_sheet']
 
             # Get correct answers from the database based on the template's question count
-            correct_answers = self.get_correct_answers(question_count)
+            if correct_answers is None:
+                with stage('answer_key'):
+                    correct_answers = self.get_correct_answers(question_count)
 
             # Try to extract student info using OCR
-            ocr_student_info = self.extract_student_info_from_image(image_path)
+            with stage('ocr_header'):
+                ocr_student_info = self.extract_student_info_from_image(image_path, template_name, roster)
 
             # Validate that we have a proper examination sheet
             # Check if we found any student info or if we captured any identifiable text
             if not ocr_student_info or (not ocr_student_info.get('name') and not ocr_student_info.get('id')):
                 print("OCR failed to extract student info")
-                return None, "No valid examination sheet detected. Please ensure the sheet is clearly visible and well-lit."
+                return self._reject(template_name, 'no_student_info', "No valid examination sheet detected. Please ensure the sheet is clearly visible and well-lit.")
 
             # Check if what we captured is actually just the title of the sheet and not a student name
             name_lower = ocr_student_info.get('name', '').lower()
             if 'exam' in name_lower and 'sheet' in name_lower or 'answer' in name_lower and 'sheet' in name_lower:
                 print("OCR detected only the title of the sheet, not a valid student name")
-                return None, "No student information detected. Please make sure the student name and ID are clearly visible at the top of the sheet."
+                return self._reject(template_name, 'title_only', "No student information detected. Please make sure the student name and ID are clearly visible at the top of the sheet.")
 
             student_info = ocr_student_info
             print(f"OCR extracted student info: {student_info}")
 
             # Try to match student with database
-            matched_student = self._match_student_with_database(student_info)
+            with stage('matching'):
+                matched_student = self._match_student_with_database(student_info, roster)
             if matched_student:
                 student_info = matched_student
                 print(f"Matched with student in database: {student_info['name']} (ID: {student_info['id']})")
 
             # Check if this is actually a bubble sheet by looking for bubbles
-            has_bubbles = self._check_for_bubbles(image_path)
+            with stage('bubble_check'):
+                has_bubbles = self._check_for_bubbles(image_path)
             if not has_bubbles:
                 print("No bubbles detected in the image")
-                return None, "No bubble answer sheet detected. Please make sure you're capturing an actual MattChecker examination sheet."
+                return self._reject(template_name, 'no_bubbles', "No bubble answer sheet detected. Please make sure you're capturing an actual MattChecker examination sheet.")
 
             # Process the bubbles to get actual answers from the sheet
             print("Processing answer bubbles...")
-            answers = self._process_answer_bubbles(image_path, question_count, template_name)
-
-            # Calculate score by comparing with correct answers
-            score = 0
-            for q_num, selected in answers.items():
-                if q_num in correct_answers and selected == correct_answers[q_num]:
-                    score += 1
+            with stage('grading'):
+                answers, confidence, regraded = self._process_answer_bubbles(
+                    image_path, question_count, template_name, upload_folder, debug_questions)
 
             # Debug logging
             print(f"Processing sheet for student: {student_info['name']} (ID: {student_info['id']})")
             print(f"Using template: {template_name} with {question_count} questions")
 
-            # Reset current_template after processing to ensure we don't reuse it unexpectedly
-            reset_template = self.current_template
-            self.current_template = None
-
-            return {
-                'success': True,
-                'template': reset_template,
-                'template_info': template,
-                'student': student_info,
-                'score': {
-                    'correct': score,
-                    'total': len(correct_answers),
-                    'percentage': round(score / len(correct_answers) * 100, 1) if len(correct_answers) > 0 else 0
-                },
-                'answers': answers,
-                'correct_answers': correct_answers
-            }, None
+            SCANS.inc(template=template_name, outcome='success')
+            return SheetResult.build(template_name, student_info, answers, correct_answers,
+                                     confidence, regraded), None
         except Exception as e:
             print(f"Error processing sheet: {e}")
             traceback.print_exc()
-            return None, "Error processing image. Please make sure you are capturing a valid examination sheet with clear student information."
+            return self._reject(template_name, 'exception', "Error processing image. Please make sure you are capturing a valid examination sheet with clear student information.")
+
+    def _debug_question_limit(self, options):
+        """How many questions of this sheet get debug images (0 = none, so no visualization is built)."""
+        if options.debug_artifacts == 'full':
+            return None
+        if options.debug_artifacts == 'sampled' and random.random() < options.debug_sample_rate:
+            return SAMPLED_QUESTIONS
+        return 0
+
+    def _reject(self, template_name, reason, message):
+        """Count a rejected sheet and return the (None, error) pair process_sheet reports."""
+        SCANS.inc(template=template_name, outcome='failure')
+        SCAN_FAILURES.inc(reason=reason)
+        return None, message
 
     def _generate_demo_student_info(self):
         """Get a random student from the database using the user_info table."""
@@ -268,9 +386,15 @@ class BubbleSheetScanner:
 
         return answers, score
 
-    def extract_student_info_from_image(self, image_path):
+    def extract_student_info_from_image(self, image_path, template_name=None, roster=None):
         """
         Use OCR to extract student information from the scanned image.
+        Templates with field boxes get each box read on its own (single line,
+        restricted alphabet); otherwise, or when neither box gives a usable
+        read, the whole header band is read and parsed.
+        Every crop goes through the quality gate: clean crops take a fast path
+        (blur and Otsu threshold); noisy or low-contrast crops, or fast-path
+        reads with low OCR confidence, go through the full denoising path.
         Returns a dictionary with name and ID.
         """
         try:
@@ -279,69 +403,29 @@ class BubbleSheetScanner:
             if img is None:
                 print(f"Failed to load image: {image_path}")
                 return None
+            height, width = img.shape[:2]
 
-            # Convert to grayscale
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-            # Get image dimensions
-            height, width = gray.shape
+            fields = self.templates.get(template_name, {}).get('fields')
+            if fields:
+                with stage('ocr_fields'):
+                    student_info = self._read_fields(img, fields)
+                if student_info['name'] or student_info['id']:
+                    return self._match_student_with_database(student_info, roster)
 
-            # Enhance image contrast
-            gray = cv2.equalizeHist(gray)
-
-            # Apply adaptive thresholding
-            binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                         cv2.THRESH_BINARY, 11, 2)
-
-            # Define the region of interest (ROI) for student info - expanded area
+            # Crop the student info region first; nothing else needs preprocessing
             roi_top = int(height * 0.01)  # 1% from top
             roi_height = int(height * 0.25)  # 25% of image height
-            roi_student_info = binary[roi_top:roi_top+roi_height, 0:width]
-
-            # Apply additional preprocessing to improve text detection
-            roi_student_info = cv2.GaussianBlur(roi_student_info, (3, 3), 0)
-            roi_student_info = cv2.adaptiveThreshold(
-                roi_student_info, 
-                255,
-                cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                cv2.THRESH_BINARY,
-                11,
-                2
-            )
+            header = cv2.cvtColor(img[roi_top:roi_top+roi_height, 0:width], cv2.COLOR_BGR2GRAY)
 
-            # Denoise the ROI
-            roi_student_info = cv2.fastNlMeansDenoising(roi_student_info)
-            _, threshold = cv2.threshold(roi_student_info, 150, 255, cv2.THRESH_BINARY_INV)
+            def parsed(text):
+                info = self._parse_student_info(text)
+                return bool(info['name'] or info['id'])
 
-            # Apply noise reduction
-            kernel = np.ones((1, 1), np.uint8)
-            threshold = cv2.dilate(threshold, kernel, iterations=1)
-            threshold = cv2.erode(threshold, kernel, iterations=1)
-
-            # Invert back to black text on white background for OCR
-            threshold = cv2.bitwise_not(threshold)
-
-            # Save the processed ROI to a temporary file
-            from flask import current_app
-            temp_roi_path = os.path.join(
-                current_app.config['UPLOAD_FOLDER'],
-                f"temp_student_roi_{uuid.uuid4().hex}.png"
-            )
-            cv2.imwrite(temp_roi_path, threshold)
-
-            # Perform OCR on the processed image
-            # Adjust these parameters based on your testing
-            custom_config = r'--oem 3 --psm 6'
-            ocr_text = pytesseract.image_to_string(Image.open(temp_roi_path), config=custom_config)
-
-            # Clean up the temporary file
-            os.remove(temp_roi_path)
-
-            # Process the OCR text to extract student info
+            ocr_text, _ = self._read_region(header, HEADER_OCR_CONFIG, parsed)
             student_info = self._parse_student_info(ocr_text)
 
             # Match the extracted info with student database for better accuracy
-            student_info = self._match_student_with_database(student_info)
+            student_info = self._match_student_with_database(student_info, roster)
 
             return student_info
 
@@ -350,6 +434,136 @@ class BubbleSheetScanner:
             traceback.print_exc()
             return None
 
+    def _read_fields(self, img, fields):
+        """
+        OCR the name and ID boxes separately, each with its own tesseract settings.
+        Returns {'name', 'id'}; a field is empty unless it read cleanly and confidently.
+        """
+        height, width = img.shape[:2]
+        student_info = {'name': '', 'id': ''}
+        for field_name, clean_value in (('name', self._clean_name_field), ('id', self._clean_id_field)):
+            left, top, right, bottom = fields[field_name]
+            x1, y1, x2, y2 = int(left * width), int(top * height), int(right * width), int(bottom * height)
+            # Stay clear of the printed box border, which reads as I or 1
+            inset = max(2, (y2 - y1) // 8)
+            crop = img[y1 + inset:y2 - inset, x1 + inset:x2 - inset]
+            if crop.size == 0:
+                continue
+            gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+            # Tesseract reads poorly below ~20px text; the sheet is scanned at 800px high
+            if gray.shape[0] < FIELD_MIN_HEIGHT:
+                scale = FIELD_MIN_HEIGHT / gray.shape[0]
+                gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+            text, confidence = self._read_region(gray, FIELD_OCR_CONFIGS[field_name], clean_value)
+            if confidence >= OCR_MIN_CONFIDENCE:
+                student_info[field_name] = clean_value(text)
+        return student_info
+
+    def _clean_name_field(self, text):
+        """Normalise an OCR'd name box; '' if it doesn't look like a name."""
+        name = ' '.join(text.replace(',', ', ').split()).replace(' ,', ',').upper()
+        return name if sum(c.isalpha() for c in name) >= 4 else ''
+
+    def _clean_id_field(self, text):
+        """The digits of an OCR'd ID box; '' unless there are 5 to 10 of them."""
+        digits = ''.join(c for c in text if c.isdigit())
+        return digits if 5 <= len(digits) <= 10 else ''
+
+    def _read_region(self, gray, config, accept):
+        """
+        OCR a grayscale crop through the quality gate.
+        accept(text) says whether a read is usable; a usable, confident fast read
+        is returned straight away, otherwise the denoising path is tried and the
+        better read kept. Returns (text, mean word confidence).
+        """
+        quality = self._header_quality(gray)
+        clean = quality['noise'] <= HEADER_NOISE_MAX and quality['contrast'] >= HEADER_CONTRAST_MIN
+
+        text, confidence = '', -1.0
+        if clean:
+            with stage('header_fast'):
+                text, confidence = self._ocr_text(self._preprocess_header_fast(gray), config)
+            if accept(text) and confidence >= OCR_MIN_CONFIDENCE:
+                HEADER_PREPROCESS.inc(path='fast')
+                return text, confidence
+
+        # Noisy crop, or the fast read wasn't trustworthy
+        HEADER_PREPROCESS.inc(path='heavy' if not clean else 'fast_fallback')
+        heavy_text, heavy_confidence = self._ocr_text(self._preprocess_header_heavy(gray), config)
+        if not clean or (accept(heavy_text) and heavy_confidence >= confidence):
+            return heavy_text, heavy_confidence
+        return text, confidence
+
+    def _header_quality(self, gray):
+        """
+        Cheap quality signals for a grayscale crop: noise (estimated sigma, from
+        Immerkaer's Laplacian-difference method), contrast (gap between the mean
+        ink and paper levels, split by Otsu) and sharpness (variance of the Laplacian).
+        """
+        h, w = gray.shape
+        if h < 3 or w < 3:
+            return {'noise': 0.0, 'contrast': 0.0, 'sharpness': 0.0}
+        residual = cv2.filter2D(gray.astype(np.float32), -1, NOISE_KERNEL)[1:-1, 1:-1]
+        noise = float(np.abs(residual).sum() * np.sqrt(np.pi / 2) / (6 * (w - 2) * (h - 2)))
+        split, _ = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        ink, paper = gray[gray <= split], gray[gray > split]
+        contrast = float(paper.mean() - ink.mean()) if ink.size and paper.size else 0.0
+        sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+        return {'noise': noise, 'contrast': contrast, 'sharpness': sharpness}
+
+    def _preprocess_header_fast(self, header):
+        """Light cleanup for clean crops: slight blur, then a global Otsu threshold."""
+        blurred = cv2.GaussianBlur(header, (3, 3), 0)
+        _, binary = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        return binary
+
+    def _preprocess_header_heavy(self, header):
+        """The full cleanup chain, including fastNlMeansDenoising, for noisy crops."""
+        # Enhance contrast and apply adaptive thresholding
+        gray = cv2.equalizeHist(header)
+        binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                       cv2.THRESH_BINARY, 11, 2)
+
+        # Apply additional preprocessing to improve text detection
+        binary = cv2.GaussianBlur(binary, (3, 3), 0)
+        binary = cv2.adaptiveThreshold(binary, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                       cv2.THRESH_BINARY, 11, 2)
+
+        # Denoise the ROI
+        with stage('denoise'):
+            binary = cv2.fastNlMeansDenoising(binary)
+        _, threshold = cv2.threshold(binary, 150, 255, cv2.THRESH_BINARY_INV)
+
+        # Apply noise reduction
+        kernel = np.ones((1, 1), np.uint8)
+        threshold = cv2.dilate(threshold, kernel, iterations=1)
+        threshold = cv2.erode(threshold, kernel, iterations=1)
+
+        # Invert back to black text on white background for OCR
+        return cv2.bitwise_not(threshold)
+
+    def _ocr_text(self, binary, config):
+        """
+        OCR a preprocessed crop in memory.
+        Returns (text with one line per OCR line, mean word confidence 0-100).
+        """
+        with stage('tesseract'):
+            data = pytesseract.image_to_data(Image.fromarray(binary), config=config,
+                                             output_type=pytesseract.Output.DICT)
+        lines = {}
+        confidences = []
+        for i, word in enumerate(data['text']):
+            word = word.strip()
+            if not word:
+                continue
+            confidence = float(data['conf'][i])
+            if confidence >= 0:
+                confidences.append(confidence)
+            key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+            lines.setdefault(key, []).append(word)
+        text = '\n'.join(' '.join(words) for words in lines.values())
+        return text, (sum(confidences) / len(confidences) if confidences else 0.0)
+
     def _parse_student_info(self, ocr_text):
         """
         Parse the OCR text to extract student name and ID.
@@ -395,39 +609,40 @@ class BubbleSheetScanner:
             'id': student_id
         }
 
-    def _match_student_with_database(self, student_info):
+    def _match_student_with_database(self, student_info, roster=None):
         """
-        Match the extracted student information with database records.
+        Match the extracted student information with database records
+        (or with roster, a RosterIndex, when given).
         Uses fuzzy matching for better accuracy.
         """
         if not student_info or (not student_info['name'] and not student_info['id']):
             return student_info  # Return the original info, don't fall back to demo data
 
         try:
+            # The roster, cached per process (see roster.py)
+            if roster is None:
+                roster = roster_index()
+
             # If we have a student ID, try to match by ID first
-            if student_info['id']:
-                student = Student.query.filter_by(student_id=student_info['id']).first()
-                if student:
-                    return {
-                        'name': student.name,
-                        'id': student.student_id
-                    }
+            if student_info['id'] and student_info['id'] in roster.by_id:
+                return {
+                    'name': roster.by_id[student_info['id']],
+                    'id': student_info['id']
+                }
 
             # If no ID match or no ID provided, try fuzzy matching with names
             if student_info['name']:
-                # Get all students from the database
-                students = Student.query.all()
-
+                ocr_name = student_info['name'].upper()
                 best_match = None
                 best_score = 0
 
-                for student in students:
+                for upper_name, name, student_id in roster.names:
                     # Calculate Levenshtein distance (smaller = more similar)
-                    distance = Levenshtein.distance(student_info['name'].upper(), student.name.upper())
+                    distance = Levenshtein.distance(ocr_name, upper_name)
 
                     # Convert distance to a similarity score (higher = more similar)
                     # The max function ensures we don't divide by zero
-                    max_len = max(len(student_info['name']), len(student.name))
+                    max_len = max(len(ocr_name), len(name))
                     if max_len == 0:
                         continue
 
@@ -436,12 +651,12 @@ class BubbleSheetScanner:
                     # If this is the best match so far, store it
                     if similarity > best_score and similarity > 0.6:  # 60% similarity threshold
                         best_score = similarity
-                        best_match = student
+                        best_match = (name, student_id)
 
                 if best_match:
                     return {
-                        'name': best_match.name,
-                        'id': best_match.student_id
+                        'name': best_match[0],
+                        'id': best_match[1]
                     }
 
         except Exception as e:
@@ -504,141 +719,180 @@ class BubbleSheetScanner:
             traceback.print_exc()
             return False
 
-    def _process_answer_bubbles(self, image_path, question_count, template_name):
+    def _process_answer_bubbles(self, image_path, question_count, template_name, upload_folder, debug_questions=0):
         """
         Process the bubble answer sheet to detect which bubbles are filled in.
-        Returns a dictionary mapping question numbers to selected answers.
+        Option cells come from the template's sampling plan (see sampling_plan()).
+        Grading is two-tier: every question is first read from the ink in each
+        option cell of a half-resolution copy, then questions whose confidence
+        is below GRADE_CONFIDENCE_MIN (every question, when too many are) are
+        re-read at full resolution with contour analysis.
+        Debug images for the first debug_questions questions (None = all) are
+        queued to the background artifact writer.
+        Returns (answers, confidences, regraded): question number -> letter or
+        None, question number -> confidence 0-1, and how many were re-read.
         """
         try:
             # Load the image
             img = cv2.imread(image_path)
             if img is None:
                 print(f"Failed to load image for bubble processing: {image_path}")
-                return {}
-
-            # Convert to grayscale
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-            # Apply adaptive thresholding
-            thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
+                return {}, {}, 0
+
+            plan = sampling_plan(template_name, img.shape[0], img.shape[1])
+            labels = self.templates[template_name]['choices']
+            question_count = min(question_count, len(plan['cells']))
+
+            # Threshold only the answer block. The margin covers the 11px
+            # adaptive-threshold window, so pixels inside match a full-image pass.
+            margin = 5
+            block_top, block_bottom, block_left, block_right = plan['block']
+            top = max(0, block_top - margin)
+            bottom = min(img.shape[0], block_bottom + margin)
+            left = max(0, block_left - margin)
+            right = min(img.shape[1], block_right + margin)
+            gray = cv2.cvtColor(img[top:bottom, left:right], cv2.COLOR_BGR2GRAY)
+            thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
                                          cv2.THRESH_BINARY_INV, 11, 2)
 
-            # Defining answer regions based on the template
-            # These values need to be adjusted based on actual template
-            template_config = self._get_template_regions(template_name, question_count, img.shape[0], img.shape[1])
+            # Cells relative to the thresholded answer block
+            cells = plan['cells'][:question_count] - np.array([top, top, left, left], dtype=np.int32)
+
+            # Tier 1: ink per option cell on a half-resolution copy, for every
+            # cell at once. Darkness is summed rather than thresholded pixels,
+            # because an adaptive threshold hollows out filled bubbles wider than its window.
+            small = cv2.resize(gray, None, fx=FAST_GRADE_SCALE, fy=FAST_GRADE_SCALE, interpolation=cv2.INTER_AREA)
+            small_ink = cv2.integral(255 - small, sdepth=cv2.CV_64F) / 255.0
+            fills = self._cell_fills(small_ink, cells, FAST_GRADE_SCALE)
 
             # Dictionary to store answers
             answers = {}
-            valid_options = ['A', 'B', 'C', 'D']  # Strictly enforce A-D options
-
-            # Process each question
+            confidences = {}
+            rows = {}
             for question_num in range(1, question_count + 1):
                 q_str = str(question_num)
-
-                # Get the region for this question
-                region = self._get_question_region(question_num, template_config)
-                if not region:
-                    print(f"Cannot locate region for question {question_num}")
-                    answers[q_str] = None
+                q_cells = cells[question_num - 1]
+                rows[question_num] = (q_cells[0, 0], q_cells[0, 1], q_cells[0, 2], q_cells[-1, 3])
+                answers[q_str], confidences[q_str] = self._read_fills(fills[question_num - 1], labels)
+
+            # Tier 2: unclear questions get the full-resolution contour analysis.
+            # A sheet with many of them (poor capture, misalignment) is re-read whole.
+            unclear = [q for q in rows if confidences[str(q)] < GRADE_CONFIDENCE_MIN]
+            regrade = set(rows) if len(unclear) > SHEET_REGRADE_FRACTION * len(rows) else set(unclear)
+            full_fills = None
+            if regrade:
+                full_ink = cv2.integral(255 - gray, sdepth=cv2.CV_64F) / 255.0
+                full_fills = self._cell_fills(full_ink, cells, 1.0)
+
+            for question_num, (y1, y2, x1, x2) in rows.items():
+                save_debug = debug_questions is None or question_num <= debug_questions
+                if question_num not in regrade and not save_debug:
                     continue
 
-                # Ensure only A-D options are processed
-                answers[q_str] = None  # Default to None if no valid option is detected
-
                 # Extract the region of interest (ROI) for this question
-                y1, y2, x1, x2 = region
                 roi = thresh[y1:y2, x1:x2]
-
                 if roi.size == 0:
                     print(f"Empty ROI for question {question_num}")
-                    answers[q_str] = None
                     continue
 
                 # Find the filled bubble for this question
-                selected_option, visualization = self._find_filled_bubble(roi)
-                # Ensure we never return 'E' as an answer
-                if selected_option == 'E':
-                    selected_option = None
-                answers[q_str] = selected_option
-
-                # Debug - save the ROI for inspection
-                if question_num <= 5:  # Only save first few for debugging
-                    from flask import current_app
+                selected_option, visualization = self._find_filled_bubble(roi, labels, visualize=save_debug)
+                if question_num in regrade:
+                    q_str = str(question_num)
+                    confidence = self._fill_confidence(full_fills[question_num - 1], selected_option, labels)
+                    # The contour analysis can land on a neighbouring bubble when the
+                    # mark is faint or off-centre; keep the full-resolution cell reading then
+                    fill_option, fill_confidence = self._read_fills(full_fills[question_num - 1], labels)
+                    if fill_confidence > confidence:
+                        selected_option, confidence = fill_option, fill_confidence
+                    answers[q_str] = selected_option
+                    confidences[q_str] = confidence
+
+                # Debug - save the ROI for inspection, off the request thread
+                if save_debug:
                     debug_path = os.path.join(
-                        current_app.config['UPLOAD_FOLDER'],
+                        upload_folder,
                         f"debug_q{question_num}_{uuid.uuid4().hex}.png"
                     )
-                    cv2.imwrite(debug_path, visualization if visualization is not None else roi)
+                    get_debug_writer().submit(debug_path, visualization if visualization is not None else roi)
 
-            return answers
+            if regrade:
+                GRADE_REGRADES.inc(len(regrade), scope='sheet' if len(regrade) == len(rows) else 'question')
+            return answers, confidences, len(regrade)
 
         except Exception as e:
             print(f"Error processing answer bubbles: {e}")
             traceback.print_exc()
-            return {}
-
-    def _get_template_regions(self, template_name, question_count, img_height, img_width):
-        """
-        Define the regions for each question based on the template.
-        Returns a configuration dictionary with region parameters.
-        """
-        # Default configuration
-        config = {
-            'answer_region_top': int(img_height * 0.25),  # Start after student info
-            'answer_region_height': int(img_height * 0.7),  # Most of the remaining page
-            'answer_region_left': int(img_width * 0.1),
-            'answer_region_width': int(img_width * 0.8),
-            'bubbles_per_row': 4,  # A, B, C, D
-            'option_labels': ['A', 'B', 'C', 'D'],
-            'questions_per_page': 20,
-            'question_height': 0,  # Will be calculated
-            'question_spacing': 10,  # Space between questions
-            'option_width': 0,  # Will be calculated
-            'current_page': 0  # First page
-        }
-
-        # Adjust based on template
-        if template_name == 'standard_20':
-            config['questions_per_page'] = 20
-        elif template_name == 'extended_50':
-            config['questions_per_page'] = 25  # 25 questions per page, 2 pages
-        elif template_name == 'comprehensive_100':
-            config['questions_per_page'] = 25  # 25 questions per page, 4 pages
-
-        # Calculate question height based on available space and question count
-        questions_on_current_page = min(config['questions_per_page'], question_count)
-        total_spacing = config['question_spacing'] * (questions_on_current_page - 1)
-        config['question_height'] = (config['answer_region_height'] - total_spacing) / questions_on_current_page
+            return {}, {}, 0
 
-        # Calculate option width
-        config['option_width'] = config['answer_region_width'] / config['bubbles_per_row']
-
-        return config
-
-    def _get_question_region(self, question_num, config):
+    def _cell_fills(self, ink, cells, scale):
         """
-        Calculate the region for a specific question.
-        Returns (y1, y2, x1, x2) coordinates for the question's bubble area.
+        Mean darkness (0-1) of option cells, less the darkness of the cell
+        unmarked. The printed bubble and letter of each option are taken as
+        its median over all questions, and what is left of the paper shade as
+        the question's median cell.
+        ink is the integral image of darkness; cells is a (questions x choices x 4)
+        array of (y1, y2, x1, x2) at full resolution, scaled to the image the
+        integral was built from. Returns a (questions x choices) array.
         """
-        # Always process all questions on the current page
-        relative_q_num = ((question_num - 1) % config['questions_per_page']) + 1
-
-        # Calculate the top position of this question
-        q_top = config['answer_region_top'] + (relative_q_num - 1) * (config['question_height'] + config['question_spacing'])
-
-        # Define the region
-        y1 = int(q_top)
-        y2 = int(q_top + config['question_height'])
-        x1 = int(config['answer_region_left'])
-        x2 = int(config['answer_region_left'] + config['answer_region_width'])
-
-        return (y1, y2, x1, x2)
+        scaled = np.rint(cells * scale).astype(np.intp)
+        y1, y2, x1, x2 = scaled[..., 0], scaled[..., 1], scaled[..., 2], scaled[..., 3]
+        area = (y2 - y1) * (x2 - x1)
+        count = ink[y2, x2] - ink[y1, x2] - ink[y2, x1] + ink[y1, x1]
+        darkness = np.where(area > 0, count / np.maximum(area, 1), 0.0)
+        darkness -= np.median(darkness, axis=0, keepdims=True)
+        return np.maximum(darkness - np.median(darkness, axis=-1, keepdims=True), 0.0)
+
+    def _read_fills(self, fills, labels):
+        """Pick the marked option from one question's cell fills. Returns (letter or None, confidence)."""
+        best = int(np.argmax(fills))
+        second = max(fill for i, fill in enumerate(fills) if i != best)
+        contrast = (fills[best] - second) / fills[best] if fills[best] > 0 else 0.0
+        selected = labels[best] if fills[best] >= FILL_FLOOR and contrast >= MARK_CONTRAST else None
+        return selected, self._fill_confidence(fills, selected, labels)
+
+    def _fill_confidence(self, fills, selected, labels):
+        """
+        How clearly a reading falls on one side of the mark/no-mark boundary, 0-1.
+        A mark is certain when its cell is CLEAR_CONTRAST darker than any other;
+        a blank when no cell is more than BLANK_CONTRAST darker, or when every
+        cell is under FILL_FLOOR, the less certain the closer the darkest one
+        is to it. In between, or when the pick isn't the darkest cell, the
+        reading is unclear (0).
+        """
+        best = int(np.argmax(fills))
+        second = max(fill for i, fill in enumerate(fills) if i != best)
+        if fills[best] < FILL_FLOOR:
+            if selected is not None:
+                return 0.0
+            # A darkest cell just under the floor may be a faint or misregistered mark
+            return round(1.0 - float(fills[best]) / FILL_FLOOR, 3)
+        contrast = (fills[best] - second) / fills[best]
+        if selected is None:
+            confidence = (BLANK_CONTRAST - contrast) / BLANK_CONTRAST
+        elif selected != labels[best]:
+            confidence = 0.0
+        else:
+            confidence = (contrast - MARK_CONTRAST) / (CLEAR_CONTRAST - MARK_CONTRAST)
+        return round(min(1.0, max(0.0, float(confidence))), 3)
+
+    def answer_regions(self, template_name, question_count, img_height, img_width):
+        """
+        Bubble rows for every question on an image of the given size.
+        Returns {question_number: (y1, y2, x1, x2)}; each row holds the options
+        side by side in equal cells. Unknown templates have no regions.
+        """
+        if template_name not in self.templates:
+            return {}
+        rows = sampling_plan(template_name, img_height, img_width)['rows']
+        return {q: region for q, region in rows.items() if q <= question_count}
 
-    def _find_filled_bubble(self, roi):
+    def _find_filled_bubble(self, roi, labels=('A', 'B', 'C', 'D'), visualize=False):
         """
-        Find which bubble is filled using enhanced OMR techniques.
-        Returns the letter (A, B, C, D) of the selected option and a visualization,
-        or (None, None) if none is detected.
+        Find which bubble is filled using enhanced OMR techniques. The ROI holds
+        one equal-width cell per option in labels.
+        Returns the label of the selected option (or None) and,
+        when visualize is set, an annotated colour image of the ROI (else None).
         """
         # Enhanced preprocessing for better bubble detection
         roi_normalized = cv2.normalize(roi, None, 0, 255, cv2.NORM_MINMAX)
@@ -657,19 +911,18 @@ class BubbleSheetScanner:
         )
 
         # Create visualization
-        viz = cv2.cvtColor(roi, cv2.COLOR_GRAY2BGR)
+        viz = cv2.cvtColor(roi, cv2.COLOR_GRAY2BGR) if visualize else None
 
-        # Process only A-D options
-        num_options = 4
+        num_options = len(labels)
         option_width = roi.shape[1] // num_options
-        option_labels = ['A', 'B', 'C', 'D']
+        option_labels = list(labels)
 
         max_score = 0
         selected_option = None
         selected_region = None
 
         # Draw option separators and labels
-        for i in range(num_options):
+        for i in range(num_options if visualize else 0):
             x = i * option_width
             if i > 0:
                 cv2.line(viz, (x, 0), (x, roi.shape[0]), (0, 255, 0), 1)
@@ -722,9 +975,10 @@ class BubbleSheetScanner:
             
             # Calculate and display fill percentage
             fill_percentage = (cv2.countNonZero(option_roi) / option_roi.size) * 100
-            fill_text = f"{fill_percentage:.1f}%"
-            cv2.putText(viz, fill_text, (x1 + 5, roi.shape[0] - 10),
-                      cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 0, 0), 1)
+            if visualize:
+                fill_text = f"{fill_percentage:.1f}%"
+                cv2.putText(viz, fill_text, (x1 + 5, roi.shape[0] - 10),
+                          cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 0, 0), 1)
             
             # Update selected option if this is the best match
             if bubble_score > max_score and fill_percentage > 15:  # Lower threshold but with better validation
@@ -733,7 +987,7 @@ class BubbleSheetScanner:
                 selected_region = (x1, x2)
 
         # Highlight the selected option
-        if selected_region:
+        if visualize and selected_region:
             cv2.rectangle(viz, (selected_region[0], 0), (selected_region[1], roi.shape[0]), 
                          (0, 255, 255), 2)
             # Add text to show which option was detected
@@ -742,13 +996,16 @@ class BubbleSheetScanner:
 
         return selected_option, viz
 
-    def convert_pdf_to_images(self, pdf_path):
+    def convert_pdf_to_images(self, pdf_path, output_folder=None):
         """
         Convert a PDF file to images using pdf2image.
         """
+        output_folder = output_folder or default_folder()
+        # Unique per call, so concurrent conversions never overwrite each other's pages
+        batch_id = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}"
         try:
             # Create a directory for storing converted images if it doesn't exist
-            os.makedirs(current_app.config['UPLOAD_FOLDER'], exist_ok=True)
+            os.makedirs(output_folder, exist_ok=True)
 
             # Convert PDF to images
             images = convert_from_path(pdf_path)
@@ -757,8 +1014,8 @@ class BubbleSheetScanner:
             for i, image in enumerate(images):
                 # Save the image
                 image_path = os.path.join(
-                    current_app.config['UPLOAD_FOLDER'],
-                    f"page_{i}_{datetime.now().strftime('%Y%m%d%H%M%S')}.png"
+                    output_folder,
+                    f"page_{i}_{batch_id}.png"
                 )
                 image.save(image_path, 'PNG')
                 image_paths.append(image_path)
@@ -770,8 +1027,8 @@ class BubbleSheetScanner:
 
             # Fallback to the old method if conversion fails
             image_path = os.path.join(
-                current_app.config['UPLOAD_FOLDER'],
-                f"page_0_{datetime.now().strftime('%Y%m%d%H%M%S')}.png"
+                output_folder,
+                f"page_0_{batch_id}.png"
             )
 
             # Just copy the file with a new name for demonstration
@@ -779,4 +1036,4 @@ class BubbleSheetScanner:
                 with open(image_path, 'wb') as image_file:
                     image_file.write(pdf_file.read())
 
-            return [image_path]
\ No newline at end of file
+            return [image_path]
@@ -0,0 +1,217 @@
+"""
+Answer-pattern similarity screening: flag pairs of students in a section
+whose sheets for a quiz share unusually many identical wrong answers.
+
+    flask similarity --quiz 3                 # the quiz's section
+    flask similarity --quiz 3 --all-students  # everyone graded against it
+    GET /quiz/<id>/similarity                 # the same as a page (?format=json for JSON)
+
+Each student's latest scan for the quiz is packed into one row of an int8
+matrix (see batch_scoring.py for the codes), and the wrong answers into a
+one-hot students x (questions x choices) matrix, so the identical wrong
+answers of every pair are one matrix product. Rows are compared a block of
+SIMILARITY_BLOCK_ROWS at a time against the rows after them, which keeps
+memory at a few blocks of the cohort whatever its size.
+
+Each count is compared with what independent work would give. Student a
+gets question q wrong with probability p_aq from a Rasch model fitted to
+the cohort (one ability per student, one difficulty per question), and two
+wrong answers to q agree with probability s_q (the sum of the squared
+shares of its wrong choices). The count of
+identical wrong answers is then a sum of Bernoulli(p_aq p_bq s_q), whose
+mean and variance are two more matrix products. A pair is flagged when its
+z score clears the Bonferroni bound for SIMILARITY_ALPHA over all pairs and
+it shares at least SIMILARITY_MIN_SHARED identical wrong answers. A flag is
+a reason to look at the sheets, not evidence on its own.
+
+The page and the command are registered by similarity_views.py, which only
+loads this module (and NumPy) when a screening is asked for.
+"""
+import heapq
+import os
+import time
+from statistics import NormalDist
+
+import numpy as np
+from sqlalchemy import func, select
+
+from batch_scoring import BLANK, compile_key, letter_code
+from models import db, Answer, ScanResult, Student
+
+SIMILARITY_DEFAULTS = {
+    'SIMILARITY_ALPHA': 0.001,         # chance of flagging any pair of a cohort working independently
+    'SIMILARITY_MIN_SHARED': 4,        # fewest identical wrong answers worth flagging
+    'SIMILARITY_MAX_PAIRS': 100,       # pairs reported, highest z first
+    'SIMILARITY_BLOCK_ROWS': 256,      # students compared against the rest at a time
+}
+
+# Fitting the Rasch model: Newton steps, and the largest ability or difficulty (in logits)
+RASCH_STEPS = 20
+RASCH_LIMIT = 6.0
+
+PAIR_FIELDS = ['student_a', 'student_a_id', 'student_b', 'student_b_id', 'identical_wrong', 'expected',
+               'z', 'both_wrong', 'same_answers', 'scan_a', 'scan_b']
+
+
+def similarity_settings(app):
+    settings = {}
+    for key, default in SIMILARITY_DEFAULTS.items():
+        value = app.config.get(key, os.environ.get(key, default))
+        settings[key] = type(default)(value)
+    return settings
+
+
+def load_cohort(quiz, section_id=None):
+    """
+    The latest scan of each student graded against quiz, restricted to a
+    section unless section_id is None. Returns (students, scan ids, answer
+    matrix, key vector); students are (name, student number) in row order.
+    """
+    latest = (select(func.max(ScanResult.id).label('id'))
+              .join(Student, Student.id == ScanResult.student_id)
+              .where(ScanResult.quiz_id == quiz.id))
+    if section_id is not None:
+        latest = latest.where(Student.section_id == section_id)
+    latest = latest.group_by(ScanResult.student_id).subquery()
+    scans = db.session.execute(
+        select(ScanResult.id, Student.name, Student.student_id)
+        .join(Student, Student.id == ScanResult.student_id)
+        .where(ScanResult.id.in_(select(latest.c.id)))
+        .order_by(ScanResult.id)).all()
+    scan_ids = np.array([row[0] for row in scans], dtype=np.int64)
+    students = [(row[1], row[2]) for row in scans]
+
+    answers = np.full((len(scans), quiz.num_items), BLANK, dtype=np.int8)
+    rows = db.session.execute(
+        select(Answer.scan_result_id, Answer.question_number, Answer.selected_answer)
+        .where(Answer.scan_result_id.in_(select(latest.c.id)),
+               Answer.question_number.between(1, quiz.num_items))).all()
+    if rows:
+        scan_column, questions, letters = zip(*rows)
+        answers[np.searchsorted(scan_ids, scan_column), np.array(questions) - 1] = \
+            [letter_code(letter) for letter in letters]
+    key = compile_key({i: letter for i, letter in enumerate(quiz.answer_key, start=1)}, quiz.num_items)
+    return students, scan_ids, answers, key
+
+
+def _wrong_probabilities(wrong, steps=RASCH_STEPS):
+    """
+    p_aq, the chance student a gets question q wrong, from a Rasch model
+    logit p_aq = difficulty_q - ability_a fitted to the wrong-answer mask by
+    alternating Newton steps. Students or questions that are all right or
+    all wrong get clipped, near-certain probabilities.
+    """
+    observed = wrong.astype(np.float64)
+    ability = np.zeros(observed.shape[0])
+    difficulty = np.zeros(observed.shape[1])
+
+    def probabilities():
+        return 1.0 / (1.0 + np.exp(ability[:, None] - difficulty[None, :]))
+
+    for _ in range(steps):
+        p = probabilities()
+        ability -= (observed - p).sum(axis=1) / np.maximum((p * (1 - p)).sum(axis=1), 1e-9)
+        np.clip(ability, -RASCH_LIMIT, RASCH_LIMIT, out=ability)
+        p = probabilities()
+        difficulty += (observed - p).sum(axis=0) / np.maximum((p * (1 - p)).sum(axis=0), 1e-9)
+        np.clip(difficulty, -RASCH_LIMIT, RASCH_LIMIT, out=difficulty)
+    return probabilities().astype(np.float32)
+
+
+def _model(answers, key):
+    """
+    The one-hot wrong-answer matrix and the per-student, per-question
+    probabilities of the independence model: returns (wrong choices, P, P s, P^2, P^2 s^2).
+    """
+    students, questions = answers.shape
+    choices = int(max(answers.max(initial=0), key.max(initial=0)))
+    wrong = (answers > BLANK) & (answers != key)
+    rows, columns = np.nonzero(wrong)
+    onehot = np.zeros((students, questions, max(choices, 1)), dtype=np.float32)
+    onehot[rows, columns, answers[rows, columns] - 1] = 1
+    picked = onehot.sum(axis=0)                             # questions x choices
+
+    # s_q: chance that two wrong answers to q are the same letter
+    wrong_per_question = picked.sum(axis=1)
+    shares = np.divide(picked, wrong_per_question[:, None], out=np.zeros_like(picked),
+                       where=wrong_per_question[:, None] > 0)
+    same_letter = (shares ** 2).sum(axis=1)
+
+    p = _wrong_probabilities(wrong)
+    p2 = p * p
+    return onehot.reshape(students, questions * max(choices, 1)), p, p * same_letter, p2, p2 * (same_letter ** 2)
+
+
+def screen(answers, key, alpha=0.001, min_shared=4, max_pairs=100, block_rows=256):
+    """
+    Rank the pairs of rows of answers (students x questions codes) whose
+    identical wrong answers clear the threshold. Returns (pairs, stats):
+    pairs are dicts of row indices a < b and the pair's counts, highest z
+    first; stats describe the run.
+    """
+    started = time.perf_counter()
+    students = len(answers)
+    pair_count = students * (students - 1) // 2
+    critical_z = NormalDist().inv_cdf(1 - alpha / max(pair_count, 1))
+    stats = {
+        'students': students,
+        'questions': answers.shape[1],
+        'pairs': pair_count,
+        'flagged': 0,
+        'critical_z': round(critical_z, 2),
+        'seconds': 0.0,
+    }
+    if students < 2:
+        # Nothing to compare, and no cohort to fit the model to
+        return [], stats
+    wrong_choices, p, p_same, p2, p2_same2 = _model(answers, key)
+    wrong = (answers > BLANK) & (answers != key)
+    wrong_f = wrong.astype(np.float32)
+    answered = answers > BLANK
+
+    best = []   # heap of (z, a, b, identical, expected)
+    flagged = 0
+    for start in range(0, students, block_rows):
+        stop = min(start + block_rows, students)
+        # This block against itself and every later row; the upper triangle only
+        identical = wrong_choices[start:stop] @ wrong_choices[start:].T
+        expected = p_same[start:stop] @ p[start:].T
+        variance = expected - p2_same2[start:stop] @ p2[start:].T
+        z = (identical - expected) / np.sqrt(np.maximum(variance, 1e-6))
+        local = np.arange(stop - start)[:, None]
+        later = np.arange(students - start)[None, :] > local
+        hits = later & (identical >= min_shared) & (z >= critical_z)
+        for i, j in zip(*np.nonzero(hits)):
+            flagged += 1
+            entry = (float(z[i, j]), start + int(i), start + int(j), int(identical[i, j]), float(expected[i, j]))
+            if len(best) < max_pairs:
+                heapq.heappush(best, entry)
+            elif entry > best[0]:
+                heapq.heapreplace(best, entry)
+
+    pairs = []
+    for z_score, a, b, identical, expected in sorted(best, reverse=True):
+        pairs.append({
+            'a': a, 'b': b,
+            'identical_wrong': identical,
+            'expected': round(expected, 2),
+            'z': round(z_score, 2),
+            'both_wrong': int((wrong_f[a] * wrong_f[b]).sum()),
+            'same_answers': int((answered[a] & (answers[a] == answers[b])).sum()),
+        })
+    stats.update(flagged=flagged, seconds=round(time.perf_counter() - started, 3))
+    return pairs, stats
+
+
+def screen_quiz(app, quiz, section_id=None):
+    """Screen a quiz's cohort (see load_cohort). Returns (pairs with student details, stats)."""
+    settings = similarity_settings(app)
+    students, scan_ids, answers, key = load_cohort(quiz, section_id)
+    pairs, stats = screen(answers, key, settings['SIMILARITY_ALPHA'], settings['SIMILARITY_MIN_SHARED'],
+                          settings['SIMILARITY_MAX_PAIRS'], settings['SIMILARITY_BLOCK_ROWS'])
+    for pair in pairs:
+        a, b = pair.pop('a'), pair.pop('b')
+        pair.update(student_a=students[a][0], student_a_id=students[a][1], scan_a=int(scan_ids[a]),
+                    student_b=students[b][0], student_b_id=students[b][1], scan_b=int(scan_ids[b]))
+    print(f"Similarity screening of quiz {quiz.id}: {stats}")
+    return pairs, stats
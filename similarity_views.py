@@ -0,0 +1,57 @@
+"""
+The similarity page and the `flask similarity` command (see similarity.py).
+
+Registered with the app at startup. The screening itself needs NumPy, so
+similarity.py is only imported once a screening is asked for; importing
+the app stays free of the scanning stack (see startup_bench.py).
+"""
+import csv
+import sys
+from datetime import datetime
+
+import click
+from flask import jsonify, render_template, request
+
+from models import db, Quiz
+
+
+def init_similarity(app):
+    """Register the similarity page and the `flask similarity` command."""
+    @app.route('/quiz/<int:quiz_id>/similarity')
+    def quiz_similarity(quiz_id):
+        from similarity import screen_quiz
+
+        quiz = Quiz.query.get_or_404(quiz_id)
+        everyone = request.args.get('all') == '1'
+        pairs, stats = screen_quiz(app, quiz, None if everyone else quiz.section_id)
+        if request.args.get('format') == 'json':
+            return jsonify(quiz_id=quiz.id, all_students=everyone, stats=stats, pairs=pairs)
+        return render_template('similarity.html', quiz=quiz, pairs=pairs, stats=stats, all_students=everyone,
+                               now=datetime.now())
+
+    @app.cli.command('similarity')
+    @click.option('--quiz', 'quiz_id', type=int, required=True, help='Quiz to screen.')
+    @click.option('--section', 'section_id', type=int, default=None, help="Section to screen (default: the quiz's).")
+    @click.option('--all-students', is_flag=True, help='Screen everyone graded against the quiz.')
+    @click.option('--csv', 'csv_path', type=click.Path(dir_okay=False, writable=True), default=None,
+                  help='Write the flagged pairs to this CSV file instead of the terminal.')
+    def similarity_command(quiz_id, section_id, all_students, csv_path):
+        """Flag pairs of students with unusually many identical wrong answers on a quiz."""
+        from similarity import PAIR_FIELDS, screen_quiz
+
+        quiz = db.session.get(Quiz, quiz_id)
+        if quiz is None:
+            raise click.BadParameter(f"No quiz with id {quiz_id}", param_hint='--quiz')
+        if not all_students and section_id is None:
+            section_id = quiz.section_id
+        pairs, stats = screen_quiz(app, quiz, None if all_students else section_id)
+        out = open(csv_path, 'w', newline='') if csv_path else sys.stdout
+        try:
+            writer = csv.DictWriter(out, fieldnames=PAIR_FIELDS)
+            writer.writeheader()
+            writer.writerows(pairs)
+        finally:
+            if csv_path:
+                out.close()
+        click.echo(f"{stats['flagged']} of {stats['pairs']} pairs of {stats['students']} students flagged "
+                   f"(z >= {stats['critical_z']}) in {stats['seconds']} s", err=not csv_path)
@@ -0,0 +1,96 @@
+"""
+Cold-start benchmark for the web app.
+
+Imports the app in fresh interpreters, the way a gunicorn worker or a
+restarted container does, and reports how long the import takes and which
+heavy modules it pulled in. Importing the app must not load the vision and
+OCR stack (the scanner loads it on first use) and must stay within a time
+budget; the exit status is 1 when either check fails, so this can gate CI.
+
+    python startup_bench.py --runs 5 --budget-ms 1500
+    STARTUP_BUDGET_MS=1200 python startup_bench.py --json startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Modules only the scanning subsystem should load
+HEAVY_MODULES = ['cv2', 'numpy', 'pytesseract', 'Levenshtein', 'pdf2image', 'PIL', 'pyzbar', 'reportlab',
+                 'scanner', 'template_detect']
+DEFAULT_BUDGET_MS = 1500
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+print(json.dumps({'import_s': elapsed, 'heavy': [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def measure_once():
+    """Import the app in a new interpreter. Returns (wall seconds, import seconds, heavy modules loaded)."""
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-c', PROBE], capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing the app failed:\n{proc.stderr}")
+    probe = json.loads(proc.stdout.strip().splitlines()[-1])
+    return wall, probe['import_s'], probe['heavy']
+
+
+def run(runs):
+    """Measure several cold starts. Returns the report dict."""
+    walls, imports, heavy = [], [], set()
+    for _ in range(runs):
+        wall, import_s, loaded = measure_once()
+        walls.append(wall)
+        imports.append(import_s)
+        heavy.update(loaded)
+    return {
+        'runs': runs,
+        'wall_ms_median': round(statistics.median(walls) * 1000, 1),
+        'wall_ms_max': round(max(walls) * 1000, 1),
+        'import_ms_median': round(statistics.median(imports) * 1000, 1),
+        'heavy_modules': sorted(heavy),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='cold starts to measure')
+    parser.add_argument('--budget-ms', type=float,
+                        default=float(os.environ.get('STARTUP_BUDGET_MS', DEFAULT_BUDGET_MS)),
+                        help='fail when the median wall time (interpreter start + import) exceeds this')
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+
+    report = run(args.runs)
+    report['budget_ms'] = args.budget_ms
+    print(f"Cold start over {report['runs']} runs: median {report['wall_ms_median']} ms "
+          f"(max {report['wall_ms_max']} ms), of which importing the app {report['import_ms_median']} ms")
+
+    failures = []
+    if report['heavy_modules']:
+        failures.append(f"importing the app loaded {', '.join(report['heavy_modules'])}")
+    if report['wall_ms_median'] > args.budget_ms:
+        failures.append(f"median {report['wall_ms_median']} ms is over the {args.budget_ms:.0f} ms budget")
+    report['ok'] = not failures
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print(f"OK: within the {args.budget_ms:.0f} ms budget, no scanner modules loaded")
+
+
+if __name__ == '__main__':
+    main()
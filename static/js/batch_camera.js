@@ -72,43 +72,35 @@ document.addEventListener('DOMContentLoaded', function() {
         finishBatchBtn.disabled = true;
         captureBtn.disabled = true;
         
-        // Process each image sequentially
-        processImages(0);
-    });
-    
-    function processImages(index) {
-        if (index >= capturedImages.length) {
-            // All images processed, redirect to home
-            window.location.href = '/';
-            return;
-        }
-        
-        const image = capturedImages[index];
-        
-        fetch('/process_camera_image', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                image_data: image.data,
-                template: image.template
-            })
-        })
-        .then(response => response.json())
-        .then(data => {
-            if (data.error) {
-                alert(`Error processing sheet ${index + 1}: ${data.error}`);
+        // Upload the captures as one batch job; the server grades them in the
+        // background and the progress panel follows along
+        const blobs = capturedImages.map((image, index) => {
+            const binary = atob(image.data.split(',')[1]);
+            const bytes = new Uint8Array(binary.length);
+            for (let i = 0; i < binary.length; i++) {
+                bytes[i] = binary.charCodeAt(i);
             }
-            // Process next image
-            processImages(index + 1);
-        })
-        .catch(error => {
-            console.error('Error:', error);
-            alert(`Error processing sheet ${index + 1}`);
-            processImages(index + 1);
+            const file = new Blob([bytes], { type: 'image/png' });
+            file.name = `capture_${index + 1}.png`;
+            return file;
         });
-    }
+        
+        BatchProgress.submitFiles(blobs, document.getElementById('template').value, document.getElementById('quiz').value)
+            .then(() => {
+                capturedImages = [];
+                previewContainer.innerHTML = '';
+                scannedCount.textContent = 0;
+                finishBatchBtn.classList.add('d-none');
+            })
+            .catch(error => {
+                console.error('Error:', error);
+                alert('Error uploading the batch: ' + error.message);
+            })
+            .finally(() => {
+                finishBatchBtn.disabled = false;
+                captureBtn.disabled = false;
+            });
+    });
     
     // Clean up when leaving the page
     window.addEventListener('beforeunload', function() {
@@ -0,0 +1,219 @@
+// Batch grading: upload files into a batch job and follow its progress live.
+// The server grades in the background and pushes progress as Server-Sent Events.
+const BatchProgress = (function() {
+    const PARALLEL_UPLOADS = 2;
+    const MAX_RETRIES = 8;
+
+    function postJSON(url, body) {
+        return fetch(url, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(body || {})
+        }).then(response => {
+            if (!response.ok) {
+                throw new Error(`${url} failed (${response.status})`);
+            }
+            return response.json();
+        });
+    }
+
+    function delay(ms) {
+        return new Promise(resolve => setTimeout(resolve, ms));
+    }
+
+    // Send a file's chunks from offset on. After a failure, ask the server how
+    // much arrived and carry on from there, backing off between attempts.
+    function sendChunks(url, file, chunkSize, offset, failures) {
+        if (offset >= file.size) {
+            return Promise.resolve();
+        }
+        const end = Math.min(offset + chunkSize, file.size);
+        return fetch(url, {
+            method: 'PATCH',
+            headers: {
+                'Content-Type': 'application/offset+octet-stream',
+                'Upload-Offset': String(offset)
+            },
+            body: file.slice(offset, end)
+        })
+        .then(response => response.json().then(data => ({ response: response, data: data })))
+        .then(({ response, data }) => {
+            if (data.complete) {
+                return;
+            }
+            if (response.status === 410) {
+                throw new Error(data.error);
+            }
+            if (!response.ok) {
+                // Usually 409: the server has a different offset; resume from it
+                if (failures >= MAX_RETRIES) {
+                    throw new Error(data.error || `upload failed (${response.status})`);
+                }
+                return sendChunks(url, file, chunkSize, data.offset, failures + 1);
+            }
+            return sendChunks(url, file, chunkSize, data.offset, 0);
+        }, error => {
+            // The connection dropped; find out what the server kept
+            if (failures >= MAX_RETRIES) {
+                throw error;
+            }
+            return delay(Math.min(1000 * 2 ** failures, 30000))
+                .then(() => fetch(url, { cache: 'no-store' }))
+                .then(response => response.json())
+                .then(data => data.complete ? undefined : sendChunks(url, file, chunkSize, data.offset, failures + 1),
+                      () => sendChunks(url, file, chunkSize, offset, failures + 1));
+        });
+    }
+
+    // Upload one file in resumable chunks; the server queues it for grading as
+    // soon as its last chunk arrives
+    function uploadFile(jobId, file, name) {
+        return postJSON(`/batch-jobs/${jobId}/uploads`, { filename: name, size: file.size })
+            .then(upload => {
+                const url = `/batch-jobs/${jobId}/uploads/${upload.upload_id}`;
+                return sendChunks(url, file, upload.chunk_size, upload.offset, 0)
+                    .catch(error => {
+                        // Give up on it so the rest of the batch can finish
+                        fetch(url, { method: 'DELETE' });
+                        throw error;
+                    });
+            });
+    }
+
+    // Upload files (File or Blob objects) as one batch job, graded against
+    // quizId's key when given; resolves to the job id
+    function submitFiles(files, template, quizId) {
+        return postJSON('/batch-jobs', { template: template, quiz_id: quizId || null }).then(job => {
+            watch(job.job_id);
+            const queue = files.map((file, index) => ({ file: file, name: file.name || `sheet_${index + 1}.png` }));
+            const failed = [];
+            function lane() {
+                const next = queue.shift();
+                if (!next) {
+                    return Promise.resolve();
+                }
+                return uploadFile(job.job_id, next.file, next.name)
+                    .catch(error => {
+                        console.error(`Error uploading ${next.name}:`, error);
+                        failed.push(next.name);
+                    })
+                    .then(lane);
+            }
+            const lanes = [];
+            for (let i = 0; i < PARALLEL_UPLOADS; i++) {
+                lanes.push(lane());
+            }
+            return Promise.all(lanes)
+                .then(() => postJSON(`/batch-jobs/${job.job_id}/close`))
+                .then(() => {
+                    if (failed.length) {
+                        alert(`These files could not be uploaded: ${failed.join(', ')}`);
+                    }
+                    return job.job_id;
+                });
+        });
+    }
+
+    function renderItem(item) {
+        const tbody = document.querySelector('#jobItems tbody');
+        let row = document.getElementById(`batch-item-${item.id}`);
+        if (!row) {
+            row = document.createElement('tr');
+            row.id = `batch-item-${item.id}`;
+            row.innerHTML = '<td class="item-file"></td><td class="item-status"></td><td class="item-score"></td>';
+            tbody.appendChild(row);
+        }
+        row.querySelector('.item-file').textContent = item.filename;
+
+        const badges = { queued: 'secondary', grading: 'info', done: 'success', error: 'danger' };
+        const status = row.querySelector('.item-status');
+        status.innerHTML = `<span class="badge bg-${badges[item.status] || 'secondary'}"></span>`;
+        status.firstChild.textContent = item.status === 'error' ? `error: ${item.error}` : item.status;
+
+        const score = row.querySelector('.item-score');
+        if (item.status === 'done') {
+            score.innerHTML = `<a href="/result/${item.scan_id}"></a>`;
+            score.firstChild.textContent = `${item.score}/${item.total} (${Math.round(item.percentage)}%)`;
+        } else {
+            score.textContent = '';
+        }
+    }
+
+    function renderProgress(summary) {
+        const finished = summary.done + summary.error;
+        const percent = summary.total ? Math.round(100 * finished / summary.total) : 0;
+        const bar = document.getElementById('jobProgressBar');
+        bar.style.width = `${percent}%`;
+        bar.textContent = `${percent}%`;
+        let text = `${finished} of ${summary.total} graded`;
+        if (summary.error) {
+            text += `, ${summary.error} failed`;
+        }
+        if (summary.status === 'open' || summary.uploading) {
+            text += ' (still uploading)';
+        }
+        document.getElementById('jobSummary').textContent = text;
+    }
+
+    // Follow a job's progress stream until it completes
+    function watch(jobId) {
+        const panel = document.getElementById('jobProgress');
+        panel.classList.remove('d-none');
+        panel.dataset.jobId = jobId;
+
+        const source = new EventSource(`/batch-jobs/${jobId}/events`);
+        source.addEventListener('item', event => renderItem(JSON.parse(event.data)));
+        source.addEventListener('progress', event => renderProgress(JSON.parse(event.data)));
+        source.addEventListener('complete', event => {
+            const summary = JSON.parse(event.data);
+            renderProgress(summary);
+            document.getElementById('jobProgressBar').classList.add(summary.error ? 'bg-warning' : 'bg-success');
+            source.close();
+        });
+        return source;
+    }
+
+    return { submitFiles: submitFiles, watch: watch };
+})();
+
+document.addEventListener('DOMContentLoaded', function() {
+    const form = document.getElementById('batchUploadForm');
+    const fileInput = document.getElementById('batchFiles');
+    const templateSelect = document.getElementById('template');
+    const quizSelect = document.getElementById('quiz');
+    const panel = document.getElementById('jobProgress');
+
+    // Returning from a plain form POST: follow the job it created
+    if (panel && panel.dataset.jobId) {
+        BatchProgress.watch(panel.dataset.jobId);
+    }
+
+    if (!form) {
+        return;
+    }
+    form.addEventListener('submit', function(event) {
+        document.getElementById('batchTemplate').value = templateSelect.value;
+        document.getElementById('batchQuiz').value = quizSelect.value;
+        if (!window.EventSource || !window.fetch) {
+            return;  // let the browser post the form
+        }
+        event.preventDefault();
+        const files = Array.from(fileInput.files);
+        if (files.length === 0) {
+            alert('Please select files to upload');
+            return;
+        }
+        const button = document.getElementById('batchUploadBtn');
+        button.disabled = true;
+        document.querySelector('#jobItems tbody').innerHTML = '';
+        BatchProgress.submitFiles(files, templateSelect.value, quizSelect.value)
+            .catch(error => {
+                console.error('Error:', error);
+                alert('Error uploading the batch: ' + error.message);
+            })
+            .finally(() => {
+                button.disabled = false;
+                form.reset();
+            });
+    });
+});
@@ -67,7 +67,8 @@ document.addEventListener('DOMContentLoaded', function() {
             },
             body: JSON.stringify({
                 image_data: imageData,
-                template: document.getElementById('template').value
+                template: document.getElementById('template').value,
+                quiz_id: document.getElementById('quiz').value
             })
         })
         .then(response => response.json())
@@ -0,0 +1,217 @@
+import os
+import threading
+import traceback
+from contextlib import contextmanager
+
+import click
+from sqlalchemy import event, inspect
+from sqlalchemy.pool import NullPool, QueuePool, SingletonThreadPool, StaticPool
+
+# Pool strategies selectable through the DB_POOL setting
+POOL_CLASSES = {
+    'queue': QueuePool,
+    'null': NullPool,
+    'static': StaticPool,
+    'singleton': SingletonThreadPool,
+}
+
+# Defaults tuned for several gunicorn workers sharing one SQLite file.
+# Every value can be overridden through app.config or an environment variable.
+STORAGE_DEFAULTS = {
+    'SQLITE_JOURNAL_MODE': 'WAL',       # readers no longer block the writer
+    'SQLITE_SYNCHRONOUS': 'NORMAL',     # durable with WAL, fsync only at checkpoints
+    'SQLITE_BUSY_TIMEOUT': 30000,       # ms to wait on a locked database before failing
+    'SQLITE_CACHE_SIZE': -20000,        # negative = KiB, so ~20MB of page cache per connection
+    'SQLITE_MMAP_SIZE': 256 * 1024 * 1024,
+    'SQLITE_BEGIN_MODE': 'DEFERRED',    # default transaction mode, see write_transaction()
+    'DB_POOL': 'queue',
+    'DB_POOL_SIZE': 5,
+    'DB_MAX_OVERFLOW': 5,
+    'DB_POOL_TIMEOUT': 30,
+}
+
+
+def _setting(app, key):
+    """Read a storage setting from app.config, then the environment, then the defaults."""
+    if key in app.config:
+        return app.config[key]
+    default = STORAGE_DEFAULTS[key]
+    value = os.environ.get(key)
+    if value is None:
+        return default
+    return type(default)(value) if isinstance(default, int) else value
+
+
+def configure_storage(app):
+    """
+    Configure the SQLAlchemy engine before db.init_app() is called.
+    Sets the database URI, the connection pool strategy and, for SQLite,
+    the options needed to tune each pooled connection.
+    """
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', os.environ.get('DATABASE_URL', 'sqlite:///app.db'))
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+
+    for key in STORAGE_DEFAULTS:
+        app.config[key] = _setting(app, key)
+
+    pool_name = str(app.config['DB_POOL']).lower()
+    if pool_name not in POOL_CLASSES:
+        raise ValueError(f"Unknown DB_POOL '{pool_name}', expected one of {', '.join(POOL_CLASSES)}")
+
+    if uri in ('sqlite://', 'sqlite:///:memory:'):
+        # An in-memory database only exists on its one connection
+        pool_name = 'static'
+
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    options.setdefault('poolclass', POOL_CLASSES[pool_name])
+    options.setdefault('pool_pre_ping', not uri.startswith('sqlite'))
+    if pool_name == 'queue':
+        # A small per-worker pool: one connection per request thread plus some headroom
+        options.setdefault('pool_size', app.config['DB_POOL_SIZE'])
+        options.setdefault('max_overflow', app.config['DB_MAX_OVERFLOW'])
+        options.setdefault('pool_timeout', app.config['DB_POOL_TIMEOUT'])
+
+    if uri.startswith('sqlite'):
+        connect_args = dict(options.get('connect_args', {}))
+        # The sqlite3 module's own timeout, kept in line with busy_timeout
+        connect_args.setdefault('timeout', app.config['SQLITE_BUSY_TIMEOUT'] / 1000)
+        # Pooled connections are handed between request threads
+        connect_args.setdefault('check_same_thread', False)
+        options['connect_args'] = connect_args
+
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def register_sqlite_pragmas(app, engine):
+    """Apply the configured PRAGMAs to every new connection opened by the engine's pool."""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    pragmas = [
+        f"PRAGMA journal_mode={app.config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA synchronous={app.config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA busy_timeout={int(app.config['SQLITE_BUSY_TIMEOUT'])}",
+        f"PRAGMA cache_size={int(app.config['SQLITE_CACHE_SIZE'])}",
+        f"PRAGMA mmap_size={int(app.config['SQLITE_MMAP_SIZE'])}",
+    ]
+    begin_mode = str(app.config['SQLITE_BEGIN_MODE']).upper()
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        # Let SQLAlchemy emit BEGIN itself so the transaction mode can be chosen
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def begin_transaction(conn):
+        mode = conn.get_execution_options().get('sqlite_begin', begin_mode)
+        conn.exec_driver_sql(f"BEGIN {mode}")
+
+
+def init_storage(app, db):
+    """Hook the connection tuning into every engine managed by Flask-SQLAlchemy."""
+    with app.app_context():
+        for engine in db.engines.values():
+            register_sqlite_pragmas(app, engine)
+
+
+def dispose_engines(app, db):
+    """
+    Drop pooled connections inherited from a parent process.
+    Call this after a fork so each worker opens its own SQLite handles.
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def upgrade_schema(app, db):
+    """
+    Add columns and indexes that were added to the models after a table was
+    created. db.create_all() only creates missing tables, so an existing
+    database would otherwise lack them. Only nullable columns without
+    defaults are added; anything else needs a real migration.
+    """
+    with app.app_context():
+        engine = db.engine
+        inspector = inspect(engine)
+        existing_tables = set(inspector.get_table_names())
+        with engine.begin() as conn:
+            for table in db.metadata.sorted_tables:
+                if table.name not in existing_tables:
+                    continue
+                present = {column['name'] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in present or not column.nullable:
+                        continue
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    print(f"Adding column {table.name}.{column.name}")
+                    conn.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}')
+                present_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+                for index in table.indexes:
+                    if index.name not in present_indexes:
+                        print(f"Adding index {index.name}")
+                        index.create(conn)
+
+
+def create_schema(app, db):
+    """Create missing tables, then add missing columns (see upgrade_schema)."""
+    with app.app_context():
+        db.create_all()
+    upgrade_schema(app, db)
+
+
+def init_schema(app, db):
+    """
+    Register `flask init-db` and, unless SCHEMA_AUTO_CREATE is off, create the
+    schema on the first request. Nothing touches the database at import time,
+    so importing the app (CLI commands, preloading, tests) stays cheap.
+    """
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create missing tables and columns."""
+        create_schema(app, db)
+        click.echo("Database schema is up to date.")
+
+    state = {'ready': not app.config.get('SCHEMA_AUTO_CREATE', True)}
+    lock = threading.Lock()
+
+    @app.before_request
+    def ensure_schema():
+        if state['ready']:
+            return
+        with lock:
+            if state['ready']:
+                return
+            try:
+                create_schema(app, db)
+            except Exception as e:
+                # Another worker may have created the same table in between; a
+                # second pass finds it and carries on
+                print(f"Schema creation failed, retrying: {e}")
+                traceback.print_exc()
+                create_schema(app, db)
+            state['ready'] = True
+
+
+@contextmanager
+def write_transaction(session):
+    """
+    Run a read-then-write block (look up the student, then insert the scan) in
+    one transaction that takes the SQLite write lock up front (BEGIN IMMEDIATE).
+    A deferred transaction that reads first fails at once with "database is
+    locked" when another worker commits in between; an immediate one waits on
+    busy_timeout instead. Commits at the end, rolls back on error.
+    """
+    # End any read transaction so the next one can begin in the right mode
+    session.commit()
+    session.connection(execution_options={'sqlite_begin': 'IMMEDIATE'})
+    try:
+        yield session
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
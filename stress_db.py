@@ -0,0 +1,119 @@
+"""
+Concurrency stress test for the persistence path.
+
+Starts N writer processes (one per simulated gunicorn worker), each with a few
+threads, that repeatedly save a scan through routes.save_scan_result, the
+same persistence path the scan routes use: look up or create the student,
+insert a ScanResult, then insert its Answer rows.
+
+    python stress_db.py --writers 8 --threads 2 --scans 50
+    DB_POOL=null SQLITE_JOURNAL_MODE=DELETE python stress_db.py   # compare settings
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+
+def _writer(db_url, scans, threads, questions, results):
+    os.environ['DATABASE_URL'] = db_url
+    from app import app
+    from routes import save_scan_result
+    from scanner import SheetResult
+
+    counts = {'ok': 0, 'locked': 0, 'other': 0}
+    latencies = []
+    lock = threading.Lock()
+    correct_answers = {str(q): 'A' for q in range(1, questions + 1)}
+
+    def save_scans():
+        for _ in range(scans):
+            student = {'name': f"STUDENT {random.randint(1, 200)}", 'id': str(random.randint(10000000, 99999999))}
+            answers = {q: random.choice('ABCD') for q in correct_answers}
+            result = SheetResult.build('standard_20', student, answers, correct_answers)
+            started = time.perf_counter()
+            try:
+                with app.app_context():
+                    save_scan_result(result, None)
+                outcome = 'ok'
+            except Exception as e:
+                outcome = 'locked' if 'database is locked' in str(e) else 'other'
+                if outcome == 'other':
+                    print(f"Writer error: {e}")
+            elapsed = time.perf_counter() - started
+            with lock:
+                counts[outcome] += 1
+                latencies.append(elapsed)
+
+    workers = [threading.Thread(target=save_scans) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+
+    results.put((counts, latencies))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=4, help='parallel writer processes')
+    parser.add_argument('--threads', type=int, default=2, help='threads per writer process')
+    parser.add_argument('--scans', type=int, default=25, help='scans saved by each thread')
+    parser.add_argument('--questions', type=int, default=20, help='answers per scan')
+    parser.add_argument('--db', help='SQLite file to write to (default: a fresh temporary file)')
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix='stress_db_'), 'stress.db')
+    db_url = f"sqlite:///{os.path.abspath(db_path)}"
+
+    # Create the schema once, before the writers start
+    os.environ['DATABASE_URL'] = db_url
+    from app import app, db
+    with app.app_context():
+        db.create_all()
+
+    print(f"Database: {db_path}")
+    print(f"Settings: journal_mode={app.config['SQLITE_JOURNAL_MODE']} synchronous={app.config['SQLITE_SYNCHRONOUS']} "
+          f"busy_timeout={app.config['SQLITE_BUSY_TIMEOUT']} pool={app.config['DB_POOL']} "
+          f"begin={app.config['SQLITE_BEGIN_MODE']}")
+
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(target=_writer, args=(db_url, args.scans, args.threads, args.questions, results))
+        for _ in range(args.writers)
+    ]
+
+    started = time.perf_counter()
+    for p in processes:
+        p.start()
+    totals = {'ok': 0, 'locked': 0, 'other': 0}
+    latencies = []
+    for _ in processes:
+        counts, lat = results.get()
+        for key in totals:
+            totals[key] += counts[key]
+        latencies.extend(lat)
+    for p in processes:
+        p.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    attempted = sum(totals.values())
+    print(f"Writers: {args.writers} x {args.threads} threads, {attempted} scans in {elapsed:.2f}s "
+          f"({totals['ok'] / elapsed:.1f} scans/s)")
+    print(f"Committed: {totals['ok']}  database is locked: {totals['locked']}  other errors: {totals['other']}")
+    if latencies:
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"Latency per scan: p50={p50 * 1000:.1f}ms p99={p99 * 1000:.1f}ms max={latencies[-1] * 1000:.1f}ms")
+
+    return 0 if totals['locked'] == 0 and totals['other'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
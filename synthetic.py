@@ -0,0 +1,183 @@
+"""
+Synthetic answer sheet generator.
+
+Renders the layouts from sheet_templates.json into images, fills bubbles at
+random and records the ground truth, optionally degrading the image with
+noise, blur, rotation and a lighting gradient the way phone photos are.
+
+    python synthetic.py --template extended_50 --count 100 --out corpus/ --noise 8 --rotate 2
+"""
+import argparse
+import json
+import os
+import random
+
+import cv2
+import numpy as np
+
+from template_registry import TEMPLATE_REGISTRY, printed_templates, sheet_layout
+
+# Template name -> question count, for the layouts we print
+TEMPLATE_QUESTIONS = {spec.name: spec.questions for spec in printed_templates()}
+
+FIRST_NAMES = ['JOHN', 'MARIA', 'ANGELO', 'NICOLE', 'PAOLO', 'ANNA', 'MARK', 'GRACE', 'CARLO', 'JOY']
+LAST_NAMES = ['SANTOS', 'REYES', 'CRUZ', 'BAUTISTA', 'GARCIA', 'MENDOZA', 'TORRES', 'RAMOS', 'AQUINO', 'CASTRO']
+
+
+def random_student(rng):
+    """Make up a roster-style student: 'LASTNAME, FIRSTNAME' and an 8-digit ID."""
+    name = f"{rng.choice(LAST_NAMES)}, {rng.choice(FIRST_NAMES)} {rng.choice(FIRST_NAMES)}"
+    return {'name': name, 'id': str(rng.randint(20180000, 20249999))}
+
+
+def random_answers(num_questions, rng, blank_rate=0.05, choices=('A', 'B', 'C', 'D')):
+    """Pick one answer per question, leaving roughly blank_rate of them empty."""
+    return {
+        str(q): None if rng.random() < blank_rate else rng.choice(choices)
+        for q in range(1, num_questions + 1)
+    }
+
+
+def render_sheet(template_name, answers, student, dpi=100):
+    """
+    Draw a clean filled-in sheet for the template.
+    Returns a BGR image the size of a letter page at the given dpi.
+    """
+    spec = TEMPLATE_REGISTRY[template_name]
+    layout = sheet_layout(spec)
+    page_w, page_h = layout['page_size']
+    scale = dpi / 72.0
+
+    def px(x, y):
+        # PDF points (origin bottom-left) to pixel coordinates (origin top-left)
+        return int(round(x * scale)), int(round((page_h - y) * scale))
+
+    img = np.full((int(page_h * scale), int(page_w * scale), 3), 255, np.uint8)
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    black = (0, 0, 0)
+
+    title = spec.title
+    (tw, _), _ = cv2.getTextSize(title, font, 0.3 * scale, 2)
+    cv2.putText(img, title, (px(page_w / 2, 0)[0] - tw // 2, px(0, layout['title_y'])[1]),
+                font, 0.3 * scale, black, 2, cv2.LINE_AA)
+
+    # Printed labels and boxes, with the student's details written inside the boxes
+    for name, field in layout['fields'].items():
+        cv2.putText(img, field['label'], px(*field['label_at']), font, 0.22 * scale, black, 1, cv2.LINE_AA)
+        x, y, w, h = field['box']
+        cv2.rectangle(img, px(x, y + h), px(x + w, y), black, 1)
+        cv2.putText(img, student.get(name, ''), px(x + 4, y + h * 0.25), font, 0.22 * scale, black, 1,
+                    cv2.LINE_AA)
+
+    # Question numbers end at x, like the right-aligned numbers on the PDF
+    for question, x, y in layout['labels']:
+        text = f"{question}."
+        (tw, th), _ = cv2.getTextSize(text, font, 0.18 * scale, 1)
+        left, baseline = px(x, y)
+        cv2.putText(img, text, (left - tw, baseline + th // 2), font, 0.18 * scale, black, 1, cv2.LINE_AA)
+
+    radius = max(2, int(round(layout['bubble_radius'] * scale)))
+    for question, j, x, y in layout['bubbles']:
+        centre = px(x, y)
+        if answers.get(str(question)) == spec.choices[j]:
+            cv2.circle(img, centre, radius, (40, 40, 40), -1, cv2.LINE_AA)
+        else:
+            cv2.circle(img, centre, radius, black, 1, cv2.LINE_AA)
+
+    return img
+
+
+def degrade(img, rng, noise=0.0, blur=0, rotate=0.0, gradient=0.0):
+    """
+    Apply capture artefacts: gaussian noise (std dev in grey levels), box blur
+    (kernel size), rotation (max degrees either way) and a lighting gradient
+    (0-1, fraction of brightness lost across the page).
+    """
+    out = img.astype(np.float32)
+    h, w = img.shape[:2]
+
+    if gradient > 0:
+        angle = rng.uniform(0, 2 * np.pi)
+        xs, ys = np.meshgrid(np.linspace(-1, 1, w), np.linspace(-1, 1, h))
+        ramp = (xs * np.cos(angle) + ys * np.sin(angle) + 1) / 2
+        out *= (1.0 - gradient * ramp)[..., None]
+
+    if noise > 0:
+        np_rng = np.random.default_rng(rng.randint(0, 2**31))
+        out += np_rng.normal(0, noise, out.shape)
+
+    out = np.clip(out, 0, 255).astype(np.uint8)
+
+    if blur and blur > 1:
+        out = cv2.blur(out, (int(blur), int(blur)))
+
+    if rotate:
+        degrees = rng.uniform(-rotate, rotate)
+        matrix = cv2.getRotationMatrix2D((w / 2, h / 2), degrees, 1.0)
+        out = cv2.warpAffine(out, matrix, (w, h), borderMode=cv2.BORDER_CONSTANT, borderValue=(255, 255, 255))
+
+    return out
+
+
+def generate_sheet(template_name, rng, dpi=100, blank_rate=0.05, **degradation):
+    """Render one random sheet. Returns (image, ground truth dict)."""
+    student = random_student(rng)
+    spec = TEMPLATE_REGISTRY[template_name]
+    answers = random_answers(spec.questions, rng, blank_rate, spec.choices)
+    img = render_sheet(template_name, answers, student, dpi)
+    img = degrade(img, rng, **degradation)
+    return img, {'template': template_name, 'student': student, 'answers': answers}
+
+
+def generate_corpus(out_dir, templates, count, seed=0, dpi=100, blank_rate=0.05, **degradation):
+    """
+    Write count sheets per template into out_dir with a manifest.json holding
+    the ground truth and generation settings. Returns the manifest.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    sheets = []
+    for template_name in templates:
+        for i in range(count):
+            img, truth = generate_sheet(template_name, rng, dpi, blank_rate, **degradation)
+            filename = f"{template_name}_{i:04d}.png"
+            cv2.imwrite(os.path.join(out_dir, filename), img)
+            truth['file'] = filename
+            sheets.append(truth)
+
+    manifest = {
+        'seed': seed,
+        'dpi': dpi,
+        'blank_rate': blank_rate,
+        'degradation': degradation,
+        'sheets': sheets,
+    }
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--template', action='append', choices=sorted(TEMPLATE_QUESTIONS),
+                        help='layout to render (repeatable, default: all)')
+    parser.add_argument('--count', type=int, default=10, help='sheets per template')
+    parser.add_argument('--out', default='corpus', help='output directory')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dpi', type=int, default=100)
+    parser.add_argument('--blank-rate', type=float, default=0.05, help='fraction of questions left empty')
+    parser.add_argument('--noise', type=float, default=0.0, help='gaussian noise std dev (grey levels)')
+    parser.add_argument('--blur', type=int, default=0, help='blur kernel size in pixels')
+    parser.add_argument('--rotate', type=float, default=0.0, help='max rotation in degrees')
+    parser.add_argument('--gradient', type=float, default=0.0, help='lighting falloff across the page, 0-1')
+    args = parser.parse_args()
+
+    manifest = generate_corpus(
+        args.out, args.template or list(TEMPLATE_QUESTIONS), args.count, seed=args.seed, dpi=args.dpi,
+        blank_rate=args.blank_rate, noise=args.noise, blur=args.blur, rotate=args.rotate, gradient=args.gradient
+    )
+    print(f"Wrote {len(manifest['sheets'])} sheets to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Template auto-detection for mixed stacks of answer sheets.
+
+Each printed layout (see sheet_templates.json) has a distinct answer block:
+its own number of columns and rows of bubbles. A layout fingerprint is
+the darkness profile of that block, projected onto the x and y axes of a small
+straightened thumbnail. Reference fingerprints are drawn once from the layouts
+themselves and a sheet is matched to the most similar one.
+
+Sheets printed with a footer barcode (MC:<template name>) are identified from
+the barcode instead when pyzbar and the zbar library are installed.
+"""
+import functools
+
+import cv2
+import numpy as np
+
+from template_registry import BARCODE_PREFIX, printed_templates, sheet_layout
+
+try:
+    from pyzbar import pyzbar
+except (ImportError, OSError):  # the zbar shared library may be missing
+    pyzbar = None
+
+# Template value that asks the scanner to recognise the layout itself
+AUTO_TEMPLATE = 'auto'
+
+THUMB_WIDTH = 300
+PROFILE_BINS = 96
+# Page tilt tried when straightening a capture, in degrees
+DESKEW_ANGLES = np.arange(-4.0, 4.01, 0.5)
+# Profile bins a sheet may be shifted by (off-centre captures)
+MAX_SHIFT = 3
+# Answer block band, as fractions of the page height (below the header, above the footer)
+BAND_TOP = 2.0 / 11
+BAND_BOTTOM = 9.0 / 11
+# Best match must score at least this (cosine similarity) and beat the runner-up by MIN_MARGIN
+MIN_SCORE = 0.4
+MIN_MARGIN = 0.05
+
+
+def _profile(values, bins):
+    """
+    Resample a 1-D profile to a fixed length, drop its slow trend (uneven
+    lighting), smooth it and normalise it to unit length.
+    """
+    values = np.asarray(values, dtype=np.float32).reshape(1, -1)
+    resampled = cv2.resize(values, (bins, 1), interpolation=cv2.INTER_AREA)
+    detail = resampled - cv2.GaussianBlur(resampled, (0, 0), sigmaX=bins / 8, borderType=cv2.BORDER_REFLECT)
+    smoothed = cv2.GaussianBlur(detail, (5, 1), 0).ravel()
+    smoothed -= smoothed.mean()
+    norm = np.linalg.norm(smoothed)
+    return smoothed / norm if norm > 0 else smoothed
+
+
+def _deskew(thumb):
+    """
+    Straighten a thumbnail by the angle whose row profile is sharpest, the
+    classic projection-profile method. Phone captures are rarely level.
+    """
+    darkness = 255 - thumb
+    centre = (thumb.shape[1] / 2, thumb.shape[0] / 2)
+    best_angle, best_sharpness = 0.0, -1.0
+    for angle in DESKEW_ANGLES:
+        matrix = cv2.getRotationMatrix2D(centre, angle, 1.0)
+        rotated = cv2.warpAffine(darkness, matrix, (thumb.shape[1], thumb.shape[0]))
+        sharpness = float(np.var(rotated.sum(axis=1, dtype=np.float32)))
+        if sharpness > best_sharpness:
+            best_angle, best_sharpness = angle, sharpness
+    if best_angle == 0.0:
+        return thumb
+    matrix = cv2.getRotationMatrix2D(centre, best_angle, 1.0)
+    return cv2.warpAffine(thumb, matrix, (thumb.shape[1], thumb.shape[0]), borderValue=255)
+
+
+def layout_fingerprint(img):
+    """
+    Fingerprint a page image (BGR or grayscale, any size): the x and y darkness
+    profiles of the answer band of a deskewed thumbnail.
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    scale = THUMB_WIDTH / gray.shape[1]
+    thumb = cv2.resize(gray, (THUMB_WIDTH, max(1, int(gray.shape[0] * scale))), interpolation=cv2.INTER_AREA)
+    thumb = _deskew(thumb)
+    band = thumb[int(thumb.shape[0] * BAND_TOP):int(thumb.shape[0] * BAND_BOTTOM)]
+    darkness = 255.0 - band.astype(np.float32)
+    return (_profile(darkness.sum(axis=0), PROFILE_BINS),
+            _profile(darkness.sum(axis=1), PROFILE_BINS))
+
+
+def _similarity(a, b):
+    """Cosine similarity of two profiles, allowing the sheet to sit a few bins off."""
+    return max(float(np.dot(np.roll(a, shift), b)) for shift in range(-MAX_SHIFT, MAX_SHIFT + 1))
+
+
+def fingerprint_similarity(fingerprint, reference):
+    """Mean similarity of the x and y profiles, -1 to 1."""
+    return (_similarity(fingerprint[0], reference[0]) + _similarity(fingerprint[1], reference[1])) / 2
+
+
+def _draw_layout(spec):
+    """A blank sheet of the template's bubbles at thumbnail resolution."""
+    layout = sheet_layout(spec)
+    page_w, page_h = layout['page_size']
+    scale = THUMB_WIDTH / page_w
+    img = np.full((int(page_h * scale), THUMB_WIDTH), 255, np.uint8)
+    radius = max(1, int(round(layout['bubble_radius'] * scale)))
+    for _, _, x, y in layout['bubbles']:
+        cv2.circle(img, (int(round(x * scale)), int(round((page_h - y) * scale))), radius, 0, 1)
+    # Question numbers end at x
+    for _, x, y in layout['labels']:
+        cv2.rectangle(img, (int(x * scale) - 3, int((page_h - y) * scale) - 1),
+                      (int(x * scale), int((page_h - y) * scale) + 1), 0, -1)
+    return img
+
+
+@functools.lru_cache(maxsize=1)
+def reference_fingerprints():
+    """Fingerprints of every printed layout, computed once per process."""
+    return {spec.name: layout_fingerprint(_draw_layout(spec)) for spec in printed_templates()}
+
+
+def read_template_barcode(img):
+    """Template name from an MC: barcode on the sheet, or None (also when pyzbar is unavailable)."""
+    if pyzbar is None:
+        return None
+    # Barcodes sit in the footer; decoding just that strip is much faster
+    footer = img[int(img.shape[0] * 0.85):]
+    for symbol in pyzbar.decode(footer):
+        data = symbol.data.decode('ascii', errors='ignore')
+        if data.startswith(BARCODE_PREFIX):
+            return data[len(BARCODE_PREFIX):]
+    return None
+
+
+def detect_template(img, templates=None):
+    """
+    Recognise which template a page image was printed from.
+    Returns (template name or None, score), where score is 1.0 for a barcode
+    match and the fingerprint similarity otherwise.
+    """
+    name = read_template_barcode(img)
+    if name and (templates is None or name in templates):
+        return name, 1.0
+
+    fingerprint = layout_fingerprint(img)
+    scores = sorted(
+        ((fingerprint_similarity(fingerprint, reference), name)
+         for name, reference in reference_fingerprints().items()
+         if templates is None or name in templates),
+        reverse=True
+    )
+    if not scores:
+        return None, 0.0
+    best_score, best_name = scores[0]
+    runner_up = scores[1][0] if len(scores) > 1 else -1.0
+    if best_score < MIN_SCORE or best_score - runner_up < MIN_MARGIN:
+        return None, best_score
+    return best_name, best_score
@@ -0,0 +1,213 @@
+"""
+The answer sheet templates, loaded from sheet_templates.json.
+
+Every part of the app that knows what a sheet looks like reads it from here:
+create_templates.py prints the PDFs, the scanner compiles its sampling plans,
+the routes list and serve the templates, and synthetic.py and template
+detection draw them. Adding a layout (more questions, a fifth choice) is an
+entry in the JSON file.
+
+Template entries override the "defaults" section; "extends" starts from
+another template instead. Lengths are in inches, measured from the top-left
+corner of the page. Set SHEET_TEMPLATES to load a different spec file.
+"""
+import json
+import os
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping, Tuple
+
+SPEC_PATH = os.environ.get(
+    'SHEET_TEMPLATES', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sheet_templates.json'))
+
+POINTS_PER_INCH = 72
+# Footer barcodes read "MC:<template name>"
+BARCODE_PREFIX = 'MC:'
+# Keep the answer block clear of the footer barcode
+FOOTER_HEIGHT = 0.9
+
+
+@dataclass(frozen=True)
+class TemplateSpec:
+    """One answer sheet layout."""
+    name: str
+    title: str
+    identifier: str
+    label: str
+    questions: int
+    choices: Tuple[str, ...]
+    columns: int
+    rows_per_column: int
+    row_spacing: float
+    first_row: float
+    margin: float
+    bubble_offset: float
+    bubble_spacing: float
+    bubble_radius: float
+    fields: Mapping
+    page_width: float
+    page_height: float
+    printed: bool = True
+
+    @property
+    def field_boxes(self):
+        """Write-in boxes as (left, top, right, bottom) fractions of the page."""
+        return MappingProxyType({
+            name: (left / self.page_width, top / self.page_height,
+                   right / self.page_width, bottom / self.page_height)
+            for name, (left, top, right, bottom) in ((name, field['box']) for name, field in self.fields.items())
+        })
+
+    def as_dict(self):
+        """The template as the scanner's TEMPLATES entry."""
+        entry = {
+            'identifier': self.identifier,
+            'questions_per_sheet': self.questions,
+            'choices': list(self.choices),
+        }
+        if self.fields:
+            entry['fields'] = self.field_boxes
+        return entry
+
+
+def _resolve(name, entries, defaults, seen=()):
+    """Merge a template entry over its base (another template or the defaults)."""
+    entry = entries[name]
+    base_name = entry.get('extends')
+    if base_name:
+        if base_name not in entries or base_name in seen:
+            raise ValueError(f"Template {name}: cannot extend '{base_name}'")
+        base = _resolve(base_name, entries, defaults, seen + (name,))
+    else:
+        base = dict(defaults)
+    merged = dict(base)
+    merged.update({key: value for key, value in entry.items() if key != 'extends'})
+    return merged
+
+
+def _validate(spec):
+    """Reject layouts that would not print or scan: overlapping columns, rows off the page."""
+    if spec.questions > spec.columns * spec.rows_per_column:
+        raise ValueError(f"Template {spec.name}: {spec.questions} questions do not fit in "
+                         f"{spec.columns} columns of {spec.rows_per_column}")
+    column_width = (spec.page_width - 2 * spec.margin) / spec.columns
+    bubbles_width = spec.bubble_offset + (len(spec.choices) - 0.5) * spec.bubble_spacing
+    if bubbles_width > column_width:
+        raise ValueError(f"Template {spec.name}: {len(spec.choices)} choices need {bubbles_width:.2f}in "
+                         f"per column but columns are {column_width:.2f}in wide")
+    last_row = spec.first_row + (spec.rows_per_column - 1) * spec.row_spacing + spec.row_spacing / 2
+    if last_row > spec.page_height - FOOTER_HEIGHT:
+        raise ValueError(f"Template {spec.name}: {spec.rows_per_column} rows run to {last_row:.2f}in, "
+                         f"past the {spec.page_height - FOOTER_HEIGHT:.2f}in limit")
+
+
+def load_templates(path=SPEC_PATH):
+    """Read and validate a spec file. Returns {name: TemplateSpec} in file order."""
+    with open(path) as f:
+        data = json.load(f)
+    page = data.get('page', {})
+    defaults = data.get('defaults', {})
+    entries = data['templates']
+
+    registry = {}
+    for name in entries:
+        merged = _resolve(name, entries, defaults)
+        try:
+            spec = TemplateSpec(
+                name=name,
+                title=merged.get('title', name),
+                identifier=merged.get('identifier', name),
+                label=merged.get('label', name),
+                questions=int(merged['questions']),
+                choices=tuple(merged['choices']),
+                columns=int(merged['columns']),
+                rows_per_column=int(merged['rows_per_column']),
+                row_spacing=float(merged['row_spacing']),
+                first_row=float(merged['first_row']),
+                margin=float(merged['margin']),
+                bubble_offset=float(merged['bubble_offset']),
+                bubble_spacing=float(merged['bubble_spacing']),
+                bubble_radius=float(merged['bubble_radius']),
+                fields=MappingProxyType({key: MappingProxyType(dict(value))
+                                         for key, value in merged.get('fields', {}).items()}),
+                page_width=float(page.get('width', 8.5)),
+                page_height=float(page.get('height', 11.0)),
+                printed=bool(merged.get('printed', True)),
+            )
+        except KeyError as e:
+            raise ValueError(f"Template {name}: missing setting {e}") from None
+        _validate(spec)
+        registry[name] = spec
+    return registry
+
+
+TEMPLATE_REGISTRY = MappingProxyType(load_templates())
+
+
+def printed_templates():
+    """Templates we print and offer for download, in spec order."""
+    return [spec for spec in TEMPLATE_REGISTRY.values() if spec.printed]
+
+
+def template_for_questions(num_questions):
+    """The smallest printed template with room for num_questions (the largest if none has)."""
+    specs = sorted(printed_templates(), key=lambda spec: spec.questions)
+    for spec in specs:
+        if spec.questions >= num_questions:
+            return spec
+    return specs[-1]
+
+
+def sheet_layout(spec):
+    """
+    Compute the page geometry of a template, in PDF points (origin bottom-left).
+    Returns the header positions, the write-in fields, a list of
+    (question, x, y) labels (right-aligned at x) and a list of
+    (question, choice index, x, y) bubble centres.
+    """
+    inch = POINTS_PER_INCH
+    width, height = spec.page_width * inch, spec.page_height * inch
+    column_width = (spec.page_width - 2 * spec.margin) / spec.columns * inch
+
+    labels = []
+    bubbles = []
+    current_question = 1
+    for col in range(spec.columns):
+        col_x = spec.margin * inch + col * column_width
+        bubble_x = col_x + spec.bubble_offset * inch
+
+        for i in range(spec.rows_per_column):
+            if current_question > spec.questions:
+                break
+
+            y = height - (spec.first_row + i * spec.row_spacing) * inch
+            # Numbers end left of the first bubble's cell, so they never read as ink in it
+            labels.append((current_question, bubble_x - 0.6 * spec.bubble_spacing * inch, y))
+            for j in range(len(spec.choices)):
+                bubbles.append((current_question, j, bubble_x + j * spec.bubble_spacing * inch, y))
+
+            current_question += 1
+
+    fields = {}
+    for name, field in spec.fields.items():
+        left, top, right, bottom = field['box']
+        label_x, label_y = field['label_at']
+        fields[name] = {
+            'label': field['label'],
+            'label_at': (label_x * inch, height - label_y * inch),
+            'box': (left * inch, height - bottom * inch, (right - left) * inch, (bottom - top) * inch),
+        }
+
+    return {
+        'page_size': (width, height),
+        'title_y': height - 0.75 * inch,
+        'subtitle_y': height - 1.1 * inch,
+        'fields': fields,
+        'columns': spec.columns,
+        'questions_per_column': spec.rows_per_column,
+        'bubble_radius': spec.bubble_radius * inch,
+        'bubble_spacing': spec.bubble_spacing * inch,
+        'row_spacing': spec.row_spacing * inch,
+        'labels': labels,
+        'bubbles': bubbles,
+    }
@@ -0,0 +1,162 @@
+"""
+Content-addressed storage for uploaded answer sheets.
+
+Uploads are stored once per distinct content, under their SHA-256:
+
+    UPLOAD_FOLDER/objects/ab/ab12...ef.jpg
+
+Sharding by the first two hex digits keeps every directory small. The
+ResultCache table maps (content hash, template) to the ScanResult the
+upload produced, so an identical resubmission can reuse it without being
+scanned again.
+"""
+import glob
+import hashlib
+import os
+import tempfile
+import uuid
+
+from models import db, ResultCache, ScanResult, Answer
+from storage import write_transaction
+
+OBJECTS_DIR = 'objects'
+WORK_DIR = 'work'
+CHUNK_SIZE = 1024 * 1024
+
+# Extensions that name the same format
+EXTENSION_ALIASES = {'jpeg': 'jpg'}
+
+
+def object_dir(upload_folder, digest):
+    return os.path.join(upload_folder, OBJECTS_DIR, digest[:2])
+
+
+def find_object(upload_folder, digest):
+    """Return the stored path for a content hash, whatever its extension, or None."""
+    matches = glob.glob(os.path.join(object_dir(upload_folder, digest), f"{digest}.*"))
+    return matches[0] if matches else None
+
+
+def _place_object(tmp_path, digest, extension, upload_folder):
+    """Move a hashed temporary file into the store, or drop it if the content is already there."""
+    existing = find_object(upload_folder, digest)
+    if existing:
+        os.remove(tmp_path)
+        return existing
+
+    os.makedirs(object_dir(upload_folder, digest), exist_ok=True)
+    path = os.path.join(object_dir(upload_folder, digest), f"{digest}.{extension}")
+    os.replace(tmp_path, path)
+    return path
+
+
+def store_upload(source, extension, upload_folder):
+    """
+    Store an upload by content hash. source is bytes or a readable binary stream.
+    The data is hashed while it is written to a temporary file, which is
+    discarded if identical content is already stored.
+    Returns (digest, path of the stored object).
+    """
+    extension = EXTENSION_ALIASES.get(extension.lower(), extension.lower())
+    tmp_dir = os.path.join(upload_folder, OBJECTS_DIR)
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    hasher = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            if isinstance(source, (bytes, bytearray)):
+                hasher.update(source)
+                out.write(source)
+            else:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+                    out.write(chunk)
+
+        digest = hasher.hexdigest()
+        return digest, _place_object(tmp_path, digest, extension, upload_folder)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def store_file(file_path, extension, upload_folder):
+    """
+    Store a file already on disk under the upload folder (such as a finished
+    chunked upload) by content hash. The file is moved, not copied.
+    Returns (digest, path of the stored object).
+    """
+    extension = EXTENSION_ALIASES.get(extension.lower(), extension.lower())
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    digest = hasher.hexdigest()
+    return digest, _place_object(file_path, digest, extension, upload_folder)
+
+
+def work_path(upload_folder, digest):
+    """A scratch path for the resized copy the scanner works on."""
+    os.makedirs(os.path.join(upload_folder, WORK_DIR), exist_ok=True)
+    return os.path.join(upload_folder, WORK_DIR, f"{digest[:16]}_{uuid.uuid4().hex[:8]}.png")
+
+
+def find_cached_result(digest, template_name, quiz_id=None):
+    """
+    Return the ScanResult previously produced by this content and template,
+    if it still exists and was graded against the same quiz (or none).
+    """
+    entry = ResultCache.query.filter_by(content_hash=digest, template_used=template_name).first()
+    if not entry:
+        return None
+    scan_result = db.session.get(ScanResult, entry.scan_result_id)
+    if scan_result is None:
+        # The scan was deleted since; forget it
+        with write_transaction(db.session):
+            ResultCache.query.filter_by(id=entry.id).delete()
+    elif scan_result.quiz_id != quiz_id:
+        # Scored against another key; grade it again (remember_result then points here)
+        return None
+    return scan_result
+
+
+def remember_result(digest, template_name, scan_result):
+    """Record which ScanResult this content and template produced."""
+    scan_result_id = scan_result.id
+    with write_transaction(db.session):
+        entry = ResultCache.query.filter_by(content_hash=digest, template_used=template_name).first()
+        if entry:
+            entry.scan_result_id = scan_result_id
+        else:
+            db.session.add(ResultCache(content_hash=digest, template_used=template_name, scan_result_id=scan_result_id))
+
+
+def copy_scan_result(scan_result):
+    """Attach a cached outcome to a new ScanResult (new scan date, same student, quiz, score and answers)."""
+    scan_result_id = scan_result.id
+    with write_transaction(db.session):
+        scan_result = db.session.get(ScanResult, scan_result_id)
+        copy = ScanResult(
+            student_id=scan_result.student_id,
+            template_used=scan_result.template_used,
+            score=scan_result.score,
+            total_questions=scan_result.total_questions,
+            percentage=scan_result.percentage,
+            image_path=scan_result.image_path,
+            confidence=scan_result.confidence,
+            regraded_questions=scan_result.regraded_questions,
+            quiz_id=scan_result.quiz_id
+        )
+        db.session.add(copy)
+        db.session.flush()
+        for answer in scan_result.answers:
+            db.session.add(Answer(
+                scan_result_id=copy.id,
+                question_number=answer.question_number,
+                selected_answer=answer.selected_answer,
+                correct_answer=answer.correct_answer,
+                is_correct=answer.is_correct,
+                confidence=answer.confidence
+            ))
+    return copy
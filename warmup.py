@@ -0,0 +1,153 @@
+"""
+Worker warm-up, so the first sheet a worker grades is as fast as the rest.
+
+A fresh worker pays for importing OpenCV and starting tesseract, compiling
+the templates' sampling plans and detection fingerprints, and loading the
+roster and answer keys on its first scan. warm_worker() does all of that up
+front by grading a synthetic sheet of every printed template. Under gunicorn
+it runs in each worker before the worker accepts connections (see
+gunicorn.conf.py); the development server warms in a background thread.
+
+/ready answers 503 until this process is warm (200 when WARMUP is off), for
+load balancers and container health checks.
+"""
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import traceback
+
+import click
+from flask import jsonify
+
+from metrics import WARMUP_SECONDS
+
+_state = {'ready': False, 'steps': {}}
+_lock = threading.Lock()
+
+
+def is_ready(app):
+    return _state['ready'] or not app.config.get('WARMUP', True)
+
+
+def _step(name, func):
+    """Run one warm-up step, timing it. A failing step is logged and skipped."""
+    start = time.perf_counter()
+    try:
+        func()
+    except Exception as e:
+        print(f"Warm-up step {name} failed: {e}")
+        traceback.print_exc()
+    elapsed = time.perf_counter() - start
+    _state['steps'][name] = round(elapsed, 3)
+    WARMUP_SECONDS.set(elapsed, step=name)
+
+
+def warm_worker(app, get_scanner):
+    """
+    Warm this process: load the scanner, OCR and grade a synthetic sheet of
+    every printed template, and load the roster and answer keys.
+    Returns {step: seconds}. Safe to call more than once; later calls return at once.
+    """
+    with _lock:
+        if _state['ready']:
+            return dict(_state['steps'])
+        start = time.perf_counter()
+        scratch = tempfile.mkdtemp(prefix='warmup_')
+        try:
+            with app.app_context():
+                _warm(app, get_scanner, scratch)
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+        _state['ready'] = True
+        total = time.perf_counter() - start
+        print(f"Worker {os.getpid()} warm in {total:.2f}s: {_state['steps']}")
+        return dict(_state['steps'])
+
+
+def _warm(app, get_scanner, scratch):
+    scanner = None
+    sheets = {}
+
+    def load_scanner():
+        nonlocal scanner
+        scanner = get_scanner()
+
+    def render_sheets():
+        import cv2
+        from scanner import ScanOptions
+        from synthetic import random_answers, random_student, render_sheet
+        from template_registry import printed_templates
+
+        height = ScanOptions().resize_height
+        rng = random.Random(0)
+        for spec in printed_templates():
+            img = render_sheet(spec.name, random_answers(spec.questions, rng, choices=spec.choices),
+                               random_student(rng))
+            sheets[spec.name] = img
+            resized = cv2.resize(img, (int(img.shape[1] * height / img.shape[0]), height),
+                                 interpolation=cv2.INTER_AREA)
+            cv2.imwrite(os.path.join(scratch, f"{spec.name}.png"), resized)
+
+    def detect():
+        from template_detect import detect_template
+        for img in sheets.values():
+            detect_template(img, scanner.templates)
+
+    def ocr():
+        # Field OCR and the header fallback; also matches against the roster
+        name = next(iter(sheets))
+        scanner.extract_student_info_from_image(os.path.join(scratch, f"{name}.png"), name)
+
+    def grade():
+        for name in sheets:
+            path = os.path.join(scratch, f"{name}.png")
+            scanner._check_for_bubbles(path)
+            scanner._process_answer_bubbles(path, scanner.templates[name]['questions_per_sheet'], name, scratch)
+
+    def answer_keys():
+        from roster import answer_key, quiz_answer_keys, roster_index
+        roster_index()
+        quiz_answer_keys()
+        for name in sheets:
+            answer_key(scanner.templates[name]['questions_per_sheet'])
+
+    _step('scanner', load_scanner)
+    if scanner is None:
+        return
+    _step('render', render_sheets)
+    _step('detect', detect)
+    _step('ocr', ocr)
+    _step('grade', grade)
+    _step('answer_keys', answer_keys)
+
+
+def start_warmup_thread(app, get_scanner):
+    """Warm in the background (for servers without a post-fork hook). Returns the thread or None."""
+    if not app.config.get('WARMUP', True):
+        return None
+    thread = threading.Thread(target=warm_worker, args=(app, get_scanner), name='warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def init_warmup(app, get_scanner):
+    """Register /ready and the `flask warmup` command."""
+    @app.route('/ready')
+    def ready():
+        """Readiness probe: 200 once this worker is warm, 503 before."""
+        if is_ready(app):
+            return jsonify(ready=True, pid=os.getpid(), warmup=_state['steps'])
+        response = jsonify(ready=False, pid=os.getpid())
+        response.status_code = 503
+        response.headers['Retry-After'] = '2'
+        return response
+
+    @app.cli.command('warmup')
+    def warmup_command():
+        """Warm a process the way a worker is warmed and print the time per step."""
+        steps = warm_worker(app, get_scanner)
+        for name, seconds in steps.items():
+            click.echo(f"{name:12s} {seconds * 1000:8.1f} ms")